@@ -8,4 +8,5 @@ def site_variables(request):
             'STORAGE_BASE_URL': "{bucket}/{storage_root}/".format(bucket=settings.AWS_S3_BUCKET_NAME, storage_root=settings.STORAGE_ROOT),
             'STORAGE_HOST': settings.AWS_S3_ENDPOINT_URL,
             'DEBUG': settings.DEBUG,
+            'SYNC_POLL_ENABLED': settings.SYNC_POLL_ENABLED,
             'LOGGED_IN': not request.user.is_anonymous()}
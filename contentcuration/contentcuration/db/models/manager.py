@@ -2,11 +2,18 @@ import contextlib
 import logging as logger
 import time
 import uuid
+from collections import defaultdict
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db import DatabaseError
 from django.db import transaction
 from django.db.models import Manager
+from django.db.models import Max
 from django.db.models import Q
 from django.db.utils import OperationalError
+from django.utils import timezone
 from django_cte import CTEQuerySet
 from le_utils.constants import content_kinds
 from mptt.managers import TreeManager
@@ -15,6 +22,7 @@ from mptt.signals import node_moved
 from contentcuration.db.models.query import CustomTreeQuerySet
 from contentcuration.utils.tasks import increment_progress
 from contentcuration.utils.tasks import set_total
+from contentcuration.utils.tracing import record_metric
 
 
 logging = logger.getLogger(__name__)
@@ -33,6 +41,26 @@ logging = logger.getLogger(__name__)
 # topology also, so these rudimentary tests are likely insufficient
 BATCH_SIZE = 100
 
+# Attributes of a node that are copied to its copies, and synced from its source
+SOURCE_ATTRIBUTES = (
+    "content_id",
+    "kind_id",
+    "title",
+    "description",
+    "language_id",
+    "license_id",
+    "license_description",
+    "thumbnail_encoding",
+    "extra_fields",
+    "copyright_holder",
+    "author",
+    "provider",
+    "role_visibility",
+)
+
+# SQL expression for a new random hex id, in the format of our UUIDFields
+NEW_ID_SQL = "md5(random()::text || clock_timestamp()::text)"
+
 
 class CustomManager(Manager.from_queryset(CTEQuerySet)):
     """
@@ -42,8 +70,19 @@ class CustomManager(Manager.from_queryset(CTEQuerySet)):
     pass
 
 
+# Namespace for the advisory locks taken on ContentNode trees, so that they
+# don't collide with any other advisory locks keyed on small integers
+MPTT_ADVISORY_LOCK_NAMESPACE = 0x6D707474
+
+
 def log_lock_time_spent(timespent):
     logging.debug("Spent {} seconds inside an mptt lock".format(timespent))
+    record_metric("Custom/MPTT/LockTimeSpent", timespent)
+
+
+def log_lock_wait_time(timespent):
+    logging.debug("Waited {} seconds to acquire an mptt lock".format(timespent))
+    record_metric("Custom/MPTT/LockWaitTime", timespent)
 
 
 def execute_queryset_without_results(queryset):
@@ -87,19 +126,35 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         """
         start = time.time()
         with transaction.atomic():
-            # Issue a separate lock on each tree_id
-            # in a predictable order.
-            # This will mean that every process acquires locks in the same order
-            # and should help to minimize deadlocks
-            for tree_id in tree_ids:
-                execute_queryset_without_results(
-                    self.select_for_update()
-                    .order_by()
-                    .filter(tree_id=tree_id)
-                    .values(*values)
-                )
+            if settings.MPTT_ADVISORY_LOCKS:
+                self._acquire_advisory_locks(tree_ids)
+            else:
+                # Issue a separate lock on each tree_id
+                # in a predictable order.
+                # This will mean that every process acquires locks in the same order
+                # and should help to minimize deadlocks
+                for tree_id in tree_ids:
+                    execute_queryset_without_results(
+                        self.select_for_update()
+                        .order_by()
+                        .filter(tree_id=tree_id)
+                        .values(*values)
+                    )
+            acquired = time.time()
+            log_lock_wait_time(acquired - start)
             yield
-            log_lock_time_spent(time.time() - start)
+            log_lock_time_spent(time.time() - acquired)
+
+    def _acquire_advisory_locks(self, tree_ids):
+        """
+        Take a transaction level advisory lock for each tree_id, in the order given.
+        Unlike locking every row of the trees, this only makes other mptt operations
+        on the same trees wait, while edits to node metadata carry on. Rows shifted
+        by an mptt operation are still locked by its updates until the end of the transaction.
+        """
+        with connections[self.db].cursor() as cursor:
+            for tree_id in tree_ids:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [MPTT_ADVISORY_LOCK_NAMESPACE, tree_id])
 
     @contextlib.contextmanager
     def lock_mptt(self, *tree_ids):
@@ -208,7 +263,9 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         ``MPTTMeta.order_insertion_by``.  In most cases you should just
         move the node yourself by setting node.parent.
         """
-        with self.lock_mptt(node.tree_id, target.tree_id):
+        from contentcuration.node_metadata import aggregates
+
+        with aggregates.track_structure_changes([node.pk]), self.lock_mptt(node.tree_id, target.tree_id):
             # Call _mptt_refresh to ensure that the mptt fields on
             # these nodes are up to date once we have acquired a lock
             # on the associated trees. This means that the mptt data
@@ -223,29 +280,95 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             sender=node.__class__, instance=node, target=target, position=position,
         )
 
+    def get_channel_ids_by_tree_id(self, tree_ids):
+        """
+        Return the id of the channel that each of `tree_ids` belongs to, in at most one query
+        """
+        from contentcuration.models import ChannelTree
+
+        return ChannelTree.get_channel_ids(tree_ids)
+
+    def get_original_nodes(self, nodes):
+        """
+        Bulk version of ContentNode.get_original_node, returns the original node of each of `nodes` by pk.
+        Nodes whose original can't be found are their own original.
+        """
+        from contentcuration.models import Channel
+
+        nodes = list(nodes)
+        imported = [
+            node for node in nodes if node.original_channel_id and node.original_source_node_id
+        ]
+        imported_ids = {node.pk for node in imported}
+        legacy = [node for node in nodes if node.pk not in imported_ids and node.original_node_id]
+
+        originals = {node.pk: node for node in nodes}
+        originals_by_id = self.in_bulk([node.original_node_id for node in legacy])
+        for node in legacy:
+            originals[node.pk] = originals_by_id.get(node.original_node_id, node)
+
+        if imported:
+            # Nodes are looked for in the main tree of their original channel by node_id, then content_id
+            tree_ids = dict(
+                Channel.objects.filter(
+                    pk__in={node.original_channel_id for node in imported}
+                ).values_list("id", "main_tree__tree_id")
+            )
+            by_node_id = {}
+            by_content_id = {}
+            for candidate in self.filter(tree_id__in=set(tree_ids.values())).filter(
+                Q(node_id__in={node.original_source_node_id for node in imported})
+                | Q(content_id__in={node.content_id for node in imported})
+            ).order_by("tree_id", "lft"):
+                by_node_id.setdefault((candidate.tree_id, candidate.node_id), candidate)
+                by_content_id.setdefault((candidate.tree_id, candidate.content_id), candidate)
+            for node in imported:
+                tree_id = tree_ids.get(node.original_channel_id)
+                originals[node.pk] = (
+                    by_node_id.get((tree_id, node.original_source_node_id))
+                    or by_content_id.get((tree_id, node.content_id))
+                    or node
+                )
+        return originals
+
+    def get_original_ids(self, nodes):
+        """
+        Return the original_channel_id and original_source_node_id of each of `nodes` by pk.
+        Legacy nodes missing either have it filled in from their original node, as in `_clone_node`.
+        """
+        nodes = list(nodes)
+        original_ids = {
+            node.pk: (node.original_channel_id, node.original_source_node_id) for node in nodes
+        }
+        legacy = [node for node in nodes if None in original_ids[node.pk]]
+        originals = self.get_original_nodes(legacy)
+        channel_ids = self.get_channel_ids_by_tree_id(
+            original.tree_id for original in originals.values()
+        )
+        for node in legacy:
+            original = originals[node.pk]
+            original_ids[node.pk] = (
+                node.original_channel_id or channel_ids.get(original.tree_id),
+                node.original_source_node_id or original.node_id,
+            )
+        return original_ids
+
     def get_source_attributes(self, source):
         """
         These attributes will be copied when the node is copied
         and also when a copy is synced with its source
         """
-        return {
-            "content_id": source.content_id,
-            "kind_id": source.kind_id,
-            "title": source.title,
-            "description": source.description,
-            "language_id": source.language_id,
-            "license_id": source.license_id,
-            "license_description": source.license_description,
-            "thumbnail_encoding": source.thumbnail_encoding,
-            "extra_fields": source.extra_fields,
-            "copyright_holder": source.copyright_holder,
-            "author": source.author,
-            "provider": source.provider,
-            "role_visibility": source.role_visibility,
-        }
+        return {attr: getattr(source, attr) for attr in SOURCE_ATTRIBUTES}
 
     def _clone_node(
-        self, source, parent_id, source_channel_id, can_edit_source_channel, pk, mods
+        self,
+        source,
+        parent_id,
+        source_channel_id,
+        can_edit_source_channel,
+        pk,
+        mods,
+        original_ids=None,
     ):
         copy = {
             "id": pk or uuid.uuid4().hex,
@@ -273,14 +396,13 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             copy["original_channel_id"] is None
             or copy["original_source_node_id"] is None
         ):
-            original_node = source.get_original_node()
+            if original_ids is None:
+                original_ids = self.get_original_ids([source])
+            original_channel_id, original_source_node_id = original_ids[source.pk]
             if copy["original_channel_id"] is None:
-                original_channel = original_node.get_channel()
-                copy["original_channel_id"] = (
-                    original_channel.id if original_channel else None
-                )
+                copy["original_channel_id"] = original_channel_id
             if copy["original_source_node_id"] is None:
-                copy["original_source_node_id"] = original_node.node_id
+                copy["original_source_node_id"] = original_source_node_id
 
         return copy
 
@@ -294,9 +416,16 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         can_edit_source_channel,
         pk,
         mods,
+        original_ids,
     ):
         copy = self._clone_node(
-            source, parent_id, source_channel_id, can_edit_source_channel, pk, mods,
+            source,
+            parent_id,
+            source_channel_id,
+            can_edit_source_channel,
+            pk,
+            mods,
+            original_ids,
         )
 
         if source.kind_id == content_kinds.TOPIC and source.id in nodes_by_parent:
@@ -312,6 +441,7 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
                         can_edit_source_channel,
                         None,
                         None,
+                        original_ids,
                     ),
                     children,
                 )
@@ -323,10 +453,11 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         nodes_to_copy = node.get_descendants(include_self=True)
 
         if excluded_descendants:
-            excluded_descendants = self.filter(
+            excluded_ranges = nodes_to_copy.filter(
                 node_id__in=excluded_descendants.keys()
-            ).get_descendants(include_self=True)
-            nodes_to_copy = nodes_to_copy.difference(excluded_descendants)
+            ).values_list("lft", "rght")
+            for lft, rght in excluded_ranges:
+                nodes_to_copy = nodes_to_copy.exclude(lft__gte=lft, rght__lte=rght)
         return nodes_to_copy
 
     def copy_node(
@@ -547,6 +678,9 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         mods,
         can_edit_source_channel,
     ):
+        from contentcuration.node_metadata import aggregates
+        from search import search_index
+
         data = self._clone_node(
             node, None, source_channel_id, can_edit_source_channel, pk, mods,
         )
@@ -560,6 +694,10 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         self._copy_associated_objects(
             {node.id: node_copy.id}, contentnode=node,
         )
+        # The copy was added to the aggregates when it was saved, but its files were not
+        aggregates.add_file_sizes({node_copy.id: aggregates.get_file_size(node_copy.id)})
+        # Nor were its tags in its search vector
+        search_index.update_search_vectors(node_ids=[node_copy.id])
         increment_progress(1)
         return node_copy
 
@@ -574,9 +712,47 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         excluded_descendants,
         can_edit_source_channel,
     ):
-
         nodes_to_copy = self._all_nodes_to_copy(node, excluded_descendants)
 
+        # Legacy nodes without original ids have them filled in from their original nodes
+        original_ids = self.get_original_ids(
+            nodes_to_copy.filter(
+                Q(original_channel_id__isnull=True)
+                | Q(original_source_node_id__isnull=True)
+            )
+        )
+
+        if connections[self.db].vendor != "postgresql":
+            copy_method = self._deep_copy_objects
+        else:
+            copy_method = self._deep_copy_sql
+        return copy_method(
+            node,
+            target,
+            position,
+            source_channel_id,
+            pk,
+            mods,
+            nodes_to_copy,
+            can_edit_source_channel,
+            original_ids,
+        )
+
+    def _deep_copy_objects(
+        self,
+        node,
+        target,
+        position,
+        source_channel_id,
+        pk,
+        mods,
+        nodes_to_copy,
+        can_edit_source_channel,
+        original_ids,
+    ):
+        from contentcuration.node_metadata import aggregates
+        from search import search_index
+
         nodes_by_parent = {}
 
         for copy_node in nodes_to_copy:
@@ -588,13 +764,14 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
 
         data = self._recurse_to_create_tree(
             node,
-            target.id if target else None,
+            self._get_parent_id(target, position),
             source_channel_id,
             nodes_by_parent,
             source_copy_id_map,
             can_edit_source_channel,
             pk,
             mods,
+            original_ids,
         )
 
         with self.lock_mptt(target.tree_id if target else None):
@@ -608,35 +785,318 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             self.filter(pk=target.pk).update(changed=True)
 
         self._copy_associated_objects(source_copy_id_map, contentnode__in=nodes_to_copy)
+        aggregates.add_subtree(source_copy_id_map[node.id])
+        search_index.update_subtree(source_copy_id_map[node.id])
 
         increment_progress(len(nodes_to_copy))
 
         return new_nodes
 
+    def _deep_copy_sql(
+        self,
+        node,
+        target,
+        position,
+        source_channel_id,
+        pk,
+        mods,
+        nodes_to_copy,
+        can_edit_source_channel,
+        original_ids,
+    ):
+        """
+        Copy the nodes in `nodes_to_copy`, the subtree of `node`, and their files,
+        assessment items and tags with INSERT ... SELECT statements, without loading
+        them into python. The copies are numbered in a temporary table mapping each
+        source id to its copy before the tree is locked, so that only the insert of
+        the copied nodes happens while it is held.
+        """
+        from contentcuration.node_metadata import aggregates
+        from search import search_index
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        id_map = "copy_map_" + uuid.uuid4().hex
+        nodes_sql, nodes_params = (
+            nodes_to_copy.order_by()
+            .values_list("id", "parent_id", "node_id", "lft", "rght", "level")
+            .query.sql_with_params()
+        )
+
+        with connection.cursor() as cursor:
+            try:
+                # Number the copies as a contiguous subtree, in the lft order of the source:
+                # the lft of a node is 2 for each node before it, less 1 for each open ancestor,
+                # and its rght is 2 for each node up to its last descendant, less 1 for each ancestor.
+                cursor.execute(
+                    """
+                    CREATE TEMPORARY TABLE {id_map} AS
+                    SELECT nodes.id AS source_id,
+                           nodes.parent_id AS source_parent_id,
+                           nodes.lft AS source_lft,
+                           nodes.rght AS source_rght,
+                           {new_id} AS copy_id,
+                           row_number() OVER (ORDER BY nodes.lft) AS preorder,
+                           nodes.level - %s AS depth
+                    FROM ({nodes}) AS nodes (id, parent_id, node_id, lft, rght, level)
+                    """.format(id_map=id_map, new_id=NEW_ID_SQL, nodes=nodes_sql),
+                    [node.level] + list(nodes_params),
+                )
+                cursor.execute(
+                    """
+                    ALTER TABLE {id_map}
+                        ADD COLUMN lft integer,
+                        ADD COLUMN rght integer,
+                        ADD COLUMN original_channel_id varchar(32),
+                        ADD COLUMN original_source_node_id varchar(32);
+                    UPDATE {id_map} m SET
+                        lft = 2 * m.preorder - 1 - m.depth,
+                        rght = 2 * (
+                            SELECT count(*) FROM {id_map} d WHERE d.source_lft < m.source_rght
+                        ) - m.depth;
+                    """.format(id_map=id_map)
+                )
+                cursor.executemany(
+                    """
+                    UPDATE {id_map}
+                    SET original_channel_id = %s, original_source_node_id = %s
+                    WHERE source_id = %s
+                    """.format(id_map=id_map),
+                    [
+                        (original_channel_id, original_source_node_id, source_id)
+                        for source_id, (original_channel_id, original_source_node_id)
+                        in original_ids.items()
+                    ],
+                )
+                if pk:
+                    cursor.execute(
+                        "UPDATE {id_map} SET copy_id = %s WHERE source_id = %s".format(id_map=id_map),
+                        [pk, node.id],
+                    )
+                cursor.execute("SELECT count(*) FROM {id_map}".format(id_map=id_map))
+                count = cursor.fetchone()[0]
+
+                with self.lock_mptt(target.tree_id if target else None):
+                    if target:
+                        self._mptt_refresh(target)
+                    tree_id, cursor_value, level = self._make_space(target, position, 2 * count)
+                    self._copy_rows(
+                        cursor,
+                        self.model,
+                        "{id_map} m JOIN {table} s ON s.id = m.source_id "
+                        "LEFT JOIN {id_map} p ON p.source_id = s.parent_id".format(
+                            id_map=id_map, table=qn(self.model._meta.db_table)
+                        ),
+                        self._node_copy_columns(
+                            source_channel_id,
+                            can_edit_source_channel,
+                            self._get_parent_id(target, position),
+                            tree_id,
+                            cursor_value,
+                            level,
+                        ),
+                    )
+                    root_copy_id = pk or self._get_copy_id(cursor, id_map, node.id)
+                    if isinstance(mods, dict) and mods:
+                        self.filter(pk=root_copy_id).update(**mods)
+                if target:
+                    self.filter(pk=target.pk).update(changed=True)
+
+                self._copy_associated_objects_sql(cursor, id_map)
+            finally:
+                self._drop_temporary_tables(cursor, id_map)
+        aggregates.add_subtree(root_copy_id)
+        search_index.update_subtree(root_copy_id)
+
+        increment_progress(count)
+
+        return [self.get(pk=root_copy_id)]
+
+    def _get_parent_id(self, target, position):
+        if target and position in ("left", "right"):
+            return target.parent_id
+        return target.id if target else None
+
+    def _get_copy_id(self, cursor, id_map, source_id):
+        cursor.execute(
+            "SELECT copy_id FROM {id_map} WHERE source_id = %s".format(id_map=id_map),
+            [source_id],
+        )
+        return cursor.fetchone()[0]
+
+    def _node_copy_columns(
+        self, source_channel_id, can_edit_source_channel, parent_id, tree_id, cursor, level
+    ):
+        """
+        Return the SQL expressions, and their parameters, for each column of a copied node
+        in the same way as `_clone_node` and `build_tree_nodes`, with the source node as `s`,
+        its row in the id map as `m` and its parent's row in the id map as `p`
+        """
+        connection = connections[self.db]
+        now = timezone.now()
+        columns = {
+            "id": ("m.copy_id", []),
+            "node_id": (NEW_ID_SQL, []),
+            "cloned_source_id": ("s.id", []),
+            "source_channel_id": ("%s", [source_channel_id]),
+            "source_node_id": ("s.node_id", []),
+            "freeze_authoring_data": (
+                "(%s OR s.freeze_authoring_data)",
+                [not can_edit_source_channel],
+            ),
+            "changed": ("TRUE", []),
+            "published": ("FALSE", []),
+            "parent_id": ("COALESCE(p.copy_id, %s)", [parent_id]),
+            "tree_id": ("%s", [tree_id]),
+            "lft": ("m.lft + %s", [cursor - 1]),
+            "rght": ("m.rght + %s", [cursor - 1]),
+            "level": ("m.depth + %s", [level]),
+            "created": ("%s", [now]),
+            "modified": ("%s", [now]),
+        }
+        for attr in SOURCE_ATTRIBUTES + ("aggregator",):
+            columns[attr] = ("s." + connection.ops.quote_name(attr), [])
+        for attr in ("original_channel_id", "original_source_node_id"):
+            columns[attr] = ("COALESCE(s.{attr}, m.{attr})".format(attr=attr), [])
+        for field in self.model._meta.concrete_fields:
+            if field.column not in columns:
+                default = field.get_db_prep_save(field.get_default(), connection)
+                columns[field.column] = ("%s", [default])
+        return columns
+
+    def _copy_rows(self, cursor, model, from_clause, columns=None, params=None):
+        """
+        Insert a copy of each row of `model` selected by `from_clause`, where the rows are
+        aliased as `s`. `columns` maps column names to a tuple of the SQL expression, and
+        its parameters, to use instead of copying the value of the column.
+        """
+        qn = connections[self.db].ops.quote_name
+        columns = columns or {}
+        names = []
+        expressions = []
+        expression_params = []
+        for field in model._meta.concrete_fields:
+            expression, values = columns.get(field.column, ("s." + qn(field.column), []))
+            names.append(qn(field.column))
+            expressions.append(expression)
+            expression_params.extend(values)
+        cursor.execute(
+            "INSERT INTO {table} ({names}) SELECT {expressions} FROM {from_clause}".format(
+                table=qn(model._meta.db_table),
+                names=", ".join(names),
+                expressions=", ".join(expressions),
+                from_clause=from_clause,
+            ),
+            expression_params + list(params or []),
+        )
+
+    def _copy_associated_objects_sql(self, cursor, id_map):
+        """
+        The INSERT ... SELECT equivalent of `_copy_associated_objects`, for the nodes in `id_map`
+        """
+        from contentcuration.models import AssessmentItem
+        from contentcuration.models import ContentTag
+        from contentcuration.models import File
+
+        qn = connections[self.db].ops.quote_name
+        file_table = qn(File._meta.db_table)
+        assessmentitem_table = qn(AssessmentItem._meta.db_table)
+        tag_table = qn(ContentTag._meta.db_table)
+        node_tag_table = qn(self.model.tags.through._meta.db_table)
+        assessmentitem_map = id_map + "_assessmentitems"
+
+        self._copy_rows(
+            cursor,
+            File,
+            "{file} s JOIN {id_map} m ON m.source_id = s.contentnode_id".format(
+                file=file_table, id_map=id_map
+            ),
+            {"id": (NEW_ID_SQL, []), "contentnode_id": ("m.copy_id", [])},
+        )
+
+        # Assessment items have serial ids, so take them from the sequence up front
+        # so that the files of the copied items can be joined to them
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE {assessmentitem_map} AS
+            SELECT a.id AS source_id,
+                   nextval(pg_get_serial_sequence(%s, 'id')) AS copy_id
+            FROM {assessmentitem} a JOIN {id_map} m ON m.source_id = a.contentnode_id
+            """.format(
+                assessmentitem_map=assessmentitem_map,
+                assessmentitem=assessmentitem_table,
+                id_map=id_map,
+            ),
+            [AssessmentItem._meta.db_table],
+        )
+        self._copy_rows(
+            cursor,
+            AssessmentItem,
+            "{assessmentitem_map} am JOIN {assessmentitem} s ON s.id = am.source_id "
+            "JOIN {id_map} m ON m.source_id = s.contentnode_id".format(
+                assessmentitem_map=assessmentitem_map,
+                assessmentitem=assessmentitem_table,
+                id_map=id_map,
+            ),
+            {"id": ("am.copy_id", []), "contentnode_id": ("m.copy_id", [])},
+        )
+        self._copy_rows(
+            cursor,
+            File,
+            "{file} s JOIN {assessmentitem_map} am ON am.source_id = s.assessment_item_id".format(
+                file=file_table, assessmentitem_map=assessmentitem_map
+            ),
+            {"id": (NEW_ID_SQL, []), "assessment_item_id": ("am.copy_id", [])},
+        )
+
+        # Channel tags are copied as the tag of the same name with no channel,
+        # created if it doesn't exist yet
+        cursor.execute(
+            """
+            INSERT INTO {tag} (id, tag_name, channel_id)
+            SELECT {new_id}, names.tag_name, NULL FROM (
+                SELECT DISTINCT t.tag_name
+                FROM {tag} t
+                JOIN {node_tag} nt ON nt.contenttag_id = t.id
+                JOIN {id_map} m ON m.source_id = nt.contentnode_id
+                WHERE t.channel_id IS NOT NULL
+            ) names
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {tag} e WHERE e.tag_name = names.tag_name AND e.channel_id IS NULL
+            )
+            """.format(tag=tag_table, node_tag=node_tag_table, id_map=id_map, new_id=NEW_ID_SQL)
+        )
+        cursor.execute(
+            """
+            INSERT INTO {node_tag} (contentnode_id, contenttag_id)
+            SELECT DISTINCT m.copy_id, CASE WHEN t.channel_id IS NULL THEN t.id ELSE (
+                SELECT e.id FROM {tag} e
+                WHERE e.tag_name = t.tag_name AND e.channel_id IS NULL
+                ORDER BY e.id LIMIT 1
+            ) END
+            FROM {node_tag} nt
+            JOIN {id_map} m ON m.source_id = nt.contentnode_id
+            JOIN {tag} t ON t.id = nt.contenttag_id
+            """.format(tag=tag_table, node_tag=node_tag_table, id_map=id_map)
+        )
+
+    def _drop_temporary_tables(self, cursor, id_map):
+        try:
+            cursor.execute(
+                "DROP TABLE IF EXISTS {id_map}, {id_map}_assessmentitems".format(id_map=id_map)
+            )
+        except DatabaseError:
+            # The transaction has been aborted, rolling it back will drop the tables
+            pass
+
     def build_tree_nodes(self, data, target=None, position="last-child"):
         """
         vendored from:
         https://github.com/django-mptt/django-mptt/blob/fe2b9cc8cfd8f4b764d294747dba2758147712eb/mptt/managers.py#L614
         """
         opts = self.model._mptt_meta
-        if target:
-            tree_id = target.tree_id
-            if position in ("left", "right"):
-                level = getattr(target, opts.level_attr)
-                if position == "left":
-                    cursor = getattr(target, opts.left_attr)
-                else:
-                    cursor = getattr(target, opts.right_attr) + 1
-            else:
-                level = getattr(target, opts.level_attr) + 1
-                if position == "first-child":
-                    cursor = getattr(target, opts.left_attr) + 1
-                else:
-                    cursor = getattr(target, opts.right_attr)
-        else:
-            tree_id = self._get_next_tree_id()
-            cursor = 1
-            level = 0
+        size = 2 * len(list(_iterate_tree_data(data)))
+        tree_id, cursor, level = self._make_space(target, position, size)
 
         stack = []
 
@@ -656,7 +1116,335 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
 
         treeify(data, cursor=cursor, level=level)
 
-        if target:
-            self._create_space(2 * len(stack), cursor - 1, tree_id)
-
         return stack
+
+    def _make_space(self, target, position, size):
+        """
+        Make space for `size` lft and rght values at `position` relative to `target`,
+        or in a new tree if there is no target. Returns the tree_id, first free value
+        and level of the nodes to be placed there.
+        Must be called inside `lock_mptt` for the tree, with fresh values on `target`.
+        """
+        opts = self.model._mptt_meta
+        if not target:
+            return self._get_next_tree_id(), 1, 0
+        tree_id = getattr(target, opts.tree_id_attr)
+        if position in ("left", "right"):
+            level = getattr(target, opts.level_attr)
+            if position == "left":
+                cursor = getattr(target, opts.left_attr)
+            else:
+                cursor = getattr(target, opts.right_attr) + 1
+        else:
+            level = getattr(target, opts.level_attr) + 1
+            if position != "first-child":
+                # With sparse numbering, this uses the space left free at the end of the target
+                return tree_id, self.make_space_for_children(target, size), level
+            cursor = getattr(target, opts.left_attr) + 1
+        self._create_space(size, cursor - 1, tree_id)
+        return tree_id, cursor, level
+
+    def make_space_for_children(self, parent, size):
+        """
+        Make space for `size` lft and rght values at the end of the children of `parent`,
+        and return the first free value. With sparse numbering, the free values left at
+        the end of a topic are used first, so that appending to it only touches its own
+        subtree. When there aren't enough of them, the tree is shifted to fit the new
+        nodes plus a fresh gap, and the tree is queued to be respaced in the background.
+        Must be called inside `lock_mptt` for the tree, with fresh values on `parent`.
+        """
+        gap = settings.MPTT_SPARSE_GAP
+        if not gap:
+            self._create_space(size, parent.rght - 1, parent.tree_id)
+            return parent.rght
+        last_child_rght = (
+            self.filter(parent_id=parent.pk).aggregate(last=Max("rght"))["last"]
+        )
+        cursor = (last_child_rght or parent.lft) + 1
+        free = parent.rght - cursor
+        if free < size:
+            self._create_space(size - free + gap, parent.rght - 1, parent.tree_id)
+            schedule_respace_tree(parent.tree_id)
+        return cursor
+
+    def respace_tree(self, tree_id, gap=None):
+        """
+        Renumber the lft and rght values of a tree so that every topic has `gap`
+        free values after its last child, leaving the numbering of leaves dense.
+        The order and nesting of the nodes is unchanged, so only rows whose
+        values move are updated.
+        """
+        if gap is None:
+            gap = settings.MPTT_SPARSE_GAP
+        with self.lock_mptt(tree_id):
+            nodes = self.filter(tree_id=tree_id).order_by("lft").values_list(
+                "id", "parent_id", "kind_id", "lft", "rght"
+            )
+            current_values = {}
+            kinds = {}
+            children = defaultdict(list)
+            for node_id, parent_id, kind_id, lft, rght in nodes:
+                current_values[node_id] = (lft, rght)
+                kinds[node_id] = kind_id
+                children[parent_id].append(node_id)
+
+            updates = []
+            for root_id in children[None]:
+                for node_id, (lft, rght, _) in _layout_tree(root_id, children, kinds, gap).items():
+                    if current_values[node_id] != (lft, rght):
+                        updates.append((lft, rght, node_id))
+            with connections[self.db].cursor() as db_cursor:
+                db_cursor.executemany(
+                    "UPDATE {} SET lft = %s, rght = %s WHERE id = %s".format(
+                        self.model._meta.db_table
+                    ),
+                    updates,
+                )
+        return len(updates)
+
+    def _get_move_scopes(self, moves, whole_trees=False):
+        """
+        Find the subtree of each tree that a batch of moves rearranges, as the id, lft, rght
+        and level of its root. Moves within a tree only rearrange the smallest subtree holding
+        the current and new parents of the moved nodes, while moves across trees, or all moves
+        if `whole_trees` is set, rearrange the whole of both trees.
+        Must be called inside `lock_mptt` for the trees, with fresh values on the nodes.
+        """
+        bounds = {}
+        tree_ids = set()
+        for node, target, position in moves:
+            tree_ids.update((node.tree_id, target.tree_id))
+            if whole_trees or node.tree_id != target.tree_id:
+                bounds[node.tree_id] = bounds[target.tree_id] = None
+                continue
+            # The new parent is the target itself, unless the node is moved next to it
+            if position in ("left", "right"):
+                target_bounds = (target.lft - 1, target.rght + 1)
+            else:
+                target_bounds = (target.lft, target.rght)
+            tree_bounds = [(node.lft - 1, node.rght + 1), target_bounds]
+            if node.tree_id in bounds:
+                if bounds[node.tree_id] is None:
+                    continue
+                tree_bounds.append(bounds[node.tree_id])
+            bounds[node.tree_id] = (min(b[0] for b in tree_bounds), max(b[1] for b in tree_bounds))
+
+        scopes = {}
+        for tree_id in tree_ids:
+            ancestors = self.filter(tree_id=tree_id).order_by("-lft")
+            scope = None
+            if bounds.get(tree_id) is not None:
+                lft, rght = bounds[tree_id]
+                scope = ancestors.filter(lft__lte=lft, rght__gte=rght).values_list("id", "lft", "rght", "level").first()
+            # Moving a root node has no parent to hold, so look at the whole tree to report it
+            if scope is None:
+                scope = ancestors.filter(parent_id__isnull=True).values_list("id", "lft", "rght", "level").first()
+            scopes[tree_id] = scope
+        return scopes
+
+    def _plan_bulk_move(self, moves, scopes):
+        """
+        Apply a batch of moves to the structure of the subtrees in `scopes` in memory,
+        and renumber them. Returns a list with an error message, or None, for each move,
+        the valid moves, and the current and new parent, tree_id, lft, rght and level of
+        each node of the subtrees, or None for the new values if a subtree no longer fits
+        between the values of its root.
+        """
+        scope_query = Q()
+        for tree_id, (_, lft, rght, _) in scopes.items():
+            scope_query |= Q(tree_id=tree_id, lft__gte=lft, rght__lte=rght)
+        rows = self.filter(scope_query).values_list(
+            "id", "parent_id", "tree_id", "kind_id", "lft", "rght", "level"
+        )
+        current_values = {}
+        parents = {}
+        kinds = {}
+        children = defaultdict(list)
+        for node_id, parent_id, tree_id, kind_id, lft, rght, level in sorted(
+            rows, key=lambda row: (row[2], row[4])
+        ):
+            current_values[node_id] = (parent_id, tree_id, lft, rght, level)
+            kinds[node_id] = kind_id
+            if node_id == scopes[tree_id][0]:
+                # Moves only rearrange the descendants of the root of a subtree
+                parents[node_id] = None
+            else:
+                parents[node_id] = parent_id
+                children[parent_id].append(node_id)
+
+        errors = []
+        moved = []
+        for node, target, position in moves:
+            error = _move_in_tree(parents, children, node.id, target.id, position)
+            errors.append(error)
+            if error is None:
+                moved.append((node, target, position))
+
+        new_values = {}
+        for tree_id, (root_id, root_lft, root_rght, root_level) in scopes.items():
+            layout = _layout_tree(root_id, children, kinds, settings.MPTT_SPARSE_GAP)
+            is_whole_tree = current_values[root_id][0] is None
+            if not is_whole_tree and layout[root_id][1] + root_lft - 1 > root_rght:
+                return errors, moved, current_values, None
+            for node_id, (lft, rght, level) in layout.items():
+                new_values[node_id] = (
+                    parents[node_id], tree_id, lft + root_lft - 1, rght + root_lft - 1, level + root_level
+                )
+            if not is_whole_tree:
+                # The root of a subtree stays where it is, any values left free at its end become a gap
+                new_values[root_id] = current_values[root_id]
+        return errors, moved, current_values, new_values
+
+    def _bulk_move(self, moves):
+        from contentcuration.models import PrerequisiteContentRelationship
+
+        nodes = [node for move in moves for node in move[:2]]
+        with self.lock_mptt(*set(node.tree_id for node in nodes)):
+            self._mptt_refresh(*nodes)
+            errors, moved, current_values, new_values = self._plan_bulk_move(
+                moves, self._get_move_scopes(moves)
+            )
+            if new_values is None:
+                # The numbering of a subtree needs more values than it has, so renumber the whole trees
+                errors, moved, current_values, new_values = self._plan_bulk_move(
+                    moves, self._get_move_scopes(moves, whole_trees=True)
+                )
+
+            updates = [
+                values + (node_id,)
+                for node_id, values in new_values.items()
+                if current_values[node_id] != values
+            ]
+            with connections[self.db].cursor() as db_cursor:
+                db_cursor.executemany(
+                    "UPDATE {} SET parent_id = %s, tree_id = %s, lft = %s, rght = %s, level = %s "
+                    "WHERE id = %s".format(self.model._meta.db_table),
+                    updates,
+                )
+
+            # Mark the nodes that changed parent, and their old and new parents, as changed,
+            # as saving each moved node would have done
+            moved_ids = set(node.id for node, _, _ in moved)
+            reparented = set(
+                node_id for node_id in moved_ids
+                if new_values[node_id][0] != current_values[node_id][0]
+            )
+            self.filter(id__in=reparented).update(changed=True, modified=timezone.now())
+            self.filter(id__in=moved_ids - reparented).update(modified=timezone.now())
+            self.filter(
+                id__in=set(new_values[node_id][0] for node_id in reparented)
+                | set(current_values[node_id][0] for node_id in reparented)
+            ).update(changed=True)
+            # Prerequisites can't point across channels
+            moved_trees = [
+                node_id for node_id in reparented
+                if new_values[node_id][1] != current_values[node_id][1]
+            ]
+            PrerequisiteContentRelationship.objects.filter(
+                Q(prerequisite_id__in=moved_trees) | Q(target_node_id__in=moved_trees)
+            ).delete()
+
+            self._mptt_refresh(*nodes)
+            for node in set(node for node, _, _ in moved):
+                node.parent_id = new_values[node.id][0]
+        return errors, moved
+
+    def bulk_move(self, moves):
+        """
+        Move several nodes, taking the locks on all the trees involved once.
+        The moves are applied in order to the structure of the trees in memory,
+        limited to the smallest subtree of each tree that holds the parents the
+        nodes are moved from and to, and the subtrees are then renumbered together,
+        so that each row is written at most once, however many of the moves shift it.
+        `moves` is a list of (node, target, position) tuples, with the same
+        positions as move_node. Returns a list with an error message, or None,
+        for each move.
+        """
+        from contentcuration.node_metadata import aggregates
+
+        with aggregates.track_structure_changes(set(node.id for node, _, _ in moves)):
+            errors, moved = self._bulk_move(moves)
+        for node, target, position in moved:
+            node_moved.send(
+                sender=node.__class__, instance=node, target=target, position=position,
+            )
+        return errors
+
+
+def _move_in_tree(parents, children, node_id, target_id, position):
+    """
+    Move a node in an in memory tree structure, as used by bulk_move.
+    Returns an error message if the move is invalid.
+    """
+    if parents.get(node_id) is None:
+        return "Cannot move a root node"
+    if position in ("left", "right"):
+        if node_id == target_id:
+            return "Cannot move a node next to itself"
+        parent_id = parents.get(target_id)
+        if parent_id is None:
+            return "Cannot move a node next to a root node"
+    elif position in ("first-child", "last-child"):
+        parent_id = target_id
+    else:
+        return "Invalid position argument specified: {}".format(position)
+
+    ancestor_id = parent_id
+    while ancestor_id is not None:
+        if ancestor_id == node_id:
+            return "Cannot move a node into its own descendants"
+        ancestor_id = parents.get(ancestor_id)
+
+    children[parents[node_id]].remove(node_id)
+    siblings = children[parent_id]
+    if position in ("left", "right"):
+        index = siblings.index(target_id) + (1 if position == "right" else 0)
+    else:
+        index = 0 if position == "first-child" else len(siblings)
+    siblings.insert(index, node_id)
+    parents[node_id] = parent_id
+
+
+def _layout_tree(root_id, children, kinds, gap):
+    """
+    Number a tree in depth first order, leaving `gap` free values after the
+    last child of every topic. Returns a dict of node id to (lft, rght, level).
+    """
+    layout = {}
+    lefts = {}
+    cursor = 0
+    stack = [(root_id, 0, False)]
+    while stack:
+        node_id, level, closing = stack.pop()
+        if closing:
+            cursor += 1
+            if kinds[node_id] == content_kinds.TOPIC:
+                cursor += gap
+            layout[node_id] = (lefts.pop(node_id), cursor, level)
+        else:
+            cursor += 1
+            lefts[node_id] = cursor
+            stack.append((node_id, level, True))
+            stack.extend(
+                (child_id, level + 1, False) for child_id in reversed(children.get(node_id, []))
+            )
+    return layout
+
+
+def _iterate_tree_data(data):
+    yield data
+    for child in data.get("children", []):
+        for descendant in _iterate_tree_data(child):
+            yield descendant
+
+
+def schedule_respace_tree(tree_id):
+    """
+    Queue a background respace of a tree once the current transaction commits,
+    at most once per tree every MPTT_RESPACE_INTERVAL seconds.
+    """
+    if not cache.add("respace_tree_{}".format(tree_id), True, settings.MPTT_RESPACE_INTERVAL):
+        return
+    from contentcuration.tasks import respace_tree_task
+
+    transaction.on_commit(lambda: respace_tree_task.delay(tree_id))
@@ -37,6 +37,18 @@ let unsyncedPollingTimeoutId;
 // Flag to check if a sync is currently active.
 let syncActive = false;
 
+// Number of seconds the server waits for new changes before responding to a poll
+const SERVER_EVENTS_TIMEOUT = 30;
+
+// Number of seconds to wait before polling again after a failed poll
+const SERVER_EVENTS_RETRY_AFTER = 10;
+
+// Flag to check if we are listening for changes from the server
+let pollingServerEvents = false;
+
+// Stores the setTimeout for retrying a failed poll so we may clear it when we want
+let serverEventsTimeoutId;
+
 function handleFetchMessages(msg) {
   if (msg.type === MESSAGES.FETCH_COLLECTION && msg.urlName && msg.params) {
     API_RESOURCES[msg.urlName]
@@ -232,8 +244,15 @@ function syncChanges() {
             // The errors property is an array of any changes that were sent to the server,
             // that were rejected, with an additional errors property that describes
             // the error.
+            // The deferred property is an array of any changes that the server did not get to
+            // within its time budget, these are kept to be sent again on the next sync.
             const returnedChanges = get(response, ['data', 'changes'], []);
             const errors = get(response, ['data', 'errors'], []);
+            const deferred = get(response, ['data', 'deferred'], []);
+            const deferredRevs = {};
+            for (let change of deferred) {
+              deferredRevs[change.rev] = true;
+            }
             // Collect all errors into an errorMap
             const errorMap = {};
             let errorSetPromise = Promise.resolve();
@@ -253,12 +272,14 @@ function syncChanges() {
             let changesToDelete;
             if (!allErrors) {
               changesToDelete = db[CHANGES_TABLE].where('rev').belowOrEqual(changesMaxRevision);
-              if (errors.length) {
+              if (errors.length || deferred.length) {
                 // Filter changes by whether the revision for this change is in the errorMap
                 // merged changes will have been returned from the server whole, so deleting
                 // older changes will not be a problem here, as we maintain the merged
                 // representation
-                changesToDelete = changesToDelete.filter(change => !errorMap[change.rev]);
+                changesToDelete = changesToDelete.filter(
+                  change => !errorMap[change.rev] && !deferredRevs[change.rev]
+                );
               }
             }
             const deleteChangesPromise =
@@ -357,6 +378,45 @@ function stopPollingUnsyncedChanges() {
   }
 }
 
+function pollServerEvents() {
+  if (!pollingServerEvents) {
+    return Promise.resolve();
+  }
+  // The server holds the request open until there are changes for us, or the timeout passes
+  return client
+    .get(window.Urls['sync_events'](), {
+      params: { timeout: SERVER_EVENTS_TIMEOUT },
+      timeout: (SERVER_EVENTS_TIMEOUT + SERVER_EVENTS_RETRY_AFTER) * 1000,
+    })
+    .then(response => {
+      const changes = get(response, ['data', 'changes'], []);
+      return changes.length ? applyChanges(changes) : null;
+    })
+    .then(
+      () => pollServerEvents(),
+      () => {
+        if (pollingServerEvents) {
+          serverEventsTimeoutId = setTimeout(pollServerEvents, SERVER_EVENTS_RETRY_AFTER * 1000);
+        }
+      }
+    );
+}
+
+function startPollingServerEvents() {
+  // Long polls hold a server worker each, so are only made when the server allows them
+  if (window.syncPollEnabled && !pollingServerEvents) {
+    pollingServerEvents = true;
+    pollServerEvents();
+  }
+}
+
+function stopPollingServerEvents() {
+  pollingServerEvents = false;
+  if (serverEventsTimeoutId) {
+    clearTimeout(serverEventsTimeoutId);
+  }
+}
+
 export function startSyncing() {
   startChannelFetchListener();
   cleanupLocks();
@@ -365,6 +425,8 @@ export function startSyncing() {
   debouncedSyncChanges();
   // Begin polling our CHANGES_TABLE
   pollUnsyncedChanges();
+  // Listen for changes from the server, such as task results
+  startPollingServerEvents();
   db.on('changes', handleChanges);
 }
 
@@ -373,6 +435,7 @@ export function stopSyncing() {
   debouncedSyncChanges.cancel();
   // Stop pollUnsyncedChanges
   stopPollingUnsyncedChanges();
+  stopPollingServerEvents();
   // Dexie's slightly counterintuitive method for unsubscribing from events
   db.on('changes').unsubscribe(handleChanges);
 }
@@ -0,0 +1,26 @@
+import logging as logmodule
+
+from django.core.management.base import BaseCommand
+
+from contentcuration.models import Channel
+from contentcuration.utils.publish import fill_channel_facets
+
+logmodule.basicConfig()
+logging = logmodule.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Compute the catalog facets of channels from their main trees"
+
+    def add_arguments(self, parser):
+        parser.add_argument('channel_ids', nargs='*', type=str,
+                            help="Only compute the facets of these channels")
+
+    def handle(self, *args, **options):
+        channels = Channel.objects.filter(deleted=False, main_tree__isnull=False).select_related('main_tree')
+        if options['channel_ids']:
+            channels = channels.filter(pk__in=options['channel_ids'])
+
+        for channel in channels.iterator():
+            fill_channel_facets(channel)
+            logging.info("Computed the facets of channel {}".format(channel.id))
@@ -21,6 +21,12 @@ class Command(BaseCommand):
             default=False,
         )
 
+        # optional argument to map the channel with set based queries and bulk inserts
+        parser.add_argument("--bulk", action="store_true", default=False)
+
+        # optional argument to update the previously published database rather than rebuilding it
+        parser.add_argument("--incremental", action="store_true", default=False)
+
         # optional argument to send an email to the user when done with exporting channel
         parser.add_argument("--email", action="store_true", default=False)
 
@@ -31,6 +37,8 @@ class Command(BaseCommand):
         user_id = options["user_id"]
         force_exercises = options["force-exercises"]
         version_notes = options.get("version_notes")
+        bulk = options["bulk"]
+        incremental = options["incremental"]
 
         try:
             publish.publish_channel(
@@ -40,6 +48,8 @@ class Command(BaseCommand):
                 force_exercises=force_exercises,
                 send_email=send_email,
                 version_notes=version_notes,
+                bulk=bulk,
+                incremental=incremental,
             )
         except ValueError as e:
             logging.warning(
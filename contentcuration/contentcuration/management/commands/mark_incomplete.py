@@ -8,6 +8,7 @@ from le_utils.constants import exercises
 from contentcuration.models import AssessmentItem
 from contentcuration.models import ContentNode
 from contentcuration.models import File
+from contentcuration.node_metadata.aggregates import rebuild_aggregates
 
 
 class Command(BaseCommand):
@@ -45,3 +46,5 @@ class Command(BaseCommand):
 
         # Getting an error on bulk update with the annotations, so query again
         ContentNode.objects.filter(pk__in=invalid_nodes).update(complete=False)
+        # The update bypasses the aggregates of the nodes' ancestors, so rebuild them
+        rebuild_aggregates()
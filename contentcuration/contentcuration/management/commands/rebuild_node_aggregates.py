@@ -0,0 +1,31 @@
+import logging as logmodule
+
+from django.core.management.base import BaseCommand
+
+from contentcuration.models import ChannelTree
+from contentcuration.models import ContentNode
+from contentcuration.node_metadata.aggregates import rebuild_aggregates
+
+logmodule.basicConfig()
+logging = logmodule.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Recompute the aggregates of content nodes from their descendants, to repair any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('channel_ids', nargs='*', type=str,
+                            help="Only rebuild the trees of these channels")
+
+    def handle(self, *args, **options):
+        if options['channel_ids']:
+            tree_ids = ChannelTree.objects.filter(channel_id__in=options['channel_ids']).values_list(
+                'tree_id', flat=True
+            )
+        else:
+            tree_ids = ContentNode.objects.filter(parent__isnull=True).values_list('tree_id', flat=True)
+
+        # Rebuild one tree at a time, to keep each statement short
+        for tree_id in sorted(tree_ids):
+            rebuild_aggregates(tree_id)
+            logging.info("Rebuilt the aggregates of tree {}".format(tree_id))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+from django.db import transaction
+
+
+# Compute the aggregates of the nodes of a tree from their descendants, and their descendants' files
+REBUILD_SQL = """
+INSERT INTO {aggregate} (
+    contentnode_id,
+    child_count,
+    resource_count,
+    coach_count,
+    error_count,
+    new_resource_count,
+    updated_resource_count,
+    resource_size
+)
+SELECT
+    a.id,
+    count(d.id) FILTER (WHERE d.parent_id = a.id),
+    count(d.id) FILTER (WHERE d.kind_id != 'topic'),
+    count(d.id) FILTER (WHERE d.kind_id != 'topic' AND d.role_visibility = 'coach'),
+    count(d.id) FILTER (WHERE NOT d.complete),
+    count(d.id) FILTER (WHERE d.kind_id != 'topic' AND d.changed AND NOT d.published),
+    count(d.id) FILTER (WHERE d.kind_id != 'topic' AND d.changed AND d.published),
+    COALESCE(sum(sizes.size), 0)
+FROM {node} a
+LEFT JOIN {node} d ON d.tree_id = a.tree_id AND d.lft > a.lft AND d.rght < a.rght
+LEFT JOIN (
+    SELECT f.contentnode_id, sum(f.file_size) AS size
+    FROM {file} f
+    JOIN {node} n ON n.id = f.contentnode_id
+    WHERE n.tree_id = %(tree_id)s
+    GROUP BY f.contentnode_id
+) sizes ON sizes.contentnode_id = d.id
+WHERE a.tree_id = %(tree_id)s
+GROUP BY a.id
+ON CONFLICT (contentnode_id) DO NOTHING
+"""
+
+
+def rebuild_aggregates(apps, schema_editor):
+    ContentNode = apps.get_model("contentcuration", "ContentNode")
+    ContentNodeAggregate = apps.get_model("contentcuration", "ContentNodeAggregate")
+    File = apps.get_model("contentcuration", "File")
+    sql = REBUILD_SQL.format(
+        aggregate=ContentNodeAggregate._meta.db_table,
+        node=ContentNode._meta.db_table,
+        file=File._meta.db_table,
+    )
+    tree_ids = list(
+        ContentNode.objects.filter(parent__isnull=True).order_by("tree_id").values_list("tree_id", flat=True)
+    )
+    # Each tree is computed in its own transaction, so that only the rows of one tree are locked at a time
+    for tree_id in tree_ids:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(sql, params={"tree_id": tree_id})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("contentcuration", "0123_auto_20200921_1536"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentNodeAggregate",
+            fields=[
+                (
+                    "contentnode",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="aggregate",
+                        serialize=False,
+                        to="contentcuration.ContentNode",
+                    ),
+                ),
+                ("child_count", models.IntegerField(default=0)),
+                ("resource_count", models.IntegerField(default=0)),
+                ("coach_count", models.IntegerField(default=0)),
+                ("error_count", models.IntegerField(default=0)),
+                ("new_resource_count", models.IntegerField(default=0)),
+                ("updated_resource_count", models.IntegerField(default=0)),
+                ("resource_size", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(rebuild_aggregates, migrations.RunPython.noop),
+    ]
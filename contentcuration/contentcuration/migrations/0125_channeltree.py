@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+
+CHANNEL_TREES = (
+    "main_tree",
+    "chef_tree",
+    "trash_tree",
+    "staging_tree",
+    "previous_tree",
+)
+
+
+def populate_channel_trees(apps, schema_editor):
+    Channel = apps.get_model("contentcuration", "Channel")
+    ChannelTree = apps.get_model("contentcuration", "ChannelTree")
+    ContentNode = apps.get_model("contentcuration", "ContentNode")
+    # A tree in more than one field of a channel is recorded under the first of them
+    for tree_name in CHANNEL_TREES:
+        schema_editor.execute(
+            "INSERT INTO {channel_tree} (tree_id, channel_id, tree_name) "
+            "SELECT n.tree_id, c.id, %s FROM {channel} c "
+            "JOIN {node} n ON n.id = c.{tree_name}_id "
+            "ON CONFLICT (tree_id) DO NOTHING".format(
+                channel_tree=ChannelTree._meta.db_table,
+                channel=Channel._meta.db_table,
+                node=ContentNode._meta.db_table,
+                tree_name=tree_name,
+            ),
+            params=[tree_name],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contentcuration", "0124_contentnodeaggregate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChannelTree",
+            fields=[
+                ("tree_id", models.IntegerField(primary_key=True, serialize=False)),
+                (
+                    "tree_name",
+                    models.CharField(
+                        choices=[
+                            ("main_tree", "main_tree"),
+                            ("chef_tree", "chef_tree"),
+                            ("trash_tree", "trash_tree"),
+                            ("staging_tree", "staging_tree"),
+                            ("previous_tree", "previous_tree"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "channel",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trees",
+                        to="contentcuration.Channel",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(populate_channel_trees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+from django.db import transaction
+
+# Compute the facets of a channel from the nodes of its main tree that are published: complete
+# nodes without an incomplete ancestor, leaving out topics without resources
+FILL_SQL = """
+WITH published AS (
+    SELECT n.id, n.kind_id, n.license_id, n.role_visibility
+    FROM {channel} c
+    JOIN {node} t ON t.id = c.main_tree_id
+    JOIN {node} n ON n.tree_id = t.tree_id
+    WHERE c.id = %(channel_id)s
+    AND n.complete
+    AND NOT EXISTS(
+        SELECT 1 FROM {node} a
+        WHERE a.tree_id = n.tree_id AND a.lft < n.lft AND a.rght > n.rght AND NOT a.complete
+    )
+    AND (n.kind_id != 'topic' OR EXISTS(
+        SELECT 1 FROM {node} d
+        WHERE d.tree_id = n.tree_id AND d.lft > n.lft AND d.rght < n.rght AND d.kind_id != 'topic'
+    ))
+)
+INSERT INTO {facets} (channel_id, kinds, licenses, has_coach_content, has_exercises, has_subtitles)
+SELECT
+    %(channel_id)s,
+    ARRAY(SELECT DISTINCT kind_id FROM published WHERE kind_id IS NOT NULL ORDER BY 1),
+    ARRAY(SELECT DISTINCT license_id FROM published WHERE license_id IS NOT NULL ORDER BY 1),
+    EXISTS(SELECT 1 FROM published WHERE role_visibility = 'coach'),
+    EXISTS(SELECT 1 FROM published WHERE kind_id = 'exercise'),
+    EXISTS(
+        SELECT 1 FROM {file} f
+        JOIN published n ON n.id = f.contentnode_id
+        JOIN {preset} p ON p.id = f.preset_id
+        WHERE p.subtitle
+    )
+ON CONFLICT (channel_id) DO NOTHING
+"""
+
+
+def fill_channel_facets(apps, schema_editor):
+    Channel = apps.get_model("contentcuration", "Channel")
+    ChannelFacets = apps.get_model("contentcuration", "ChannelFacets")
+    ContentNode = apps.get_model("contentcuration", "ContentNode")
+    File = apps.get_model("contentcuration", "File")
+    FormatPreset = apps.get_model("contentcuration", "FormatPreset")
+    sql = FILL_SQL.format(
+        facets=ChannelFacets._meta.db_table,
+        channel=Channel._meta.db_table,
+        node=ContentNode._meta.db_table,
+        file=File._meta.db_table,
+        preset=FormatPreset._meta.db_table,
+    )
+    channel_ids = list(
+        Channel.objects.filter(deleted=False, main_tree__isnull=False).values_list("id", flat=True)
+    )
+    # Each channel is computed in its own transaction, so that only the rows of one tree are locked at a time
+    for channel_id in channel_ids:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(sql, params={"channel_id": channel_id})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("contentcuration", "0125_channeltree"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChannelFacets",
+            fields=[
+                (
+                    "channel",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="facets",
+                        serialize=False,
+                        to="contentcuration.Channel",
+                    ),
+                ),
+                (
+                    "kinds",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=200), default=list, size=None
+                    ),
+                ),
+                (
+                    "licenses",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(), default=list, size=None
+                    ),
+                ),
+                ("has_coach_content", models.BooleanField(default=False)),
+                ("has_exercises", models.BooleanField(default=False)),
+                ("has_subtitles", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="channelfacets",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["kinds"], name="channel_facets_kinds_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="channelfacets",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["licenses"], name="channel_facets_licenses_idx"
+            ),
+        ),
+        migrations.RunPython(fill_channel_facets, migrations.RunPython.noop),
+    ]
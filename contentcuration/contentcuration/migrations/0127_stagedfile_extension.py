@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contentcuration", "0126_channelfacets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stagedfile",
+            name="extension",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
@@ -4,6 +4,7 @@ from builtins import zip
 from builtins import filter
 from builtins import str
 from builtins import range
+import contextlib
 import functools
 import hashlib
 import json
@@ -18,10 +19,10 @@ from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.cache import cache
-from django.core.exceptions import MultipleObjectsReturned
-from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import PermissionDenied
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
@@ -30,6 +31,7 @@ from django.core.mail import send_mail
 from django.db import connection
 from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
 from django.db.models import Count
 from django.db.models import Exists
 from django.db.models import Max
@@ -42,7 +44,6 @@ from django.db.models.query_utils import DeferredAttribute
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext as _
-from django_cte import With
 from model_utils import FieldTracker
 from le_utils import proquint
 from le_utils.constants import content_kinds
@@ -56,9 +57,6 @@ from mptt.models import raise_if_unsaved
 from mptt.models import TreeForeignKey
 from rest_framework.authtoken.models import Token
 
-from contentcuration.db.models.expressions import Array
-from contentcuration.db.models.functions import Unnest
-from contentcuration.db.models.functions import ArrayRemove
 from contentcuration.db.models.manager import CustomManager
 from contentcuration.db.models.manager import CustomContentNodeTreeManager
 from contentcuration.statistics import record_channel_stats
@@ -659,29 +657,47 @@ def boolean_val(val):
     return Value(val, output_field=models.BooleanField())
 
 
-class PermissionCTE(With):
-    tree_id_fields = [
-        "channel__{}__tree_id".format(tree_name)
-        for tree_name in CHANNEL_TREES
-    ]
+# The ids of the trees that each user can edit or view are cached, and invalidated whenever
+# the editors or viewers of a channel, or its trees, change. The timeout limits how long
+# any change that bypasses this could go unnoticed.
+TREE_PERMISSIONS_CACHE_TIMEOUT = 60 * 60
 
-    def __init__(self, model, user_id, **kwargs):
-        queryset = model.objects.filter(user_id=user_id)\
-            .annotate(
-                tree_id=Unnest(ArrayRemove(Array(*self.tree_id_fields), None), output_field=models.IntegerField())
-            )
-        super(PermissionCTE, self).__init__(queryset=queryset.values("user_id", "channel_id", "tree_id"), **kwargs)
 
-    @classmethod
-    def editable_channels(cls, user_id):
-        return PermissionCTE(User.editable_channels.through, user_id, name="editable_channels_cte")
+def _tree_permissions_cache_key(user_id):
+    return "tree_permissions_{}".format(user_id)
 
-    @classmethod
-    def view_only_channels(cls, user_id):
-        return PermissionCTE(User.view_only_channels.through, user_id, name="view_only_channels_cte")
 
-    def exists(self, *filters):
-        return Exists(self.queryset().filter(*filters).values("user_id"))
+def get_user_tree_ids(user_id):
+    """
+    Return a dict of the ids of the trees of the channels that a user is an editor of, under "edit",
+    and of those they are a viewer of, under "view"
+    """
+    cache_key = _tree_permissions_cache_key(user_id)
+    tree_ids = cache.get(cache_key)
+    if tree_ids is None:
+        tree_ids = {
+            "edit": set(ChannelTree.objects.filter(channel__editors=user_id).values_list("tree_id", flat=True)),
+            "view": set(ChannelTree.objects.filter(channel__viewers=user_id).values_list("tree_id", flat=True)),
+        }
+        cache.set(cache_key, tree_ids, TREE_PERMISSIONS_CACHE_TIMEOUT)
+    return tree_ids
+
+
+def invalidate_user_tree_ids(user_ids):
+    """
+    Invalidate the cached tree ids of users, both now and once the current transaction commits,
+    as any request that runs before then still reads, and caches, the tree ids from before the change
+    """
+    cache_keys = [_tree_permissions_cache_key(user_id) for user_id in set(user_ids)]
+    cache.delete_many(cache_keys)
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def public_tree_ids():
+    """
+    Subquery for the ids of the main trees of public channels
+    """
+    return ChannelTree.objects.filter(tree_name="main_tree", channel__public=True).values("tree_id")
 
 
 class Channel(models.Model):
@@ -765,6 +781,10 @@ class Channel(models.Model):
         "deleted",
         "public",
         "main_tree_id",
+        "chef_tree_id",
+        "trash_tree_id",
+        "staging_tree_id",
+        "previous_tree_id",
         "version",
     ])
 
@@ -863,6 +883,10 @@ class Channel(models.Model):
         blacklist = set([
             "public",
             "main_tree_id",
+            "chef_tree_id",
+            "trash_tree_id",
+            "staging_tree_id",
+            "previous_tree_id",
             "version",
         ])
 
@@ -892,6 +916,13 @@ class Channel(models.Model):
             delete_public_channel_cache_keys()
 
     def save(self, *args, **kwargs):
+        from search import content_locations
+
+        original_values = self._field_updates.changed()
+        trees_changed = self._state.adding or any(
+            "{}_id".format(tree_name) in original_values for tree_name in CHANNEL_TREES
+        )
+        locations_changed = not self._state.adding and "main_tree_id" in original_values
         if self._state.adding:
             self.on_create()
         else:
@@ -899,6 +930,14 @@ class Channel(models.Model):
 
         super(Channel, self).save(*args, **kwargs)
 
+        if trees_changed:
+            ChannelTree.update_channel_trees(self)
+        if locations_changed:
+            old_main_tree_id = original_values.get("main_tree_id")
+            content_locations.refresh_channel(
+                self, None if old_main_tree_id is DeferredAttribute else old_main_tree_id
+            )
+
     def get_thumbnail(self):
         return get_channel_thumbnail(self)
 
@@ -973,6 +1012,113 @@ class Channel(models.Model):
         ]
 
 
+# Number of seconds the channel of each tree is cached for
+CHANNEL_TREE_CACHE_TIMEOUT = 60 * 60
+
+
+def _channel_tree_cache_key(tree_id):
+    return "channel_tree_{}".format(tree_id)
+
+
+class ChannelTree(models.Model):
+    """
+    The channel, and the field of the channel, that each tree in CHANNEL_TREES belongs to,
+    kept up to date by Channel.save. This allows the channel of a node to be found from its
+    tree_id with an index lookup, rather than by checking each of the tree fields of Channel.
+    """
+    tree_id = models.IntegerField(primary_key=True)
+    channel = models.ForeignKey(Channel, related_name="trees", on_delete=models.CASCADE)
+    tree_name = models.CharField(max_length=20, choices=[(tree_name, tree_name) for tree_name in CHANNEL_TREES])
+
+    @classmethod
+    def update_channel_trees(cls, channel):
+        """
+        Record the current trees of `channel`, if a tree is in more than one field,
+        under the first of them in CHANNEL_TREES
+        """
+        tree_names = {}
+        for tree_name in reversed(CHANNEL_TREES):
+            root_id = getattr(channel, "{}_id".format(tree_name))
+            if root_id:
+                tree_names[root_id] = tree_name
+        trees = {
+            tree_id: tree_names[root_id]
+            for root_id, tree_id in ContentNode.objects.filter(pk__in=tree_names).values_list("id", "tree_id")
+        }
+        removed_trees = cls.objects.filter(channel=channel).exclude(tree_id__in=trees)
+        cache_keys = [
+            _channel_tree_cache_key(tree_id)
+            for tree_id in set(trees).union(removed_trees.values_list("tree_id", flat=True))
+        ]
+        removed_trees.delete()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO {} (tree_id, channel_id, tree_name) VALUES (%s, %s, %s) "
+                "ON CONFLICT (tree_id) DO UPDATE "
+                "SET channel_id = EXCLUDED.channel_id, tree_name = EXCLUDED.tree_name".format(cls._meta.db_table),
+                [(tree_id, channel.id, tree_name) for tree_id, tree_name in trees.items()],
+            )
+        # As with the tree ids of users, requests that run before the transaction commits
+        # still read, and cache, the channels from before the change
+        cache.delete_many(cache_keys)
+        transaction.on_commit(lambda: cache.delete_many(cache_keys))
+        invalidate_user_tree_ids(
+            list(channel.editors.values_list("id", flat=True))
+            + list(channel.viewers.values_list("id", flat=True))
+        )
+
+    @classmethod
+    def get_channel_ids(cls, tree_ids):
+        """
+        Return the id of the channel of each of `tree_ids` that belongs to a channel.
+        The ids are cached until update_channel_trees changes the channel of the tree.
+        """
+        tree_ids = set(tree_ids)
+        cached = cache.get_many([_channel_tree_cache_key(tree_id) for tree_id in tree_ids])
+        channel_ids = {}
+        missing_tree_ids = set()
+        for tree_id in tree_ids:
+            channel_id = cached.get(_channel_tree_cache_key(tree_id))
+            if channel_id is None:
+                missing_tree_ids.add(tree_id)
+            else:
+                channel_ids[tree_id] = channel_id
+        if missing_tree_ids:
+            found = dict(
+                cls.objects.filter(tree_id__in=missing_tree_ids).values_list("tree_id", "channel_id")
+            )
+            cache.set_many(
+                {_channel_tree_cache_key(tree_id): channel_id for tree_id, channel_id in found.items()},
+                CHANNEL_TREE_CACHE_TIMEOUT,
+            )
+            channel_ids.update(found)
+        return channel_ids
+
+
+CHANNEL_FACETS_KINDS_INDEX_NAME = "channel_facets_kinds_idx"
+CHANNEL_FACETS_LICENSES_INDEX_NAME = "channel_facets_licenses_idx"
+
+
+class ChannelFacets(models.Model):
+    """
+    What the main tree of a channel contains, for filtering the catalog without scanning it.
+    Recomputed from the published tree each time the channel is published, so lists of
+    channels that are edited, rather than published, filter on their main trees instead.
+    """
+    channel = models.OneToOneField(Channel, primary_key=True, related_name="facets", on_delete=models.CASCADE)
+    kinds = ArrayField(models.CharField(max_length=200), default=list)
+    licenses = ArrayField(models.IntegerField(), default=list)
+    has_coach_content = models.BooleanField(default=False)
+    has_exercises = models.BooleanField(default=False)
+    has_subtitles = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["kinds"], name=CHANNEL_FACETS_KINDS_INDEX_NAME),
+            GinIndex(fields=["licenses"], name=CHANNEL_FACETS_LICENSES_INDEX_NAME),
+        ]
+
+
 class ChannelSet(models.Model):
     # NOTE: this is referred to as "channel collections" on the front-end, but we need to call it
     # something else as there is already a ChannelCollection model on the front-end
@@ -1158,16 +1304,14 @@ class ContentNode(MPTTModel, models.Model):
     # when we check for changes
     _field_updates = FieldTracker()
 
-    _permission_filter = Q(tree_id=OuterRef("tree_id"))
-
     @classmethod
     def _annotate_channel_id(cls, queryset):
-        # Annotate channel id
+        # Annotate the id of the channel of nodes in main trees
         return queryset.annotate(
             channel_id=Subquery(
-                Channel.objects.filter(
-                    main_tree__tree_id=OuterRef("tree_id")
-                ).values_list("id", flat=True)[:1]
+                ChannelTree.objects.filter(
+                    tree_id=OuterRef("tree_id"), tree_name="main_tree"
+                ).values_list("channel_id", flat=True)[:1]
             )
         )
 
@@ -1186,39 +1330,25 @@ class ContentNode(MPTTModel, models.Model):
         if not user_id:
             return queryset.none()
 
-        edit_cte = PermissionCTE.editable_channels(user_id)
-
-        return queryset.with_cte(edit_cte).annotate(
-            edit=edit_cte.exists(cls._permission_filter),
-        ).filter(Q(edit=True) | Q(tree_id=cls._orphan_tree_id_subquery()))
+        return queryset.filter(
+            Q(tree_id__in=get_user_tree_ids(user_id)["edit"])
+            | Q(tree_id=cls._orphan_tree_id_subquery())
+        )
 
     @classmethod
     def filter_view_queryset(cls, queryset, user):
         user_id = not user.is_anonymous() and user.id
 
-        queryset = queryset.annotate(
-            public=Exists(
-                Channel.objects.filter(
-                    public=True, main_tree__tree_id=OuterRef("tree_id")
-                ).values("pk")
-            ),
-        ).exclude(pk=settings.ORPHANAGE_ROOT_ID)
+        queryset = queryset.exclude(pk=settings.ORPHANAGE_ROOT_ID)
 
         if not user_id:
-            return queryset.annotate(edit=boolean_val(False), view=boolean_val(False)).filter(public=True)
-
-        edit_cte = PermissionCTE.editable_channels(user_id)
-        view_cte = PermissionCTE.view_only_channels(user_id)
+            return queryset.filter(tree_id__in=public_tree_ids())
 
-        queryset = queryset.with_cte(edit_cte).with_cte(view_cte).annotate(
-            edit=edit_cte.exists(cls._permission_filter),
-            view=view_cte.exists(cls._permission_filter),
-        )
+        tree_ids = get_user_tree_ids(user_id)
 
         return queryset.filter(
-            Q(view=True)
-            | Q(edit=True)
-            | Q(public=True)
+            Q(tree_id__in=tree_ids["edit"] | tree_ids["view"])
+            | Q(tree_id__in=public_tree_ids())
             | Q(tree_id=cls._orphan_tree_id_subquery())
         )
 
@@ -1240,6 +1370,15 @@ class ContentNode(MPTTModel, models.Model):
             parent=None,
         )
 
+    def get_descendant_count(self):
+        # With sparse numbering, topics have free lft and rght values in them,
+        # so their descendants have to be counted
+        if settings.MPTT_SPARSE_GAP and self.rght is not None and self.rght - self.lft > 1:
+            return ContentNode.objects.filter(
+                tree_id=self.tree_id, lft__gt=self.lft, rght__lt=self.rght
+            ).count()
+        return super(ContentNode, self).get_descendant_count()
+
     def get_tree_data(self, levels=float('inf')):
         """
         Returns `levels`-deep tree information starting at current node.
@@ -1317,19 +1456,18 @@ class ContentNode(MPTTModel, models.Model):
     def get_channel_id(self):
         if hasattr(self, "channel_id"):
             return self.channel_id
-        channel = self.get_channel()
-        if channel:
-            return channel.id
-        return None
+        return self._get_tree_channel_id()
 
     def get_channel(self):
-        try:
-            root = self.get_root()
-            if not root:
-                return None
-            return Channel.objects.filter(Q(main_tree=root) | Q(chef_tree=root) | Q(trash_tree=root) | Q(staging_tree=root) | Q(previous_tree=root)).first()
-        except (ObjectDoesNotExist, MultipleObjectsReturned, AttributeError):
+        channel_id = self._get_tree_channel_id()
+        if not channel_id:
             return None
+        return Channel.objects.filter(pk=channel_id).first()
+
+    def _get_tree_channel_id(self):
+        if self.tree_id is None:
+            return None
+        return ChannelTree.get_channel_ids([self.tree_id]).get(self.tree_id)
 
     def get_thumbnail(self):
         # Problems with json.loads, so use ast.literal_eval to get dict
@@ -1401,6 +1539,13 @@ class ContentNode(MPTTModel, models.Model):
             .annotate(count=Count("original_channel_id")) \
             .order_by("original_channel_id")
         originals = {c['original_channel_id']: c['count'] for c in originals}
+        # Legacy nodes imported without an original_channel_id are counted under the channel of their original node
+        legacy_resources = resources.filter(original_channel_id__isnull=True, original_node__isnull=False) \
+            .select_related(None).prefetch_related(None) \
+            .only('id', 'node_id', 'content_id', 'original_node_id', 'original_channel_id', 'original_source_node_id')
+        for original_channel_id, _source_node_id in ContentNode.objects.get_original_ids(legacy_resources).values():
+            if original_channel_id:
+                originals[original_channel_id] = originals.get(original_channel_id, 0) + 1
         original_channels = Channel.objects.exclude(pk=channel_id) \
             .filter(pk__in=[k for k, v in list(originals.items())], deleted=False)
         original_channels = [{
@@ -1483,6 +1628,8 @@ class ContentNode(MPTTModel, models.Model):
         self.changed = self.changed or self.has_changes()
 
     def save(self, skip_lock=False, *args, **kwargs):
+        from search import search_index
+
         if self._state.adding:
             self.on_create()
         else:
@@ -1512,34 +1659,65 @@ class ContentNode(MPTTModel, models.Model):
         else:
             changed_ids = []
 
-        if not same_order and not skip_lock:
-            # Lock the mptt fields for the trees of the old and new parent
-            with ContentNode.objects.lock_mptt(*ContentNode.objects
-                                               .filter(id__in=[pid for pid in [old_parent_id, self.parent_id] if pid])
-                                               .values_list('tree_id', flat=True).distinct()):
+        update_search_vector = self._state.adding or bool(
+            set(self._field_updates.changed()).intersection(search_index.SEARCH_FIELDS)
+        )
+
+        with self._track_aggregates(same_order, skip_lock):
+            if not same_order and not skip_lock:
+                # Lock the mptt fields for the trees of the old and new parent
+                with ContentNode.objects.lock_mptt(*ContentNode.objects
+                                                   .filter(id__in=[pid for pid in [old_parent_id, self.parent_id] if pid])
+                                                   .values_list('tree_id', flat=True).distinct()):
+                    super(ContentNode, self).save(*args, **kwargs)
+                    # Always write to the database for the parent change updates, as we have
+                    # no persistent object references for the original and new parent to modify
+                    if changed_ids:
+                        ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
+            else:
                 super(ContentNode, self).save(*args, **kwargs)
                 # Always write to the database for the parent change updates, as we have
                 # no persistent object references for the original and new parent to modify
                 if changed_ids:
                     ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
-        else:
-            super(ContentNode, self).save(*args, **kwargs)
-            # Always write to the database for the parent change updates, as we have
-            # no persistent object references for the original and new parent to modify
-            if changed_ids:
-                ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
+
+        if update_search_vector:
+            search_index.update_search_vectors(node_ids=[self.pk])
 
     # Copied from MPTT
     save.alters_data = True
 
+    @contextlib.contextmanager
+    def _track_aggregates(self, same_order, skip_lock):
+        """
+        Keep the aggregates of this node's ancestors up to date with the save inside the block.
+        Moves made with skip_lock are made by the tree manager, which updates the aggregates itself.
+        """
+        from contentcuration.node_metadata import aggregates
+
+        if self._state.adding:
+            yield
+            aggregates.add_node(self)
+        elif not same_order and not skip_lock:
+            with aggregates.track_structure_changes([self.pk]):
+                yield
+        elif same_order and set(self._field_updates.changed()).intersection(aggregates.COUNTED_FIELDS):
+            with aggregates.track_changes([self.pk]):
+                yield
+        else:
+            yield
+
     def delete(self, *args, **kwargs):
+        from contentcuration.node_metadata import aggregates
+
         parent = self.parent or self._field_updates.changed().get('parent')
         if parent:
             parent.changed = True
             parent.save()
-        # Lock the mptt fields for the tree of this node
-        with ContentNode.objects.lock_mptt(self.tree_id):
-            return super(ContentNode, self).delete(*args, **kwargs)
+        with aggregates.track_structure_changes([self.pk]):
+            # Lock the mptt fields for the tree of this node
+            with ContentNode.objects.lock_mptt(self.tree_id):
+                return super(ContentNode, self).delete(*args, **kwargs)
 
     # Copied from MPTT
     delete.alters_data = True
@@ -1570,6 +1748,26 @@ class ContentNode(MPTTModel, models.Model):
         ]
 
 
+class ContentNodeAggregate(models.Model):
+    """
+    Counts over the descendants of a node, kept up to date as the tree is edited,
+    so that they don't have to be computed every time the node is read.
+    See contentcuration.node_metadata.aggregates for how they are maintained.
+    """
+    contentnode = models.OneToOneField(ContentNode, primary_key=True, related_name="aggregate", on_delete=models.CASCADE)
+    child_count = models.IntegerField(default=0)
+    resource_count = models.IntegerField(default=0)
+    coach_count = models.IntegerField(default=0)
+    # Number of descendants that are not complete
+    error_count = models.IntegerField(default=0)
+    # Number of changed descendant resources that have never been published
+    new_resource_count = models.IntegerField(default=0)
+    # Number of changed descendant resources that have been published
+    updated_resource_count = models.IntegerField(default=0)
+    # Total size of the files of the descendants
+    resource_size = models.BigIntegerField(default=0)
+
+
 class ContentKind(models.Model):
     kind = models.CharField(primary_key=True, max_length=200, choices=content_kinds.choices)
 
@@ -1675,8 +1873,6 @@ class AssessmentItem(models.Model):
             models.Index(fields=["assessment_id"], name=ASSESSMENT_ID_INDEX_NAME),
         ]
 
-    _permission_filter = Q(tree_id=OuterRef("contentnode__tree_id"))
-
     @classmethod
     def filter_edit_queryset(cls, queryset, user):
         user_id = not user.is_anonymous() and user.id
@@ -1684,37 +1880,22 @@ class AssessmentItem(models.Model):
         if not user_id:
             return queryset.none()
 
-        edit_cte = PermissionCTE.editable_channels(user_id)
-
-        return queryset.with_cte(edit_cte).annotate(
-            edit=edit_cte.exists(cls._permission_filter),
-        ).filter(edit=True)
+        return queryset.filter(contentnode__tree_id__in=get_user_tree_ids(user_id)["edit"])
 
     @classmethod
     def filter_view_queryset(cls, queryset, user):
         user_id = not user.is_anonymous() and user.id
 
-        queryset = queryset.annotate(
-            public=Exists(
-                Channel.objects.filter(
-                    public=True, main_tree__tree_id=OuterRef("contentnode__tree_id")
-                ).values("pk")
-            ),
-        )
-
         if not user_id:
-            return queryset.annotate(edit=boolean_val(False), view=boolean_val(False)).filter(public=True)
+            return queryset.filter(contentnode__tree_id__in=public_tree_ids())
 
-        edit_cte = PermissionCTE.editable_channels(user_id)
-        view_cte = PermissionCTE.view_only_channels(user_id)
+        tree_ids = get_user_tree_ids(user_id)
 
-        queryset = queryset.with_cte(edit_cte).with_cte(view_cte).annotate(
-            edit=edit_cte.exists(cls._permission_filter),
-            view=view_cte.exists(cls._permission_filter),
+        return queryset.filter(
+            Q(contentnode__tree_id__in=tree_ids["edit"] | tree_ids["view"])
+            | Q(contentnode__tree_id__in=public_tree_ids())
         )
 
-        return queryset.filter(Q(view=True) | Q(edit=True) | Q(public=True))
-
 
 class SlideshowSlide(models.Model):
     contentnode = models.ForeignKey('ContentNode', related_name="slideshow_slides", blank=True, null=True,
@@ -1728,6 +1909,8 @@ class StagedFile(models.Model):
     Keeps track of files uploaded through Ricecooker to avoid user going over disk quota limit
     """
     checksum = models.CharField(max_length=400, blank=True, db_index=True)
+    # Extension of the file in storage, blank for files staged before it was recorded
+    extension = models.CharField(max_length=40, blank=True)
     file_size = models.IntegerField(blank=True, null=True)
     uploaded_by = models.ForeignKey(User, related_name='staged_files', blank=True, null=True)
 
@@ -1756,8 +1939,12 @@ class File(models.Model):
     uploaded_by = models.ForeignKey(User, related_name='files', blank=True, null=True)
 
     objects = CustomManager()
+    # Track the fields that the aggregates of the node's ancestors depend on
+    _field_updates = FieldTracker(fields=["contentnode_id", "file_size"])
 
-    _permission_filter = Q(tree_id=OuterRef("contentnode__tree_id")) | Q(tree_id=OuterRef("assessment_item__contentnode__tree_id"))
+    @classmethod
+    def _tree_filter(cls, tree_ids):
+        return Q(contentnode__tree_id__in=tree_ids) | Q(assessment_item__contentnode__tree_id__in=tree_ids)
 
     @classmethod
     def filter_edit_queryset(cls, queryset, user):
@@ -1766,39 +1953,23 @@ class File(models.Model):
         if not user_id:
             return queryset.none()
 
-        cte = PermissionCTE.editable_channels(user_id)
-        return queryset.with_cte(cte).annotate(edit=cte.exists(cls._permission_filter)).filter(
-            Q(edit=True) | Q(uploaded_by=user, contentnode__isnull=True, assessment_item__isnull=True)
+        return queryset.filter(
+            cls._tree_filter(get_user_tree_ids(user_id)["edit"])
+            | Q(uploaded_by=user, contentnode__isnull=True, assessment_item__isnull=True)
         )
 
     @classmethod
     def filter_view_queryset(cls, queryset, user):
         user_id = not user.is_anonymous() and user.id
 
-        queryset = queryset.annotate(
-            public=Exists(
-                Channel.objects.filter(public=True).filter(
-                    Q(main_tree__tree_id=OuterRef("contentnode__tree_id"))
-                    | Q(main_tree__tree_id=OuterRef("assessment_item__contentnode__tree_id"))
-                ).values("pk")
-            ),
-        )
-
         if not user_id:
-            return queryset.annotate(edit=boolean_val(False), view=boolean_val(False)).filter(public=True)
-
-        edit_cte = PermissionCTE.editable_channels(user_id)
-        view_cte = PermissionCTE.view_only_channels(user_id)
+            return queryset.filter(cls._tree_filter(public_tree_ids()))
 
-        queryset = queryset.with_cte(edit_cte).with_cte(view_cte).annotate(
-            edit=edit_cte.exists(cls._permission_filter),
-            view=view_cte.exists(cls._permission_filter),
-        )
+        tree_ids = get_user_tree_ids(user_id)
 
         return queryset.filter(
-            Q(view=True)
-            | Q(edit=True)
-            | Q(public=True)
+            cls._tree_filter(tree_ids["edit"] | tree_ids["view"])
+            | cls._tree_filter(public_tree_ids())
             | Q(uploaded_by=user, contentnode__isnull=True, assessment_item__isnull=True)
         )
 
@@ -1841,7 +2012,19 @@ class File(models.Model):
                 else:
                     raise ValueError("Files of type `{}` are not supported.".format(ext))
 
+        from contentcuration.node_metadata import aggregates
+
+        if self._state.adding:
+            previous = (None, None)
+        else:
+            original_values = self._field_updates.changed()
+            previous = (
+                original_values.get("contentnode_id", self.contentnode_id),
+                original_values.get("file_size", self.file_size),
+            )
         super(File, self).save(*args, **kwargs)
+        if DeferredAttribute not in previous:
+            aggregates.add_file_change(previous, (self.contentnode_id, self.file_size))
 
     class Meta:
         indexes = [
@@ -1849,6 +2032,27 @@ class File(models.Model):
         ]
 
 
+@receiver(models.signals.m2m_changed, sender=Channel.editors.through)
+@receiver(models.signals.m2m_changed, sender=Channel.viewers.through)
+def invalidate_tree_ids_on_add(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached tree ids of users added as editors or viewers of channels.
+    Removals are caught by the post_delete signal of the through models below.
+    """
+    if action == "post_add":
+        invalidate_user_tree_ids([instance.pk] if reverse else pk_set)
+
+
+@receiver(models.signals.post_delete, sender=Channel.editors.through)
+@receiver(models.signals.post_delete, sender=Channel.viewers.through)
+def invalidate_tree_ids_on_delete(sender, instance, **kwargs):
+    """
+    Invalidates the cached tree ids of users removed as editors or viewers of channels,
+    however they are removed, as it is sent for bulk and cascade deletes too.
+    """
+    invalidate_user_tree_ids([instance.user_id])
+
+
 @receiver(models.signals.post_delete, sender=File)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
@@ -1860,12 +2064,25 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     delete_empty_file_reference(instance.checksum, instance.file_format.extension)
 
 
+@receiver(models.signals.post_delete, sender=File)
+def update_aggregates_on_file_delete(sender, instance, **kwargs):
+    """
+    Removes the size of a deleted `File` object from the aggregates of its node's ancestors,
+    as files are often deleted in bulk, without calling their delete method.
+    """
+    from contentcuration.node_metadata import aggregates
+
+    aggregates.add_file_change((instance.contentnode_id, instance.file_size), (None, None))
+
+
 def delete_empty_file_reference(checksum, extension):
     filename = checksum + '.' + extension
     if not File.objects.filter(checksum=checksum).exists() and not Channel.objects.filter(thumbnail=filename).exists():
         storage_path = generate_object_storage_name(checksum, filename)
         if default_storage.exists(storage_path):
             default_storage.delete(storage_path)
+        # Staged files are taken as proof that the file is in storage, so forget them once it's gone
+        StagedFile.objects.filter(checksum=checksum, extension=extension).delete()
 
 
 class PrerequisiteContentRelationship(models.Model):
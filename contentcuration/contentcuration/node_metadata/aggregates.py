@@ -0,0 +1,403 @@
+"""
+Counts over the descendants of each node, stored in ContentNodeAggregate so that
+tree views can read them with a join instead of computing them for every node.
+
+Edits to the counted attributes of a node add the difference they make to the
+counts of its ancestors. Operations that move or delete subtrees take the counts
+of each subtree from the ancestors it leaves and add them to those it joins, and
+operations that create subtrees compute the counts of the new nodes only, so no
+operation on part of a tree reads the rest of it. Operations that change whole
+trees at once, such as publishing, rebuild them for the tree. Should the counts
+drift, the rebuild_node_aggregates command rebuilds them.
+"""
+import contextlib
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import F
+from django.db.models import Q
+from django.db.models import Sum
+from le_utils.constants import content_kinds
+from le_utils.constants import roles
+
+from contentcuration.models import ContentNode
+from contentcuration.models import ContentNodeAggregate
+from contentcuration.models import File
+
+# Node attributes that the aggregates of its ancestors depend on
+COUNTED_FIELDS = ("kind_id", "role_visibility", "complete", "changed", "published")
+
+# Recompute the aggregates of nodes from their descendants, and their descendants' files
+REBUILD_SQL = """
+INSERT INTO {aggregate} (
+    contentnode_id,
+    child_count,
+    resource_count,
+    coach_count,
+    error_count,
+    new_resource_count,
+    updated_resource_count,
+    resource_size
+)
+SELECT
+    a.id,
+    count(d.id) FILTER (WHERE d.parent_id = a.id),
+    count(d.id) FILTER (WHERE d.kind_id != %(topic)s),
+    count(d.id) FILTER (WHERE d.kind_id != %(topic)s AND d.role_visibility = %(coach)s),
+    count(d.id) FILTER (WHERE NOT d.complete),
+    count(d.id) FILTER (WHERE d.kind_id != %(topic)s AND d.changed AND NOT d.published),
+    count(d.id) FILTER (WHERE d.kind_id != %(topic)s AND d.changed AND d.published),
+    COALESCE(sum(sizes.size), 0)
+FROM {node} a
+LEFT JOIN {node} d ON d.tree_id = a.tree_id AND d.lft > a.lft AND d.rght < a.rght
+LEFT JOIN (
+    SELECT f.contentnode_id, sum(f.file_size) AS size
+    FROM {file} f
+    JOIN {node} n ON n.id = f.contentnode_id
+    WHERE {file_conditions}
+    GROUP BY f.contentnode_id
+) sizes ON sizes.contentnode_id = d.id
+WHERE {conditions}
+GROUP BY a.id
+ON CONFLICT (contentnode_id) DO UPDATE SET
+    child_count = EXCLUDED.child_count,
+    resource_count = EXCLUDED.resource_count,
+    coach_count = EXCLUDED.coach_count,
+    error_count = EXCLUDED.error_count,
+    new_resource_count = EXCLUDED.new_resource_count,
+    updated_resource_count = EXCLUDED.updated_resource_count,
+    resource_size = EXCLUDED.resource_size
+"""
+
+
+def rebuild_aggregates(tree_id=None, lft=None, rght=None, node_ids=None):
+    """
+    Recompute the aggregates of the nodes in a tree, or all trees if no tree_id is given,
+    in a single statement. Limited to the subtree between `lft` and `rght`, or the nodes
+    in `node_ids`, if given.
+    """
+    conditions = []
+    file_conditions = []
+    params = {"topic": content_kinds.TOPIC, "coach": roles.COACH}
+    if tree_id is not None:
+        conditions.append("a.tree_id = %(tree_id)s")
+        file_conditions.append("n.tree_id = %(tree_id)s")
+        params["tree_id"] = tree_id
+    if lft is not None and rght is not None:
+        conditions.append("a.lft >= %(lft)s AND a.rght <= %(rght)s")
+        file_conditions.append("n.lft >= %(lft)s AND n.rght <= %(rght)s")
+        params.update(lft=lft, rght=rght)
+    if node_ids is not None:
+        node_ids = tuple(node_ids)
+        if not node_ids:
+            return
+        conditions.append("a.id IN %(node_ids)s")
+        params["node_ids"] = node_ids
+    with connection.cursor() as cursor:
+        cursor.execute(
+            REBUILD_SQL.format(
+                aggregate=ContentNodeAggregate._meta.db_table,
+                node=ContentNode._meta.db_table,
+                file=File._meta.db_table,
+                conditions=" AND ".join(conditions) or "TRUE",
+                file_conditions=" AND ".join(file_conditions) or "TRUE",
+            ),
+            params,
+        )
+
+
+def get_contribution(node):
+    """
+    Return what a node, a dict of its COUNTED_FIELDS, adds to the aggregates of its ancestors
+    """
+    is_resource = node["kind_id"] != content_kinds.TOPIC
+    return {
+        "resource_count": int(is_resource),
+        "coach_count": int(is_resource and node["role_visibility"] == roles.COACH),
+        "error_count": int(not node["complete"]),
+        "new_resource_count": int(is_resource and node["changed"] and not node["published"]),
+        "updated_resource_count": int(is_resource and node["changed"] and node["published"]),
+    }
+
+
+def add_to_ancestors(tree_id, lft, rght, delta):
+    """
+    Add the values in `delta` to the aggregates of the ancestors of the node at `lft` and `rght`
+    """
+    delta = {field: value for field, value in delta.items() if value}
+    if delta:
+        ContentNodeAggregate.objects.filter(
+            contentnode__tree_id=tree_id,
+            contentnode__lft__lt=lft,
+            contentnode__rght__gt=rght,
+        ).update(**{field: F(field) + value for field, value in delta.items()})
+
+
+def add_node(node):
+    """
+    Add the aggregates of a node that has just been created, without descendants
+    """
+    ContentNodeAggregate.objects.get_or_create(contentnode_id=node.pk)
+    add_to_ancestors(
+        node.tree_id,
+        node.lft,
+        node.rght,
+        get_contribution({field: getattr(node, field) for field in COUNTED_FIELDS}),
+    )
+    if node.parent_id:
+        ContentNodeAggregate.objects.filter(contentnode_id=node.parent_id).update(
+            child_count=F("child_count") + 1
+        )
+
+
+def add_nodes(nodes):
+    """
+    Add the aggregates of nodes that have just been created in bulk, without descendants,
+    and add their counts and the sizes of their files to the aggregates of their ancestors
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return
+    ContentNodeAggregate.objects.bulk_create(
+        [ContentNodeAggregate(contentnode_id=node.pk) for node in nodes]
+    )
+    file_sizes = _get_file_sizes_by_node([node.pk for node in nodes])
+    # Siblings have the same ancestors, so their counts are added together
+    siblings_by_parent = defaultdict(list)
+    for node in nodes:
+        siblings_by_parent[node.parent_id].append(node)
+    for parent_id, siblings in siblings_by_parent.items():
+        delta = defaultdict(int)
+        for node in siblings:
+            contribution = get_contribution({field: getattr(node, field) for field in COUNTED_FIELDS})
+            contribution["resource_size"] = file_sizes.get(node.pk, 0)
+            for field, value in contribution.items():
+                delta[field] += value
+        add_to_ancestors(siblings[0].tree_id, siblings[0].lft, siblings[0].rght, delta)
+        if parent_id:
+            ContentNodeAggregate.objects.filter(contentnode_id=parent_id).update(
+                child_count=F("child_count") + len(siblings)
+            )
+
+
+def add_subtree(node_id):
+    """
+    Compute the aggregates of a subtree that has just been created, such as a copy,
+    and add its counts to the aggregates of its ancestors
+    """
+    node = ContentNode.objects.filter(pk=node_id).values(
+        "tree_id", "lft", "rght", "parent_id", *COUNTED_FIELDS
+    ).first()
+    if not node:
+        return
+    rebuild_aggregates(node["tree_id"], node["lft"], node["rght"])
+    if not node["parent_id"]:
+        return
+    aggregate = ContentNodeAggregate.objects.get(contentnode_id=node_id)
+    delta = get_contribution(node)
+    for field in delta:
+        delta[field] += getattr(aggregate, field)
+    delta["resource_size"] = aggregate.resource_size + get_file_size(node_id)
+    add_to_ancestors(node["tree_id"], node["lft"], node["rght"], delta)
+    ContentNodeAggregate.objects.filter(contentnode_id=node["parent_id"]).update(
+        child_count=F("child_count") + 1
+    )
+
+
+def get_file_size(node_id):
+    """
+    Return the total size of the files of a node
+    """
+    return (
+        File.objects.filter(contentnode_id=node_id).aggregate(size=Sum("file_size"))["size"] or 0
+    )
+
+
+def add_file_sizes(sizes_by_node):
+    """
+    Add the sizes of files added to, or removed from, nodes to the aggregates of their ancestors
+    """
+    nodes = ContentNode.objects.filter(
+        pk__in=[node_id for node_id, size in sizes_by_node.items() if size]
+    ).values("id", "tree_id", "lft", "rght")
+    for node in nodes:
+        add_to_ancestors(
+            node["tree_id"], node["lft"], node["rght"], {"resource_size": sizes_by_node[node["id"]]}
+        )
+
+
+def add_file_change(previous, current):
+    """
+    Add a change to a file, from its `previous` (node id, size) to its `current` one,
+    to the aggregates of the ancestors of its nodes
+    """
+    sizes_by_node = defaultdict(int)
+    for (node_id, size), sign in ((previous, -1), (current, 1)):
+        if node_id and size:
+            sizes_by_node[node_id] += sign * int(size)
+    add_file_sizes(sizes_by_node)
+
+
+@contextlib.contextmanager
+def track_changes(node_ids):
+    """
+    Add the changes made to the counted attributes of the nodes in `node_ids` inside the block
+    to the aggregates of their ancestors. The nodes are looked up before and after, so this
+    works for changes made in any way, but the nodes must not be moved inside the block.
+    """
+    node_ids = list(node_ids)
+    before = _get_counted_values(node_ids)
+    yield
+    for node_id, node in _get_counted_values(node_ids).items():
+        if node_id not in before:
+            continue
+        old = get_contribution(before[node_id])
+        delta = {field: value - old[field] for field, value in get_contribution(node).items()}
+        add_to_ancestors(node["tree_id"], node["lft"], node["rght"], delta)
+
+
+@contextlib.contextmanager
+def track_file_changes(file_ids):
+    """
+    Add the changes made to the sizes and nodes of the files in `file_ids` inside the block
+    to the aggregates of the ancestors of their nodes
+    """
+    file_ids = list(file_ids)
+    sizes_by_node = defaultdict(int)
+    for node_id, size in _get_file_sizes(file_ids):
+        sizes_by_node[node_id] -= size
+    yield
+    for node_id, size in _get_file_sizes(file_ids):
+        sizes_by_node[node_id] += size
+    add_file_sizes(sizes_by_node)
+
+
+@contextlib.contextmanager
+def track_structure_changes(node_ids):
+    """
+    Take the counts of the subtrees of the nodes in `node_ids` from the aggregates of the
+    ancestors they have before the block, and add them to those of the ancestors they have
+    after it, for operations that move or delete the nodes inside it. The sizes of the files
+    of deleted nodes are taken from the aggregates as the files are deleted.
+    """
+    node_ids = list(node_ids)
+    before = _get_counted_values(node_ids, "parent_id")
+    deltas = _get_subtree_deltas(before)
+    old_ancestors = _get_ancestor_ids_by_node(before)
+    yield
+    after = _get_counted_values(node_ids, "parent_id")
+    new_ancestors = _get_ancestor_ids_by_node(after)
+
+    # Nodes that leave and join the same ancestors, such as siblings moved together,
+    # have their counts moved together
+    deltas_by_path = defaultdict(lambda: defaultdict(int))
+    child_counts = defaultdict(int)
+    for node_id, node in before.items():
+        old_path = old_ancestors[node_id]
+        new_path = new_ancestors.get(node_id, frozenset())
+        delta = deltas[node_id]
+        if node_id not in after:
+            delta = dict(delta, resource_size=0)
+        for field, value in delta.items():
+            deltas_by_path[(old_path - new_path, new_path - old_path)][field] += value
+        new_parent_id = after[node_id]["parent_id"] if node_id in after else None
+        if new_parent_id != node["parent_id"]:
+            child_counts[node["parent_id"]] -= 1
+            child_counts[new_parent_id] += 1
+
+    for (left_ids, joined_ids), delta in deltas_by_path.items():
+        _add_to_nodes(left_ids, {field: -value for field, value in delta.items()})
+        _add_to_nodes(joined_ids, delta)
+    for parent_id, count in child_counts.items():
+        if parent_id:
+            _add_to_nodes([parent_id], {"child_count": count})
+
+
+def _add_to_nodes(node_ids, delta):
+    delta = {field: value for field, value in delta.items() if value}
+    if node_ids and delta:
+        ContentNodeAggregate.objects.filter(contentnode_id__in=list(node_ids)).update(
+            **{field: F(field) + value for field, value in delta.items()}
+        )
+
+
+def _get_subtree_deltas(nodes):
+    """
+    Return what the subtree of each of `nodes`, a dict of their counted values by id, adds to
+    the aggregates of its ancestors, leaving out the subtrees of the other nodes within it
+    """
+    aggregates_by_node = {
+        aggregate["contentnode_id"]: aggregate
+        for aggregate in ContentNodeAggregate.objects.filter(contentnode_id__in=list(nodes)).values()
+    }
+    file_sizes = _get_file_sizes_by_node(list(nodes))
+    subtrees = {}
+    for node_id, node in nodes.items():
+        aggregate = aggregates_by_node.get(node_id, {})
+        delta = get_contribution(node)
+        for field in delta:
+            delta[field] += aggregate.get(field, 0)
+        delta["resource_size"] = aggregate.get("resource_size", 0) + file_sizes.get(node_id, 0)
+        subtrees[node_id] = delta
+
+    # A node within the subtree of another is counted with its own subtree, not the other's
+    deltas = {node_id: dict(delta) for node_id, delta in subtrees.items()}
+    for node_id, node in nodes.items():
+        containing = [
+            other_id for other_id, other in nodes.items()
+            if other["tree_id"] == node["tree_id"] and other["lft"] < node["lft"] and other["rght"] > node["rght"]
+        ]
+        if containing:
+            nearest_id = max(containing, key=lambda other_id: nodes[other_id]["lft"])
+            for field, value in subtrees[node_id].items():
+                deltas[nearest_id][field] -= value
+    return deltas
+
+
+def _get_file_sizes_by_node(node_ids):
+    return dict(
+        File.objects.filter(contentnode_id__in=node_ids)
+        .exclude(file_size=None)
+        .order_by()
+        .values("contentnode_id")
+        .annotate(size=Sum("file_size"))
+        .values_list("contentnode_id", "size")
+    )
+
+
+def _get_ancestor_ids_by_node(nodes):
+    """
+    Return the ids of the ancestors of each of `nodes`, a dict of their positions by id
+    """
+    ancestors = Q()
+    for node in nodes.values():
+        ancestors |= Q(tree_id=node["tree_id"], lft__lt=node["lft"], rght__gt=node["rght"])
+    if not ancestors:
+        return {}
+    candidates = list(ContentNode.objects.filter(ancestors).values("id", "tree_id", "lft", "rght"))
+    return {
+        node_id: frozenset(
+            candidate["id"] for candidate in candidates
+            if candidate["tree_id"] == node["tree_id"]
+            and candidate["lft"] < node["lft"]
+            and candidate["rght"] > node["rght"]
+        )
+        for node_id, node in nodes.items()
+    }
+
+
+def _get_counted_values(node_ids, *fields):
+    return {
+        node["id"]: node
+        for node in ContentNode.objects.filter(pk__in=node_ids).values(
+            "id", "tree_id", "lft", "rght", *(COUNTED_FIELDS + fields)
+        )
+    }
+
+
+def _get_file_sizes(file_ids):
+    return (
+        File.objects.filter(pk__in=file_ids, contentnode__isnull=False)
+        .exclude(file_size=None)
+        .values_list("contentnode_id", "file_size")
+    )
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.postgres.aggregates.general import ArrayAgg
 from django.contrib.postgres.aggregates.general import BoolOr
 from django.db.models import BooleanField
@@ -75,24 +76,6 @@ class AncestorArrayAgg(AncestorAnnotation):
         )
 
 
-class DescendantCount(MetadataAnnotation):
-    def get_annotation(self, cte=None):
-        """
-        @see MPTTModel.get_descendant_count()
-        """
-        return Max(
-            Case(
-                # when selected node is topic, use algorithm to get descendant count
-                When(
-                    condition=WhenQ(*self.build_topic_condition(F("kind_id"))),
-                    then=(F("rght") - F("lft") - Value(1)) / Value(2),
-                ),
-                # integer division floors the result in postgres
-                default=Value(1),
-            )
-        )
-
-
 class DescendantAnnotation(MetadataAnnotation):
     cte = TreeMetadataCTE
     cte_columns = ("lft", "rght")
@@ -118,6 +101,50 @@ class DescendantAnnotation(MetadataAnnotation):
         ]
 
 
+class DescendantCount(DescendantAnnotation):
+    cte_columns = ("pk",) + DescendantAnnotation.cte_columns
+
+    def __init__(self, *args, **kwargs):
+        super(DescendantCount, self).__init__(*args, **kwargs)
+        if not settings.MPTT_SPARSE_GAP:
+            # with dense numbering the count is derived from lft and rght, without the tree CTE
+            self.cte = None
+
+    def get_annotation(self, cte=None):
+        """
+        @see MPTTModel.get_descendant_count()
+        """
+        if cte is None:
+            return Max(
+                Case(
+                    # when selected node is topic, use algorithm to get descendant count
+                    When(
+                        condition=WhenQ(*self.build_topic_condition(F("kind_id"))),
+                        then=(F("rght") - F("lft") - Value(1)) / Value(2),
+                    ),
+                    # integer division floors the result in postgres
+                    default=Value(1),
+                )
+            )
+
+        resource_condition = self.build_topic_condition(F("kind_id"), "!=")
+
+        topic_condition = self.build_topic_condition(F("kind_id"))
+        topic_condition += self.build_descendant_condition(cte)
+
+        # sparse numbering leaves free values in topics, so count their descendants
+        return Count(
+            Case(
+                # when selected node is not a topic, then count = 1
+                When(condition=WhenQ(*resource_condition), then=F("id")),
+                # when it is a topic, then count descendants
+                When(condition=WhenQ(*topic_condition), then=cte.col.pk),
+                default=Value(None),
+            ),
+            distinct=True,
+        )
+
+
 class AssessmentCount(DescendantAnnotation):
     cte = AssessmentCountCTE
     cte_columns = ("content_id", "assessment_count")
@@ -370,6 +370,42 @@ CELERY_WORKER_SEND_TASK_EVENTS = True
 TWO_WEEKS_AGO = datetime.now() - timedelta(days=14)
 ORPHAN_DATE_CLEAN_UP_THRESHOLD = TWO_WEEKS_AGO
 
+# Lock ContentNode trees for mptt operations with a Postgres advisory lock per tree,
+# rather than by locking every node row in the tree. Only mptt operations on a tree
+# then wait on each other, while edits to node metadata can carry on concurrently.
+MPTT_ADVISORY_LOCKS = bool(os.getenv("MPTT_ADVISORY_LOCKS"))
+
+# Number of free lft/rght values to leave at the end of each topic in ContentNode trees,
+# so that appending children only renumbers the topic's own subtree. 0 keeps mptt's dense numbering.
+MPTT_SPARSE_GAP = int(os.getenv("MPTT_SPARSE_GAP") or 0)
+# Minimum number of seconds between background respacing of the same tree once its gaps run out
+MPTT_RESPACE_INTERVAL = int(os.getenv("MPTT_RESPACE_INTERVAL") or 300)
+
+# Number of workers, each with its own database connection, used by the sync endpoint to apply
+# groups of changes that don't depend on each other concurrently. 1 applies them all in the request thread.
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY") or 1)
+# Number of seconds after which the sync endpoint stops starting new groups of changes,
+# and defers them to the next sync. 0 means no limit.
+SYNC_TIME_BUDGET = float(os.getenv("SYNC_TIME_BUDGET") or 0)
+
+# Number of results above which paginated lists, such as the catalog and search results, report the query
+# planner's estimate of their count while counting them in the background. 0 always counts them.
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.getenv("PAGINATION_COUNT_ESTIMATE_THRESHOLD") or 10000)
+
+# Event bus holding changes to return to users on their next sync, "redis" or "memory"
+SYNC_EVENT_BUS = os.getenv("SYNC_EVENT_BUS") or "redis"
+# Maximum number of events kept for each user, older events are dropped first
+SYNC_EVENT_QUEUE_LENGTH = int(os.getenv("SYNC_EVENT_QUEUE_LENGTH") or 1000)
+# Number of seconds events are kept for, one week by default
+SYNC_EVENT_TTL = int(os.getenv("SYNC_EVENT_TTL") or 7 * 24 * 60 * 60)
+# Whether clients long poll the sync events endpoint. Each open tab then keeps a request, and with
+# synchronous gunicorn workers a whole worker, waiting for up to SYNC_POLL_TIMEOUT seconds, so only
+# enable it with a worker class that handles many requests at once, such as gevent.
+# Otherwise the endpoint returns the events already published without waiting.
+SYNC_POLL_ENABLED = bool(os.getenv("SYNC_POLL_ENABLED"))
+# Maximum number of seconds a request to the sync events endpoint waits for new events
+SYNC_POLL_TIMEOUT = int(os.getenv("SYNC_POLL_TIMEOUT") or 30)
+
 # CLOUD STORAGE SETTINGS
 DEFAULT_FILE_STORAGE = 'django_s3_storage.storage.S3Storage'
 AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID') or 'development'
@@ -380,6 +416,9 @@ AWS_AUTO_CREATE_BUCKET = False
 AWS_S3_FILE_OVERWRITE = True
 AWS_S3_BUCKET_AUTH = False
 
+# Maximum number of requests to make at once when checking many files in storage
+STORAGE_EXISTS_CONCURRENCY = int(os.getenv('STORAGE_EXISTS_CONCURRENCY') or 10)
+
 # GOOGLE DRIVE SETTINGS
 GOOGLE_AUTH_JSON = "credentials/client_secret.json"
 GOOGLE_STORAGE_REQUEST_SHEET = "16X6zcFK8FS5t5tFaGpnxbWnWTXP88h4ccpSpPbyLeA8"
@@ -23,6 +23,7 @@ from contentcuration.utils.csv_writer import write_user_csv
 from contentcuration.utils.publish import publish_channel
 from contentcuration.utils.sync import sync_channel
 from contentcuration.utils.user import cache_multiple_users_metadata
+from contentcuration.viewsets.pagination import cache_query_count
 from contentcuration.viewsets.sync.constants import CHANNEL
 from contentcuration.viewsets.sync.constants import CONTENTNODE
 from contentcuration.viewsets.sync.constants import COPYING_FLAG
@@ -116,16 +117,26 @@ def sync_channel_task(
     sync_tags,
     sync_files,
     sync_assessment_items,
+    dry_run=False,
 ):
     channel = Channel.objects.get(pk=channel_id)
-    sync_channel(
+    diff = sync_channel(
         channel,
         sync_attributes,
         sync_tags,
         sync_files,
-        sync_tags,
+        sync_assessment_items,
         task_object=self,
+        dry_run=dry_run,
     )
+    if dry_run:
+        return {"diff": diff}
+
+
+@task(name="respace_tree_task")
+def respace_tree_task(tree_id):
+    updated = ContentNode.objects.respace_tree(tree_id)
+    logger.info("Respaced {} nodes in tree {}".format(updated, tree_id))
 
 
 @task(name="generatechannelcsv_task")
@@ -191,6 +202,11 @@ def cache_multiple_users_metadata_task(users):
     cache_multiple_users_metadata(users)
 
 
+@task(name="count_query_task")
+def count_query_task(sql, params, cache_key):
+    cache_query_count(sql, params, cache_key)
+
+
 type_mapping = {
     "duplicate-nodes": {"task": duplicate_nodes_task, "progress_tracking": True},
     "export-channel": {"task": export_channel_task, "progress_tracking": True},
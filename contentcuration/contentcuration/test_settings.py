@@ -8,6 +8,8 @@ WEBPACK_LOADER["DEFAULT"][  # noqa
 
 TEST_ENV = True
 
+SYNC_EVENT_BUS = "memory"
+
 INSTALLED_APPS += ("django_concurrent_tests",)  # noqa F405
 
 MANAGE_PY_PATH = "./contentcuration/manage.py"
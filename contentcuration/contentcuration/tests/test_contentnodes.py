@@ -9,8 +9,10 @@ from builtins import str
 from builtins import zip
 
 import pytest
+from django.db.models import F
 from django.db.utils import DataError
 from le_utils.constants import content_kinds
+from le_utils.constants import roles
 from mixer.backend.django import mixer
 from mock import patch
 from past.utils import old_div
@@ -18,13 +20,17 @@ from past.utils import old_div
 from . import testdata
 from .base import BaseTestCase
 from .testdata import create_studio_file
+from contentcuration.db.models.manager import _layout_tree
 from contentcuration.models import Channel
 from contentcuration.models import ContentKind
 from contentcuration.models import ContentNode
+from contentcuration.models import ContentNodeAggregate
 from contentcuration.models import ContentTag
+from contentcuration.models import File
 from contentcuration.models import FormatPreset
 from contentcuration.models import generate_storage_url
 from contentcuration.models import Language
+from contentcuration.node_metadata.aggregates import rebuild_aggregates
 from contentcuration.utils.db_tools import TreeBuilder
 from contentcuration.utils.files import create_thumbnail_from_base64
 from contentcuration.utils.sync import sync_node
@@ -211,6 +217,80 @@ class NodeOperationsTestCase(BaseTestCase):
                 )
             )
 
+    def test_duplicate_nodes_with_advisory_locks(self):
+        new_channel = testdata.channel()
+        with self.settings(MPTT_ADVISORY_LOCKS=True), patch(
+            "contentcuration.db.models.manager.log_lock_wait_time"
+        ) as mock_wait:
+            self.channel.main_tree.copy_to(new_channel.main_tree, batch_size=1)
+            mock_wait.assert_called()
+
+        _check_node_copy(
+            self.channel.main_tree,
+            new_channel.main_tree.get_children().last(),
+            original_channel_id=self.channel.id,
+            channel=new_channel,
+        )
+
+    def test_duplicate_nodes_with_sql(self):
+        source_nodes = ContentNode.objects.filter(tree_id=self.channel.main_tree.tree_id)
+        source_nodes.update(original_channel_id=self.channel.id, original_source_node_id=F("node_id"))
+        new_channel = testdata.channel()
+        with patch(
+            "contentcuration.db.models.manager.CustomContentNodeTreeManager._deep_copy_objects"
+        ) as mock_deep_copy_objects:
+            self.channel.main_tree.copy_to(new_channel.main_tree, batch_size=10000)
+            mock_deep_copy_objects.assert_not_called()
+
+        new_channel.main_tree.refresh_from_db()
+        copy = new_channel.main_tree.get_children().last()
+        _check_node_copy(
+            self.channel.main_tree,
+            copy,
+            original_channel_id=self.channel.id,
+            channel=new_channel,
+        )
+        self.assertEqual(copy.rght - copy.lft + 1, 2 * source_nodes.count())
+        self.assertEqual(new_channel.main_tree.rght, copy.rght + 1)
+
+    def test_respace_tree(self):
+        tree_id = self.channel.main_tree.tree_id
+        node_ids = list(ContentNode.objects.filter(tree_id=tree_id).order_by("lft").values_list("id", flat=True))
+        descendant_count = self.channel.main_tree.get_descendant_count()
+
+        with self.settings(MPTT_SPARSE_GAP=4):
+            ContentNode.objects.respace_tree(tree_id)
+            self.channel.main_tree.refresh_from_db()
+
+            self.assertEqual(
+                node_ids,
+                list(ContentNode.objects.filter(tree_id=tree_id).order_by("lft").values_list("id", flat=True)),
+            )
+            self.assertEqual(descendant_count, self.channel.main_tree.get_descendant_count())
+            for topic in ContentNode.objects.filter(tree_id=tree_id, kind_id=content_kinds.TOPIC):
+                last_rght = max([child.rght for child in topic.get_children()] or [topic.lft])
+                self.assertEqual(topic.rght - last_rght - 1, 4)
+
+    def test_duplicate_nodes_with_sparse_numbering(self):
+        new_channel = testdata.channel()
+        gap = 2 * (self.channel.main_tree.get_descendant_count() + 1)
+        with self.settings(MPTT_SPARSE_GAP=gap):
+            ContentNode.objects.respace_tree(new_channel.main_tree.tree_id)
+            new_channel.main_tree.refresh_from_db()
+            rght = new_channel.main_tree.rght
+
+            self.channel.main_tree.copy_to(new_channel.main_tree)
+            new_channel.main_tree.refresh_from_db()
+
+            # The copy fit in the free values of the target, so it was not renumbered
+            self.assertEqual(rght, new_channel.main_tree.rght)
+            _check_node_copy(
+                self.channel.main_tree,
+                new_channel.main_tree.get_children().last(),
+                original_channel_id=self.channel.id,
+                channel=new_channel,
+            )
+
     def test_duplicate_nodes_shallow(self):
         """
         Ensures that when we copy nodes in a shallow way, a full copy happens
@@ -669,6 +749,160 @@ class NodeOperationsTestCase(BaseTestCase):
             channel=new_channel,
         )
 
+    def test_bulk_move_nodes(self):
+        source = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        nodes = list(source.get_children())
+        new_channel = testdata.channel()
+        target = new_channel.main_tree
+        target_child_count = target.get_children().count()
+
+        moves = [(node, target, "first-child") for node in nodes]
+        # Invalid moves are reported without stopping the others
+        moves.append((source, source, "last-child"))
+        errors = ContentNode.objects.bulk_move(moves)
+
+        self.assertEqual(errors[:-1], [None] * len(nodes))
+        self.assertIsNotNone(errors[-1])
+        source.refresh_from_db()
+        target.refresh_from_db()
+        # Each node was moved to the start in turn, so they end up in reverse order
+        self.assertEqual(
+            [node.id for node in reversed(nodes)],
+            list(target.get_children().values_list("id", flat=True)[:len(nodes)]),
+        )
+        self.assertEqual(target.get_children().count(), target_child_count + len(nodes))
+        self.assertFalse(source.get_children().exists())
+        self.assertTrue(source.changed)
+        self.assertTrue(target.changed)
+
+        for tree in (self.channel.main_tree, new_channel.main_tree):
+            tree.refresh_from_db()
+            self.assertEqual(tree.get_descendants().count(), tree.get_descendant_count())
+            for node in tree.get_descendants():
+                self.assertEqual(node.get_ancestors().last().id, node.parent_id)
+
+    def test_bulk_move_within_topic_only_renumbers_topic(self):
+        topic = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        first = ContentNode.objects.create(title="first", parent=topic, kind_id=content_kinds.VIDEO)
+        last = ContentNode.objects.create(title="last", parent=topic, kind_id=content_kinds.VIDEO)
+        topic.refresh_from_db()
+        other_values = list(
+            ContentNode.objects.filter(tree_id=topic.tree_id)
+            .exclude(lft__gte=topic.lft, rght__lte=topic.rght)
+            .order_by("id")
+            .values_list("id", "lft", "rght")
+        )
+
+        with patch("contentcuration.db.models.manager._layout_tree", wraps=_layout_tree) as layout_tree:
+            errors = ContentNode.objects.bulk_move([(last, first, "left")])
+
+        self.assertEqual(errors, [None])
+        self.assertEqual([call[0][0] for call in layout_tree.call_args_list], [topic.id])
+        self.assertEqual(
+            list(topic.get_children().values_list("id", flat=True)[topic.get_children().count() - 2:]),
+            [last.id, first.id],
+        )
+        self.assertEqual(
+            other_values,
+            list(
+                ContentNode.objects.filter(tree_id=topic.tree_id)
+                .exclude(lft__gte=topic.lft, rght__lte=topic.rght)
+                .order_by("id")
+                .values_list("id", "lft", "rght")
+            ),
+        )
+        tree = self.channel.main_tree
+        tree.refresh_from_db()
+        self.assertEqual(tree.get_descendants().count(), tree.get_descendant_count())
+        for node in tree.get_descendants():
+            self.assertEqual(node.get_ancestors().last().id, node.parent_id)
+
+
+class NodeAggregatesTestCase(BaseTestCase):
+    def setUp(self):
+        super(NodeAggregatesTestCase, self).setUp()
+
+        self.channel = testdata.channel()
+        tree = TreeBuilder()
+        self.channel.main_tree = tree.root
+        self.channel.save()
+        self.topic = self.channel.main_tree.get_descendants().filter(kind_id=content_kinds.TOPIC).first()
+        self.resource = self.topic.get_descendants().exclude(kind_id=content_kinds.TOPIC).first()
+
+    def assertAggregatesUpToDate(self, *trees):
+        """
+        Check that the aggregates maintained as the trees were edited match those rebuilt from scratch
+        """
+        for tree in trees:
+            tree.refresh_from_db()
+            aggregates = ContentNodeAggregate.objects.filter(contentnode__tree_id=tree.tree_id)
+            maintained = list(aggregates.order_by("contentnode_id").values())
+            rebuild_aggregates(tree.tree_id)
+            self.assertEqual(maintained, list(aggregates.order_by("contentnode_id").values()))
+            self.assertEqual(len(maintained), tree.get_descendant_count() + 1)
+
+    def test_aggregates_after_create(self):
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+        ContentNode.objects.create(title="new", parent=self.topic, kind_id=content_kinds.VIDEO)
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+        self.assertGreater(self.channel.main_tree.aggregate.new_resource_count, 0)
+
+    def test_aggregates_after_update(self):
+        self.resource.complete = not self.resource.complete
+        self.resource.role_visibility = roles.COACH
+        self.resource.save()
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+
+    def test_aggregates_after_file_changes(self):
+        file = File.objects.create(contentnode=self.resource, file_size=100)
+        file.file_size = 200
+        file.save()
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+        file.delete()
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+
+    def test_aggregates_after_move(self):
+        new_channel = testdata.channel()
+        self.resource.move_to(new_channel.main_tree, "last-child")
+        self.assertAggregatesUpToDate(self.channel.main_tree, new_channel.main_tree)
+
+    def test_aggregates_after_bulk_move(self):
+        new_channel = testdata.channel()
+        ContentNode.objects.bulk_move(
+            [(node, new_channel.main_tree, "first-child") for node in self.topic.get_children()]
+        )
+        self.assertAggregatesUpToDate(self.channel.main_tree, new_channel.main_tree)
+
+    def test_aggregates_after_delete(self):
+        self.topic.delete()
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+
+    def test_aggregates_after_delete_with_files(self):
+        File.objects.create(contentnode=self.resource, file_size=100)
+        self.topic.delete()
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+
+    def test_aggregates_after_move_with_files(self):
+        File.objects.create(contentnode=self.resource, file_size=100)
+        new_channel = testdata.channel()
+        with patch("contentcuration.node_metadata.aggregates.rebuild_aggregates") as rebuild:
+            self.topic.move_to(new_channel.main_tree, "last-child")
+        rebuild.assert_not_called()
+        self.assertAggregatesUpToDate(self.channel.main_tree, new_channel.main_tree)
+
+    def test_aggregates_after_bulk_move_of_nested_nodes(self):
+        File.objects.create(contentnode=self.resource, file_size=100)
+        new_channel = testdata.channel()
+        ContentNode.objects.bulk_move(
+            [(self.topic, new_channel.main_tree, "last-child"), (self.resource, self.channel.main_tree, "last-child")]
+        )
+        self.assertAggregatesUpToDate(self.channel.main_tree, new_channel.main_tree)
+
+    def test_aggregates_after_copy(self):
+        self.topic.copy_to(self.channel.main_tree)
+        self.resource.copy_to(self.topic)
+        self.assertAggregatesUpToDate(self.channel.main_tree)
+
 
 class SyncNodesOperationTestCase(BaseTestCase):
     """
@@ -2,12 +2,16 @@ from __future__ import absolute_import
 
 import os
 import random
+import shutil
 import string
 import tempfile
 
 import pytest
 from kolibri_content import models as kolibri_models
 from kolibri_content.router import set_active_content_database
+from kolibri_content.router import using_content_database
+from le_utils.constants import content_kinds
+from le_utils.constants import format_presets
 from mock import patch
 
 from .base import StudioTestCase
@@ -18,11 +22,15 @@ from contentcuration import models as cc
 from contentcuration.utils.publish import convert_channel_thumbnail
 from contentcuration.utils.publish import create_bare_contentnode
 from contentcuration.utils.publish import create_content_database
+from contentcuration.utils.publish import create_perseus_exercise
+from contentcuration.utils.publish import create_perseus_exercises
 from contentcuration.utils.publish import create_slideshow_manifest
 from contentcuration.utils.publish import fill_published_fields
+from contentcuration.utils.publish import incremental_map_content_nodes
 from contentcuration.utils.publish import map_prerequisites
 from contentcuration.utils.publish import MIN_SCHEMA_VERSION
 from contentcuration.utils.publish import prepare_export_database
+from contentcuration.utils.publish import process_assessment_metadata
 from contentcuration.utils.publish import set_channel_icon_encoding
 
 pytestmark = pytest.mark.django_db
@@ -142,6 +150,165 @@ class ExportChannelTestCase(StudioTestCase):
         self.assertIsNotNone(self.content_channel.icon_encoding)
 
 
+class BulkExportChannelTestCase(StudioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(BulkExportChannelTestCase, cls).setUpClass()
+        cls.patch_copy_db = patch('contentcuration.utils.publish.save_export_database')
+        cls.patch_copy_db.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(BulkExportChannelTestCase, cls).tearDownClass()
+        cls.patch_copy_db.stop()
+
+    def setUp(self):
+        super(BulkExportChannelTestCase, self).setUp()
+        self.content_channel = channel()
+
+        new_node = create_node({'kind_id': 'topic', 'title': 'Incomplete topic', 'children': []})
+        new_node.complete = False
+        new_node.parent = self.content_channel.main_tree
+        new_node.save()
+
+        new_video = create_node({'kind_id': 'video', 'title': 'Complete video', 'children': []})
+        new_video.parent = new_node
+        new_video.save()
+
+        empty_topic = create_node({'kind_id': 'topic', 'title': 'Empty topic', 'children': []})
+        empty_topic.parent = self.content_channel.main_tree
+        empty_topic.save()
+
+        set_channel_icon_encoding(self.content_channel)
+        self.tempdbs = [
+            create_content_database(self.content_channel, True, None, True),
+            create_content_database(self.content_channel, True, None, True, bulk=True),
+        ]
+
+    def tearDown(self):
+        super(BulkExportChannelTestCase, self).tearDown()
+        set_active_content_database(None)
+        for tempdb in self.tempdbs:
+            if os.path.exists(tempdb):
+                os.remove(tempdb)
+
+    def _get_rows(self, tempdb, model, *fields):
+        set_active_content_database(tempdb)
+        return list(model.objects.order_by(*fields).values_list(*fields))
+
+    def _assert_same_rows(self, model, *fields):
+        legacy, bulk = (self._get_rows(tempdb, model, *fields) for tempdb in self.tempdbs)
+        assert len(legacy) > 0
+        self.assertEqual(legacy, bulk)
+
+    def test_contentnode_rows(self):
+        self._assert_same_rows(
+            kolibri_models.ContentNode, "id", "parent_id", "lft", "rght", "tree_id", "level", "title", "kind",
+            "content_id", "channel_id", "available", "license_name", "license_description", "lang_id", "options",
+        )
+
+    def test_file_rows(self):
+        self._assert_same_rows(
+            kolibri_models.File, "contentnode_id", "preset", "extension", "file_size", "local_file_id", "priority",
+        )
+
+    def test_localfile_rows(self):
+        self._assert_same_rows(kolibri_models.LocalFile, "id", "extension", "file_size")
+
+    def test_tag_rows(self):
+        self._assert_same_rows(kolibri_models.ContentNode.tags.through, "contentnode_id", "contenttag_id")
+
+    def test_assessmentmetadata_rows(self):
+        self._assert_same_rows(
+            kolibri_models.AssessmentMetaData, "contentnode_id", "assessment_item_ids", "number_of_assessments", "mastery_model",
+        )
+
+
+class IncrementalExportChannelTestCase(StudioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(IncrementalExportChannelTestCase, cls).setUpClass()
+        cls.patch_copy_db = patch('contentcuration.utils.publish.save_export_database')
+        cls.patch_copy_db.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(IncrementalExportChannelTestCase, cls).tearDownClass()
+        cls.patch_copy_db.stop()
+
+    def setUp(self):
+        super(IncrementalExportChannelTestCase, self).setUp()
+        self.content_channel = channel()
+        set_channel_icon_encoding(self.content_channel)
+        self.previous_db = create_content_database(self.content_channel, True, None, True, bulk=True)
+        self.content_channel.main_tree.get_family().update(changed=False)
+        fh, self.incremental_db = tempfile.mkstemp(suffix=".sqlite3")
+        shutil.copyfile(self.previous_db, self.incremental_db)
+        self.tempdbs = [self.previous_db, self.incremental_db]
+
+    def tearDown(self):
+        super(IncrementalExportChannelTestCase, self).tearDown()
+        set_active_content_database(None)
+        for tempdb in self.tempdbs:
+            if os.path.exists(tempdb):
+                os.remove(tempdb)
+
+    def _update_incrementally(self):
+        main_tree = cc.ContentNode.objects.get(pk=self.content_channel.main_tree_id)
+        with using_content_database(self.incremental_db):
+            return incremental_map_content_nodes(main_tree, self.content_channel.language, self.content_channel.id, self.content_channel.name)
+
+    def _assert_matches_full_export(self):
+        full_db = create_content_database(self.content_channel, True, None, False, bulk=True)
+        self.tempdbs.append(full_db)
+        fields = ("id", "parent_id", "lft", "rght", "tree_id", "level", "title", "kind", "available")
+        rows = []
+        for tempdb in (self.incremental_db, full_db):
+            set_active_content_database(tempdb)
+            rows.append((
+                list(kolibri_models.ContentNode.objects.order_by("id").values_list(*fields)),
+                list(kolibri_models.File.objects.order_by("contentnode_id", "preset").values_list("contentnode_id", "preset", "local_file_id")),
+                list(kolibri_models.LocalFile.objects.order_by("id").values_list("id", flat=True)),
+            ))
+        self.assertEqual(rows[0], rows[1])
+
+    @patch('contentcuration.utils.publish.INCREMENTAL_PUBLISH_MAX_CHANGED_RATIO', 1.0)
+    def test_title_change(self):
+        node = self.content_channel.main_tree.get_descendants().filter(kind_id="video").first()
+        node.title = "New title"
+        node.save()
+        self.assertTrue(self._update_incrementally())
+        self._assert_matches_full_export()
+
+    @patch('contentcuration.utils.publish.INCREMENTAL_PUBLISH_MAX_CHANGED_RATIO', 1.0)
+    def test_move(self):
+        topics = self.content_channel.main_tree.get_children()
+        node = topics.last().get_children().first()
+        node.move_to(topics.first(), "first-child")
+        self.assertTrue(self._update_incrementally())
+        self._assert_matches_full_export()
+
+    @patch('contentcuration.utils.publish.INCREMENTAL_PUBLISH_MAX_CHANGED_RATIO', 1.0)
+    def test_delete(self):
+        self.content_channel.main_tree.get_descendants().filter(kind_id="video").first().delete()
+        self.assertTrue(self._update_incrementally())
+        self._assert_matches_full_export()
+
+    def test_channel_language_change_falls_back(self):
+        self.assertTrue(
+            self.content_channel.main_tree.get_descendants().filter(language=None).exclude(kind_id="topic").exists()
+        )
+        self.content_channel.language = cc.Language.objects.exclude(pk=self.content_channel.language_id).first()
+        self.content_channel.save()
+        self.assertFalse(self._update_incrementally())
+
+    def test_large_diff_falls_back(self):
+        self.content_channel.main_tree.get_family().update(changed=True)
+        self.assertFalse(self._update_incrementally())
+
+
 class ChannelExportUtilityFunctionTestCase(StudioTestCase):
     @classmethod
     def setUpClass(cls):
@@ -192,6 +359,37 @@ class ChannelExportUtilityFunctionTestCase(StudioTestCase):
         manifest_collection = cc.File.objects.filter(contentnode=ccnode, preset_id=u"slideshow_manifest")
         assert len(manifest_collection) == 1
 
+    def test_create_perseus_exercises_matches_single_exercise(self):
+        content_channel = channel()
+        ccnode = content_channel.main_tree.get_descendants().filter(kind_id=content_kinds.EXERCISE).first()
+        kolibrinode = create_bare_contentnode(ccnode, ccnode.language, content_channel.id, content_channel.name)
+        exercise_data = process_assessment_metadata(ccnode, kolibrinode)
+        create_perseus_exercise(ccnode, kolibrinode, exercise_data)
+        expected = cc.File.objects.get(contentnode=ccnode, preset_id=format_presets.EXERCISE)
+
+        create_perseus_exercises([(ccnode, exercise_data, list(ccnode.assessment_items.order_by('order')))])
+        perseus_files = cc.File.objects.filter(contentnode=ccnode, preset_id=format_presets.EXERCISE)
+        assert len(perseus_files) == 1
+        self.assertEqual(perseus_files[0].checksum, expected.checksum)
+        self.assertEqual(perseus_files[0].file_size, expected.file_size)
+        self.assertEqual(perseus_files[0].file_on_disk.name, expected.file_on_disk.name)
+
+    def test_create_perseus_exercises_links_cached_archive(self):
+        content_channel = channel()
+        ccnode = content_channel.main_tree.get_descendants().filter(kind_id=content_kinds.EXERCISE).first()
+        kolibrinode = create_bare_contentnode(ccnode, ccnode.language, content_channel.id, content_channel.name)
+        exercise_data = process_assessment_metadata(ccnode, kolibrinode)
+        assessment_items = list(ccnode.assessment_items.order_by('order'))
+        create_perseus_exercises([(ccnode, exercise_data, assessment_items)])
+        expected = cc.File.objects.get(contentnode=ccnode, preset_id=format_presets.EXERCISE)
+
+        with patch("contentcuration.utils.publish.create_perseus_zip") as create_perseus_zip:
+            create_perseus_exercises([(ccnode, exercise_data, assessment_items)])
+            create_perseus_exercise(ccnode, kolibrinode, exercise_data)
+            create_perseus_zip.assert_not_called()
+        perseus_files = cc.File.objects.filter(contentnode=ccnode, preset_id=format_presets.EXERCISE)
+        self.assertEqual([f.checksum for f in perseus_files], [expected.checksum])
+
 
 class ChannelExportPrerequisiteTestCase(StudioTestCase):
     @classmethod
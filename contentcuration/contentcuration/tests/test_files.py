@@ -23,8 +23,11 @@ from contentcuration.models import ContentNode
 from contentcuration.models import delete_empty_file_reference
 from contentcuration.models import File
 from contentcuration.models import generate_object_storage_name
+from contentcuration.models import StagedFile
 from contentcuration.utils.files import create_thumbnail_from_base64
+from contentcuration.utils.files import get_file_diff
 from contentcuration.utils.files import get_thumbnail_encoding
+from contentcuration.utils.files import get_thumbnail_encodings
 from contentcuration.utils.nodes import map_files_to_node
 from contentcuration.utils.publish import create_associated_thumbnail
 
@@ -45,6 +48,24 @@ class FileThumbnailTestCase(BaseAPITestCase):
         encoding = get_thumbnail_encoding(str(self.thumbnail_fobj))
         self.assertEqual(encoding, generated_base64encoding())
 
+    def test_get_thumbnail_encoding_is_cached(self):
+        get_thumbnail_encoding(str(self.thumbnail_fobj))
+        with patch('contentcuration.utils.files.generate_thumbnail_encoding') as generate_mock:
+            encoding = get_thumbnail_encoding(str(self.thumbnail_fobj))
+            generate_mock.assert_not_called()
+        self.assertEqual(encoding, generated_base64encoding())
+
+    def test_get_thumbnail_encodings(self):
+        filename = str(self.thumbnail_fobj)
+        encodings = get_thumbnail_encodings([filename, filename, "data:image/png;base64,abc"])
+        self.assertEqual(encodings, {
+            filename: generated_base64encoding(),
+            "data:image/png;base64,abc": "data:image/png;base64,abc",
+        })
+
+    def test_get_thumbnail_encodings_skips_invalid_files(self):
+        self.assertEqual(get_thumbnail_encodings(["notarealchecksum.png"]), {})
+
     @patch('contentcuration.api.default_storage.save')
     @patch('contentcuration.api.default_storage.exists', return_value=True)
     def test_existing_thumbnail_is_not_created(self, storage_exists_mock, storage_save_mock):
@@ -84,3 +105,10 @@ class NodeFileDeletionTestCase(StudioTestCase):
         assert default_storage.exists(storage_path), 'file should be saved'
         delete_empty_file_reference(checksum, 'pdf')
         assert not default_storage.exists(storage_path), 'file should be deleted'
+
+    def test_delete_empty_file_reference_forgets_staged_file(self):
+        checksum, _, storage_path = write_raw_content_to_storage(b'some fake PDF data', ext='.pdf')
+        StagedFile.objects.create(checksum=checksum, extension='pdf', file_size=18)
+        delete_empty_file_reference(checksum, 'pdf')
+        assert not StagedFile.objects.filter(checksum=checksum).exists(), 'staged file should be deleted'
+        assert get_file_diff([checksum + '.pdf']) == [checksum + '.pdf'], 'file should be uploaded again'
@@ -130,3 +130,25 @@ class GoogleCloudStorageOpenTestCase(TestCase):
         assert isinstance(f, File)
         # This checks that an actual temp file was written on disk for the file.git
         assert f.name
+
+
+class GoogleCloudStorageExistsManyTestCase(TestCase):
+    """
+    Tests for GoogleCloudStorage.exists_many().
+    """
+
+    def setUp(self):
+        self.mock_client = create_autospec(Client)
+        self.storage = gcs(client=self.mock_client())
+        self.storage.bucket.get_blob.side_effect = lambda name: name if name != "missing.mp4" else None
+
+    def test_returns_existing_names(self):
+        self.assertEqual(self.storage.exists_many(["a.mp4", "missing.mp4", "b.png"], concurrency=2), {"a.mp4", "b.png"})
+
+    def test_checks_each_name_once(self):
+        self.storage.exists_many(["a.mp4", "a.mp4", "b.png"])
+        self.assertEqual(self.storage.bucket.get_blob.call_count, 2)
+
+    def test_no_names(self):
+        self.assertEqual(self.storage.exists_many([]), set())
+        self.storage.bucket.get_blob.assert_not_called()
@@ -3,16 +3,23 @@ import uuid
 import mock
 import pytest
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase
 from le_utils.constants import content_kinds
 
 from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
+from contentcuration.models import ChannelTree
 from contentcuration.models import ContentNode
 from contentcuration.models import File
 from contentcuration.models import generate_object_storage_name
+from contentcuration.models import get_user_tree_ids
 from contentcuration.models import Invitation
 from contentcuration.models import object_storage_name
 from contentcuration.tests import testdata
+from contentcuration.tests.base import BucketTestMixin
 from contentcuration.tests.base import StudioTestCase
 
 
@@ -412,6 +419,105 @@ class ContentNodeTestCase(PermissionQuerysetTestCase):
         self.assertQuerysetDoesNotContain(queryset, pk=contentnode.id)
 
 
+class ChannelTreeTestCase(StudioTestCase):
+    def test_trees_recorded_on_save(self):
+        channel = testdata.channel()
+        self.assertEqual(
+            dict(ChannelTree.objects.filter(channel=channel).values_list("tree_name", "tree_id")),
+            {"main_tree": channel.main_tree.tree_id, "trash_tree": channel.trash_tree.tree_id},
+        )
+
+    def test_trees_updated_when_deployed(self):
+        channel = testdata.channel()
+        main_tree = channel.main_tree
+        channel.staging_tree = testdata.tree()
+        channel.save()
+        channel.previous_tree = channel.main_tree
+        channel.main_tree = channel.staging_tree
+        channel.staging_tree = None
+        channel.save()
+        self.assertEqual(ChannelTree.objects.get(tree_id=channel.main_tree.tree_id).tree_name, "main_tree")
+        self.assertEqual(ChannelTree.objects.get(tree_id=main_tree.tree_id).tree_name, "previous_tree")
+        self.assertEqual(ChannelTree.objects.filter(channel=channel).count(), 3)
+
+    def test_get_channel(self):
+        channel = testdata.channel()
+        node = channel.trash_tree.get_descendants(include_self=True).first()
+        self.assertEqual(node.get_channel(), channel)
+        # The channel id is cached after the first lookup
+        with self.assertNumQueries(0):
+            self.assertEqual(node.get_channel_id(), channel.id)
+        self.assertIsNone(create_contentnode(settings.ORPHANAGE_ROOT_ID).get_channel())
+
+    def test_cached_channel_invalidated_when_tree_changes_channel(self):
+        channel = testdata.channel()
+        other_channel = testdata.channel()
+        tree = testdata.tree()
+        channel.staging_tree = tree
+        channel.save()
+        self.assertEqual(ChannelTree.get_channel_ids([tree.tree_id]), {tree.tree_id: channel.id})
+        channel.staging_tree = None
+        channel.save()
+        self.assertEqual(ChannelTree.get_channel_ids([tree.tree_id]), {})
+        other_channel.staging_tree = tree
+        other_channel.save()
+        self.assertEqual(ChannelTree.get_channel_ids([tree.tree_id]), {tree.tree_id: other_channel.id})
+
+
+class UserTreeIdsTestCase(StudioTestCase):
+    def test_invalidated_when_editors_change(self):
+        channel = testdata.channel()
+        user = testdata.user(email="treeids@le.com")
+        self.assertEqual(get_user_tree_ids(user.id)["edit"], set())
+
+        channel.editors.add(user)
+        self.assertIn(channel.main_tree.tree_id, get_user_tree_ids(user.id)["edit"])
+
+        channel.editors.remove(user)
+        channel.viewers.add(user)
+        tree_ids = get_user_tree_ids(user.id)
+        self.assertNotIn(channel.main_tree.tree_id, tree_ids["edit"])
+        self.assertIn(channel.main_tree.tree_id, tree_ids["view"])
+
+    def test_invalidated_when_trees_change(self):
+        channel = testdata.channel()
+        user = testdata.user(email="treeids@le.com")
+        channel.editors.add(user)
+        self.assertIn(channel.main_tree.tree_id, get_user_tree_ids(user.id)["edit"])
+
+        channel.staging_tree = testdata.tree()
+        channel.save()
+        self.assertIn(channel.staging_tree.tree_id, get_user_tree_ids(user.id)["edit"])
+
+
+class UserTreeIdsTransactionTestCase(TransactionTestCase, BucketTestMixin):
+    def setUp(self):
+        super(UserTreeIdsTransactionTestCase, self).setUp()
+        if not self.persist_bucket:
+            self.create_bucket()
+        call_command("loadconstants")
+        cache.clear()
+
+    def tearDown(self):
+        super(UserTreeIdsTransactionTestCase, self).tearDown()
+        if not self.persist_bucket:
+            self.delete_bucket()
+
+    def test_invalidated_when_editor_removal_commits(self):
+        channel = testdata.channel()
+        user = testdata.user(email="treeids@le.com")
+        channel.editors.add(user)
+        tree_ids = get_user_tree_ids(user.id)
+        self.assertIn(channel.main_tree.tree_id, tree_ids["edit"])
+
+        with transaction.atomic():
+            channel.editors.remove(user)
+            # A request on another connection, that doesn't see the removal yet, caches the tree ids
+            cache.set("tree_permissions_{}".format(user.id), tree_ids)
+
+        self.assertNotIn(channel.main_tree.tree_id, get_user_tree_ids(user.id)["edit"])
+
+
 class AssessmentItemTestCase(PermissionQuerysetTestCase):
     @property
     def base_queryset(self):
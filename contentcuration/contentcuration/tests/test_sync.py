@@ -6,6 +6,8 @@ from .base import BaseTestCase
 from .testdata import create_temp_file
 from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
+from contentcuration.models import ContentNode
+from contentcuration.models import ContentTag
 from contentcuration.utils.publish import mark_all_nodes_as_published
 from contentcuration.utils.sync import sync_channel
 
@@ -51,6 +53,27 @@ class SyncTestCase(BaseTestCase):
         db_file.save()
         return db_file
 
+    def test_get_original_nodes(self):
+        nodes = list(self.derivative_channel.main_tree.get_descendants())
+        with self.assertNumQueries(2):
+            original_nodes = ContentNode.objects.get_original_nodes(nodes)
+        for node in nodes:
+            self.assertEqual(original_nodes[node.pk], node.get_original_node())
+
+    def test_get_original_ids_for_legacy_nodes(self):
+        nodes = list(self.derivative_channel.main_tree.get_descendants())
+        originals = {node.pk: node.get_original_node() for node in nodes}
+        for node in nodes:
+            node.original_node = originals[node.pk]
+            node.original_channel_id = None
+            node.original_source_node_id = None
+        original_ids = ContentNode.objects.get_original_ids(nodes)
+        for node in nodes:
+            self.assertEqual(
+                original_ids[node.pk],
+                (self.channel.id, originals[node.pk].node_id),
+            )
+
     def test_sync_channel_noop(self):
         """
         Test that calling sync channel with no changed nodes does not change the target channel.
@@ -156,3 +179,46 @@ class SyncTestCase(BaseTestCase):
         self.assertEqual(target_ai.files.filter(checksum=db_file.checksum).count(), 1)
 
         self.assertTrue(self.derivative_channel.has_changes())
+
+    def test_sync_dry_run(self):
+        """
+        Test that a dry run reports the changes a sync would make, without making them.
+        """
+        contentnode = self.channel.main_tree.get_descendants().exclude(kind_id=content_kinds.TOPIC).first()
+        target_child = self.derivative_channel.main_tree.get_descendants().get(
+            source_node_id=contentnode.node_id
+        )
+        contentnode.title = "New title"
+        contentnode.save()
+        db_file = self._add_temp_file_to_content_node(contentnode)
+
+        diff = sync_channel(
+            self.derivative_channel, sync_attributes=True, sync_files=True, dry_run=True
+        )
+
+        self.assertEqual(diff[target_child.id]["attributes"], {"title": "New title"})
+        self.assertIn(db_file.checksum, diff[target_child.id]["files"]["added"])
+        target_child.refresh_from_db()
+        self.assertNotEqual(target_child.title, "New title")
+        self.assertFalse(target_child.files.filter(checksum=db_file.checksum).exists())
+        self.assertFalse(self.derivative_channel.has_changes())
+
+    def test_sync_tags(self):
+        """
+        Test that syncing tags adds the tags of the original node and removes those it doesn't have.
+        """
+        contentnode = self.channel.main_tree.get_descendants().exclude(kind_id=content_kinds.TOPIC).first()
+        target_child = self.derivative_channel.main_tree.get_descendants().get(
+            source_node_id=contentnode.node_id
+        )
+        contentnode.tags.add(ContentTag.objects.create(tag_name="added", channel=self.channel))
+        target_child.tags.add(ContentTag.objects.create(tag_name="removed"))
+
+        sync_channel(self.derivative_channel, sync_tags=True)
+
+        self.assertEqual(
+            sorted(target_child.tags.values_list("tag_name", flat=True)),
+            sorted(contentnode.tags.values_list("tag_name", flat=True)),
+        )
+        self.assertTrue(target_child.tags.filter(tag_name="added", channel__isnull=True).exists())
+        self.assertTrue(self.derivative_channel.has_changes())
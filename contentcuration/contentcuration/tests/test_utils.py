@@ -15,6 +15,7 @@ from le_utils.constants import file_formats
 from le_utils.constants import format_presets
 from le_utils.constants import languages
 from le_utils.constants import licenses
+from mock import patch
 
 from .base import StudioTestCase
 from contentcuration.models import ContentKind
@@ -24,6 +25,7 @@ from contentcuration.models import FormatPreset
 from contentcuration.models import generate_object_storage_name
 from contentcuration.models import Language
 from contentcuration.models import License
+from contentcuration.models import StagedFile
 from contentcuration.utils.files import get_file_diff
 
 
@@ -72,6 +74,30 @@ class GetFileDiffTestCase(StudioTestCase):
         ]
         assert get_file_diff(files) == ["rando"]
 
+    def test_staged_files_are_not_checked_in_storage(self):
+        """
+        Test that files staged with the same checksum and extension are reported as present
+        without asking the storage backend.
+        """
+        StagedFile.objects.create(checksum="stagedfile", extension=file_formats.MP4, file_size=1)
+        with patch("contentcuration.utils.files.get_existing_files", return_value=set()) as get_existing_files:
+            assert get_file_diff(["stagedfile.mp4", "unknownfile.png"]) == ["unknownfile.png"]
+            get_existing_files.assert_called_once_with(
+                {generate_object_storage_name("unknownfile", "unknownfile.png")}
+            )
+
+    def test_staged_checksum_with_other_extension_is_checked_in_storage(self):
+        StagedFile.objects.create(checksum="stagedfile", extension=file_formats.MP4, file_size=1)
+        assert get_file_diff(["stagedfile.png"]) == ["stagedfile.png"]
+
+    def test_file_without_upload_is_checked_in_storage(self):
+        """
+        Test that a File is not taken as proof of its upload, as one is created before
+        the file is uploaded to a presigned URL.
+        """
+        File.objects.create(checksum="notuploaded", file_format_id=file_formats.PNG)
+        assert get_file_diff(["notuploaded.png"]) == ["notuploaded.png"]
+
 
 class FileFormatsTestCase(StudioTestCase):
     """
@@ -2,6 +2,7 @@
 """
 Tests for contentcuration.views.internal functions.
 """
+import json
 import uuid
 from builtins import filter
 from builtins import zip
@@ -47,6 +48,8 @@ class ApiAddNodesToTreeTestCase(StudioTestCase):
     Tests for contentcuration.views.internal.api_add_nodes_to_tree function.
     """
 
+    endpoint = "api_add_nodes_to_tree"
+
     def setUp(self):
         super(ApiAddNodesToTreeTestCase, self).setUp()
         # first setup a test channel...
@@ -90,14 +93,14 @@ class ApiAddNodesToTreeTestCase(StudioTestCase):
             ],
         }
         self.resp = self.admin_client().post(
-            reverse_lazy("api_add_nodes_to_tree"), data=self.sample_data, format="json"
+            reverse_lazy(self.endpoint), data=self.sample_data, format="json"
         )
 
     def test_404_no_permission(self):
         client = APIClient()
         client.force_authenticate(user())
         response = client.post(
-            reverse_lazy("api_add_nodes_to_tree"), self.sample_data, format="json"
+            reverse_lazy(self.endpoint), self.sample_data, format="json"
         )
         self.assertEqual(response.status_code, 404)
 
@@ -143,6 +146,8 @@ class ApiAddExerciseNodesToTreeTestCase(StudioTestCase):
     of type Exercise that contain questions with associated image files.
     """
 
+    endpoint = "api_add_nodes_to_tree"
+
     def setUp(self):
         super(ApiAddExerciseNodesToTreeTestCase, self).setUp()
         # first setup a test channel...
@@ -223,14 +228,14 @@ class ApiAddExerciseNodesToTreeTestCase(StudioTestCase):
             ],
         }
         self.resp = self.admin_client().post(
-            reverse_lazy("api_add_nodes_to_tree"), data=self.sample_data, format="json"
+            reverse_lazy(self.endpoint), data=self.sample_data, format="json"
         )
 
     def test_404_no_permission(self):
         client = APIClient()
         client.force_authenticate(user())
         response = client.post(
-            reverse_lazy("api_add_nodes_to_tree"), self.sample_data, format="json"
+            reverse_lazy(self.endpoint), self.sample_data, format="json"
         )
         self.assertEqual(response.status_code, 404)
 
@@ -313,6 +318,77 @@ class ApiAddExerciseNodesToTreeTestCase(StudioTestCase):
         ), "wrong original_filename"
 
 
+class ApiAddNodesToTreeBulkTestCase(ApiAddNodesToTreeTestCase):
+    """
+    Tests for contentcuration.views.internal.api_add_nodes_to_tree_bulk function.
+    """
+
+    endpoint = "api_add_nodes_to_tree_bulk"
+
+    def _ndjson(self, root_id, content_data):
+        lines = [{"root_id": root_id}] + content_data
+        return "\n".join(json.dumps(line) for line in lines)
+
+    def test_ndjson_creates_nodes(self):
+        node_data = dict(self.sample_data["content_data"][0], node_id=uuid.uuid4().hex, title="Streamed node", tags=["a", "b"])
+        response = self.admin_client().post(
+            reverse_lazy(self.endpoint),
+            data=self._ndjson(self.root_node.id, [node_data]),
+            content_type=internal.NDJSON_CONTENT_TYPE,
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        node = ContentNode.objects.get(title="Streamed node", parent=self.root_node)
+        self.assertEqual(response.data["root_ids"], {node_data["node_id"]: node.pk})
+        self.assertEqual(sorted(node.tags.values_list("tag_name", flat=True)), ["a", "b"])
+
+    def test_skips_existing_nodes(self):
+        response = self.admin_client().post(reverse_lazy(self.endpoint), data=self.sample_data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["root_ids"], {})
+        self.assertEqual(ContentNode.objects.filter(title=self.title).count(), 1)
+
+    def test_batches_keep_tree_valid(self):
+        content_data = [
+            dict(self.sample_data["content_data"][0], node_id=uuid.uuid4().hex, title="Batched node {}".format(i))
+            for i in range(5)
+        ]
+        internal.bulk_convert_data_to_nodes(self.admin_user, content_data, self.root_node.id, batch_size=2)
+        children = list(self.root_node.get_children())
+        self.assertEqual(
+            [child.title for child in children[-5:]],
+            ["Batched node {}".format(i) for i in range(5)],
+        )
+        self.assertEqual(sorted(child.sort_order for child in children), [child.sort_order for child in children])
+        self.root_node.refresh_from_db()
+        self.assertEqual(self.root_node.get_descendant_count(), self.root_node.get_descendants().count())
+
+    def test_400_invalid_license(self):
+        node_data = dict(self.sample_data["content_data"][0], node_id=uuid.uuid4().hex, license="Not a license")
+        response = self.admin_client().post(
+            reverse_lazy(self.endpoint), data={"root_id": self.root_node.id, "content_data": [node_data]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ContentNode.objects.filter(node_id=node_data["node_id"]).exists())
+
+    def test_400_missing_file(self):
+        file_data = dict(self.sample_data["content_data"][0]["files"][0], filename="notuploaded.mp4")
+        node_data = dict(self.sample_data["content_data"][0], node_id=uuid.uuid4().hex, files=[file_data])
+        response = self.admin_client().post(
+            reverse_lazy(self.endpoint), data={"root_id": self.root_node.id, "content_data": [node_data]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(ContentNode.objects.filter(node_id=node_data["node_id"]).exists())
+
+
+class ApiAddExerciseNodesToTreeBulkTestCase(ApiAddExerciseNodesToTreeTestCase):
+    """
+    Tests for contentcuration.views.internal.api_add_nodes_to_tree_bulk function for nodes
+    of type Exercise that contain questions with associated image files.
+    """
+
+    endpoint = "api_add_nodes_to_tree_bulk"
+
+
 class PublishEndpointTestCase(BaseAPITestCase):
     @classmethod
     def setUpClass(cls):
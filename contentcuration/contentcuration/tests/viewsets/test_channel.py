@@ -2,14 +2,21 @@ from __future__ import absolute_import
 
 import uuid
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.http import QueryDict
+from le_utils.constants import content_kinds
+from mock import patch
 
 from contentcuration import models
 from contentcuration.tests import testdata
 from contentcuration.tests.base import StudioAPITestCase
+from contentcuration.utils.publish import fill_channel_facets
 from contentcuration.viewsets.sync.constants import CHANNEL
 from contentcuration.viewsets.sync.utils import generate_create_event
 from contentcuration.viewsets.sync.utils import generate_delete_event
+from contentcuration.viewsets.pagination import cache_query_count
+from contentcuration.viewsets.pagination import get_count_cache_key
 from contentcuration.viewsets.sync.utils import generate_update_event
 
 
@@ -392,3 +399,93 @@ class CRUDTestCase(StudioAPITestCase):
             self.fail("Channel was not deleted")
         except models.Channel.DoesNotExist:
             pass
+
+
+class CatalogFacetsTestCase(StudioAPITestCase):
+    def test_filter_by_facets(self):
+        channel = testdata.channel()
+        channel.public = True
+        channel.save()
+        empty_channel = models.Channel.objects.create(name="empty", public=True)
+        for c in (channel, empty_channel):
+            fill_channel_facets(c)
+
+        response = self.client.get(reverse("catalog-list"), {"kinds": "exercise,audio"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([c["id"] for c in response.data], [channel.id])
+
+        response = self.client.get(reverse("catalog-list"), {"assessments": True}, format="json")
+        self.assertEqual([c["id"] for c in response.data], [channel.id])
+
+    def test_facets_leave_out_incomplete_nodes(self):
+        channel = testdata.channel()
+        exercises = channel.main_tree.get_descendants().filter(kind_id=content_kinds.EXERCISE)
+        self.assertTrue(exercises.exists())
+        exercises.update(complete=False)
+        fill_channel_facets(channel)
+        facets = models.ChannelFacets.objects.get(channel=channel)
+        self.assertNotIn(content_kinds.EXERCISE, facets.kinds)
+        self.assertFalse(facets.has_exercises)
+
+    def test_channel_list_filters_on_main_tree(self):
+        user = testdata.user()
+        channel = testdata.channel()
+        channel.editors.add(user)
+        self.client.force_authenticate(user=user)
+
+        # The channel has never been published, so has no facets
+        response = self.client.get(reverse("channel-list"), {"edit": True, "kinds": "exercise"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([c["id"] for c in response.data], [channel.id])
+
+
+class CatalogPaginationTestCase(StudioAPITestCase):
+    def setUp(self):
+        super(CatalogPaginationTestCase, self).setUp()
+        cache.clear()
+        self.channels = [
+            models.Channel.objects.create(name="channel {}".format(i % 3), public=True)
+            for i in range(5)
+        ]
+
+    def test_cursor_pages(self):
+        response = self.client.get(
+            reverse("catalog-list"), {"public": True, "page_size": 2, "cursor": ""}, format="json"
+        )
+        channel_ids = []
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response.data["count"], 5)
+            channel_ids.extend(c["id"] for c in response.data["results"])
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"], format="json")
+        self.assertEqual(
+            channel_ids,
+            [c.id for c in sorted(self.channels, key=lambda c: (c.name, c.id))],
+        )
+
+    def test_estimated_count(self):
+        with patch("contentcuration.viewsets.pagination.estimate_count", return_value=50000), patch(
+            "contentcuration.tasks.count_query_task"
+        ) as mock_task:
+            response = self.client.get(reverse("catalog-list"), {"public": True, "page_size": 2}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["count"], 50000)
+        self.assertTrue(response.data["count_is_estimate"])
+        self.assertEqual(len(response.data["results"]), 2)
+        mock_task.delay.assert_called_once()
+
+    def test_cache_query_count(self):
+        queryset = models.Channel.objects.filter(public=True).values("id")
+        sql, params = queryset.query.sql_with_params()
+        cache.add("count-test:counting", True)
+        cache_query_count(sql, params, "count-test")
+        self.assertEqual(cache.get("count-test"), 5)
+        self.assertIsNone(cache.get("count-test:counting"))
+
+    def test_count_cache_key_ignores_order(self):
+        self.assertEqual(
+            get_count_cache_key("catalog", QueryDict("kinds=video,audio&public=true&page=2"), exclude=("page",)),
+            get_count_cache_key("catalog", QueryDict("public=true&kinds=audio,video"), exclude=("page",)),
+        )
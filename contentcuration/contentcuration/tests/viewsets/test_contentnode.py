@@ -24,6 +24,7 @@ from contentcuration.viewsets.sync.constants import CONTENTNODE_PREREQUISITE
 from contentcuration.viewsets.sync.utils import generate_copy_event
 from contentcuration.viewsets.sync.utils import generate_create_event
 from contentcuration.viewsets.sync.utils import generate_delete_event
+from contentcuration.viewsets.sync.utils import generate_move_event
 from contentcuration.viewsets.sync.utils import generate_update_event
 
 
@@ -326,6 +327,32 @@ class ContentNodeViewSetTestCase(StudioAPITestCase):
             )
         self.assertEqual(response.status_code, 403, response.content)
 
+    def test_list_contentnodes_by_cursor(self):
+        user = testdata.user()
+        channel = testdata.channel()
+        channel.editors.add(user)
+        for _ in range(5):
+            create_contentnode(channel.main_tree_id)
+        children = list(
+            models.ContentNode.objects.filter(parent_id=channel.main_tree_id)
+            .order_by("lft")
+            .values_list("id", flat=True)
+        )
+
+        self.client.force_authenticate(user=user)
+        listed = []
+        params = {"parent": channel.main_tree_id, "max_results": 2}
+        while True:
+            response = self.client.get(reverse("contentnode-list"), params, format="json")
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            listed.extend(node["id"] for node in response.data["results"])
+            if response.data["cursor"] is None:
+                break
+            params["cursor"] = response.data["cursor"]
+        self.assertEqual(listed, children)
+        self.assertNotIn("tree_id", response.data["results"][0])
+
 
 class SyncTestCase(StudioAPITestCase):
     @property
@@ -788,6 +815,37 @@ class SyncTestCase(StudioAPITestCase):
         except models.ContentNode.DoesNotExist:
             pass
 
+    def test_move_contentnodes(self):
+        user = testdata.user()
+        channel = testdata.channel()
+        channel.editors.add(user)
+        target = create_and_get_contentnode(channel.main_tree_id)
+        target.kind_id = content_kinds.TOPIC
+        target.save()
+        contentnodes = [create_and_get_contentnode(channel.main_tree_id) for _ in range(3)]
+        other_channel = testdata.channel()
+        other_contentnode = create_and_get_contentnode(other_channel.main_tree_id)
+
+        self.client.force_authenticate(user=user)
+        with self.settings(TEST_ENV=False):
+            response = self.client.post(
+                self.sync_url,
+                [
+                    generate_move_event(contentnode.id, CONTENTNODE, target.id, "last-child")
+                    for contentnode in contentnodes + [other_contentnode]
+                ],
+                format="json",
+            )
+        self.assertEqual(response.status_code, 207, response.content)
+        self.assertEqual(len(response.data["errors"]), 1)
+        target.refresh_from_db()
+        self.assertEqual(
+            list(target.get_children().values_list("id", flat=True)),
+            [contentnode.id for contentnode in contentnodes],
+        )
+        other_contentnode.refresh_from_db()
+        self.assertEqual(other_contentnode.parent_id, other_channel.main_tree_id)
+
     def test_cannot_delete_some_contentnodes(self):
         user = testdata.user()
 
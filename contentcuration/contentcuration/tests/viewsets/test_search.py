@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+
+import uuid
+
+from django.core.urlresolvers import reverse
+from le_utils.constants import content_kinds
+from mock import patch
+from search.content_locations import refresh_content_locations
+from search.models import ContentNodeSearchVector
+
+from contentcuration.tests import testdata
+from contentcuration.tests.base import StudioAPITestCase
+from contentcuration.views.internal import create_node
+from contentcuration.viewsets.contentnode import set_tags
+from contentcuration.viewsets.pagination import get_count
+
+
+class SearchTestCase(StudioAPITestCase):
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+        self.channel = testdata.channel()
+        self.channel.public = True
+        self.channel.save()
+        self.user = testdata.user()
+        self.client.force_authenticate(user=self.user)
+        self.node = self.channel.main_tree.get_descendants().exclude(kind_id=content_kinds.TOPIC).first()
+        self.node.title = "Photosynthesis in plants"
+        self.node.save()
+
+    def get_results(self, keywords):
+        response = self.client.get(
+            reverse("search-list"), {"keywords": keywords}, format="json", HTTP_ACCEPT_LANGUAGE="en"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["results"]
+
+    def search(self, keywords):
+        return [node["id"] for node in self.get_results(keywords)]
+
+    def test_search_by_word_prefix(self):
+        self.assertEqual(self.search("photosynth"), [self.node.id])
+
+    def test_search_by_stemmed_word(self):
+        self.assertEqual(self.search("planting"), [self.node.id])
+
+    def test_search_by_tag(self):
+        set_tags({self.node.id: {"botany": True}})
+        self.assertEqual(self.search("botany"), [self.node.id])
+
+    def test_search_by_tag_of_uploaded_node(self):
+        node = create_node(
+            {
+                "title": "Uploaded node",
+                "kind": content_kinds.DOCUMENT,
+                "node_id": uuid.uuid4().hex,
+                "content_id": uuid.uuid4().hex,
+                "description": "",
+                "author": "",
+                "license": None,
+                "extra_fields": "{}",
+                "tags": ["zoology"],
+            },
+            self.channel.main_tree,
+            1,
+        )
+        self.assertEqual(self.search("zoology"), [node.id])
+
+    def test_search_ranks_title_first(self):
+        other_node = self.channel.main_tree.get_descendants().exclude(
+            kind_id=content_kinds.TOPIC
+        ).exclude(content_id=self.node.content_id).first()
+        other_node.description = "Photosynthesis"
+        other_node.save()
+        self.assertEqual(self.search("photosynthesis"), [self.node.id, other_node.id])
+
+    def test_copy_is_indexed(self):
+        node_copy = self.node.copy_to(target=self.channel.main_tree)
+        self.assertTrue(
+            ContentNodeSearchVector.objects.filter(contentnode_id=node_copy.id).exists()
+        )
+
+    def test_search_shows_content_once(self):
+        other_channel = testdata.channel()
+        other_channel.public = True
+        other_channel.save()
+        node_copy = self.node.copy_to(target=other_channel.main_tree)
+        refresh_content_locations([self.channel.main_tree.tree_id, other_channel.main_tree.tree_id])
+
+        results = self.get_results("photosynthesis")
+        self.assertEqual([node["id"] for node in results], [self.node.id])
+        self.assertEqual(set(results[0]["location_ids"]), {self.node.id, node_copy.id})
+
+    def test_search_shows_content_once_canonical_node_is_deleted(self):
+        other_channel = testdata.channel()
+        other_channel.public = True
+        other_channel.save()
+        node_copy = self.node.copy_to(target=other_channel.main_tree)
+        refresh_content_locations([self.channel.main_tree.tree_id, other_channel.main_tree.tree_id])
+        self.node.move_to(self.channel.trash_tree, "last-child")
+
+        results = self.get_results("photosynthesis")
+        self.assertEqual([node["id"] for node in results], [node_copy.id])
+        self.assertEqual(results[0]["location_ids"], [node_copy.id])
+
+    def test_counts_are_cached_per_language(self):
+        cache_keys = []
+        for language in ("en", "es"):
+            with patch("contentcuration.viewsets.pagination.get_count", wraps=get_count) as mock_get_count:
+                response = self.client.get(
+                    reverse("search-list"), {"keywords": "plants"}, format="json", HTTP_ACCEPT_LANGUAGE=language
+                )
+            self.assertEqual(response.status_code, 200, response.content)
+            cache_keys.append(mock_get_count.call_args[0][1])
+        self.assertNotEqual(cache_keys[0], cache_keys[1])
+
+    def test_search_shows_unpublished_content_once(self):
+        other_channel = testdata.channel()
+        other_channel.public = True
+        other_channel.save()
+        node_copy = self.node.copy_to(target=other_channel.main_tree)
+
+        results = self.get_results("photosynthesis")
+        self.assertEqual([node["id"] for node in results], [self.node.id])
+        self.assertEqual(set(results[0]["location_ids"]), {self.node.id, node_copy.id})
+
+    def test_search_leaves_out_deleted_locations(self):
+        other_channel = testdata.channel()
+        other_channel.public = True
+        other_channel.save()
+        node_copy = self.node.copy_to(target=other_channel.main_tree)
+        refresh_content_locations([self.channel.main_tree.tree_id, other_channel.main_tree.tree_id])
+        node_copy.move_to(other_channel.trash_tree, "last-child")
+
+        results = self.get_results("photosynthesis")
+        self.assertEqual([node["id"] for node in results], [self.node.id])
+        self.assertEqual(results[0]["location_ids"], [self.node.id])
@@ -0,0 +1,300 @@
+from __future__ import absolute_import
+
+import threading
+import time
+import uuid
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from le_utils.constants import content_kinds
+from mock import patch
+from rest_framework.test import APITransactionTestCase
+
+from contentcuration import models
+from contentcuration.tests import testdata
+from contentcuration.tests.base import BucketTestMixin
+from contentcuration.tests.base import StudioAPITestCase
+from contentcuration.tests.base import StudioTestCase
+from contentcuration.viewsets.sync.constants import ASSESSMENTITEM
+from contentcuration.viewsets.sync.constants import CHANNEL
+from contentcuration.viewsets.sync.constants import CONTENTNODE
+from contentcuration.viewsets.sync.constants import FILE
+from contentcuration.viewsets.sync.constants import SAVEDSEARCH
+from contentcuration.viewsets.sync.endpoint import coalesce_changes
+from contentcuration.viewsets.sync.endpoint import expand_coalesced_errors
+from contentcuration.viewsets.sync.endpoint import get_change_groups
+from contentcuration.viewsets.sync.endpoint import get_change_keys
+from contentcuration.viewsets.sync.endpoint import get_group_dependencies
+from contentcuration.viewsets.sync.endpoint import handle_changes
+from contentcuration.viewsets.sync.events import InMemoryEventBus
+from contentcuration.viewsets.sync.utils import add_event_for_users
+from contentcuration.viewsets.sync.utils import generate_copy_event
+from contentcuration.viewsets.sync.utils import generate_delete_event
+from contentcuration.viewsets.sync.utils import generate_move_event
+from contentcuration.viewsets.sync.utils import generate_update_event
+from contentcuration.viewsets.sync.utils import get_and_clear_user_events
+
+
+def return_changes(request, viewset_class, change_type, changes):
+    return None, changes
+
+
+def return_changes_slowly(request, viewset_class, change_type, changes):
+    time.sleep(0.1)
+    return None, changes
+
+
+class SyncEndpointTestCase(StudioAPITestCase):
+    @property
+    def sync_url(self):
+        return reverse("sync")
+
+    def setUp(self):
+        super(SyncEndpointTestCase, self).setUp()
+        self.user = testdata.user()
+        self.client.force_authenticate(user=self.user)
+        self.node_id = uuid.uuid4().hex
+        self.changes = [
+            generate_update_event(uuid.uuid4().hex, SAVEDSEARCH, {"name": "search"}),
+            generate_move_event(self.node_id, CONTENTNODE, uuid.uuid4().hex, "last-child"),
+            generate_update_event([uuid.uuid4().hex, uuid.uuid4().hex], ASSESSMENTITEM, {"order": 1}),
+            generate_update_event(uuid.uuid4().hex, FILE, {"contentnode": self.node_id}),
+        ]
+        for rev, change in enumerate(self.changes):
+            change["rev"] = rev
+
+    def test_group_dependencies(self):
+        groups = get_change_groups(self.changes)
+        tables = [table_name for table_name, _, _ in groups]
+        self.assertEqual(tables, [CONTENTNODE, ASSESSMENTITEM, FILE, SAVEDSEARCH])
+
+        dependencies = get_group_dependencies(groups)
+        self.assertEqual(dependencies[tables.index(SAVEDSEARCH)], set())
+        # Changes to what belongs to content nodes wait for the content node changes
+        self.assertEqual(dependencies[tables.index(ASSESSMENTITEM)], {tables.index(CONTENTNODE)})
+        self.assertEqual(dependencies[tables.index(FILE)], {tables.index(CONTENTNODE)})
+
+    def test_change_keys_include_copy_source(self):
+        change = generate_copy_event(uuid.uuid4().hex, CONTENTNODE, self.node_id, uuid.uuid4().hex)
+        self.assertIn(self.node_id, get_change_keys(change))
+
+    @patch("contentcuration.viewsets.sync.endpoint.handle_changes", side_effect=return_changes)
+    def test_concurrent_sync(self, mock_handle_changes):
+        with self.settings(SYNC_CONCURRENCY=4):
+            response = self.client.post(self.sync_url, self.changes, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(mock_handle_changes.call_count, 4)
+        self.assertEqual(
+            sorted(change["rev"] for change in response.data["changes"]),
+            list(range(len(self.changes))),
+        )
+
+    @patch("contentcuration.viewsets.sync.endpoint.handle_changes", side_effect=return_changes_slowly)
+    def test_sync_time_budget_defers_changes(self, mock_handle_changes):
+        with self.settings(SYNC_TIME_BUDGET=0.01):
+            response = self.client.post(self.sync_url, self.changes, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(mock_handle_changes.call_count, 1)
+        self.assertEqual(len(response.data["changes"]), 1)
+        self.assertEqual(
+            sorted(change["rev"] for change in response.data["changes"] + response.data["deferred"]),
+            list(range(len(self.changes))),
+        )
+
+
+class ConcurrentSyncTestCase(APITransactionTestCase, BucketTestMixin):
+    """
+    Applies changes concurrently with the real viewsets, which needs committed data
+    as each worker has its own database connection
+    """
+
+    def setUp(self):
+        super(ConcurrentSyncTestCase, self).setUp()
+        if not self.persist_bucket:
+            self.create_bucket()
+        call_command("loadconstants")
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        super(ConcurrentSyncTestCase, self).tearDown()
+        if not self.persist_bucket:
+            self.delete_bucket()
+
+    def test_copy_is_applied_before_edits_to_its_source(self):
+        assessmentitem = models.AssessmentItem.objects.create(
+            assessment_id=uuid.uuid4().hex,
+            contentnode=self.channel.main_tree.get_descendants().filter(kind_id=content_kinds.EXERCISE).first(),
+            question="original question",
+        )
+        new_node_id = uuid.uuid4().hex
+        with self.settings(SYNC_CONCURRENCY=4):
+            response = self.client.post(
+                reverse("sync"),
+                [
+                    generate_copy_event(
+                        new_node_id, CONTENTNODE, assessmentitem.contentnode_id, self.channel.main_tree_id
+                    ),
+                    generate_update_event(
+                        [assessmentitem.contentnode_id, assessmentitem.assessment_id],
+                        ASSESSMENTITEM,
+                        {"question": "edited question"},
+                    ),
+                ],
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        assessmentitem.refresh_from_db()
+        self.assertEqual(assessmentitem.question, "edited question")
+        self.assertEqual(
+            models.AssessmentItem.objects.get(contentnode_id=new_node_id).question,
+            "original question",
+        )
+
+
+class InMemoryEventBusTestCase(StudioTestCase):
+    def setUp(self):
+        super(InMemoryEventBusTestCase, self).setUp()
+        self.bus = InMemoryEventBus(max_length=2, ttl=60)
+
+    def test_publish_to_many_users(self):
+        event = generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": "channel"})
+        self.bus.publish([1, 2], event)
+        self.assertEqual(self.bus.drain(1), [event])
+        self.assertEqual(self.bus.drain(1), [])
+        self.assertEqual(self.bus.drain(2), [event])
+
+    def test_queue_is_trimmed(self):
+        events = [generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": str(i)}) for i in range(3)]
+        for event in events:
+            self.bus.publish([1], event)
+        self.assertEqual(self.bus.drain(1), events[1:])
+
+    def test_events_expire(self):
+        self.bus.publish([1], generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": "channel"}))
+        with patch("contentcuration.viewsets.sync.events.time.time", return_value=time.time() + 61):
+            self.assertEqual(self.bus.drain(1), [])
+
+    def test_sync_returns_user_events(self):
+        user = testdata.user()
+        event = generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": "channel"})
+        add_event_for_users([user.id], event)
+        self.assertEqual(get_and_clear_user_events(user.id), [event])
+        self.assertEqual(get_and_clear_user_events(user.id), [])
+
+    def test_wait_returns_published_events(self):
+        event = generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": "channel"})
+        publisher = threading.Timer(0.1, self.bus.publish, args=([1], event))
+        publisher.start()
+        start = time.time()
+        self.assertEqual(self.bus.wait(1, 5), [event])
+        self.assertLess(time.time() - start, 5)
+        publisher.join()
+
+    def test_wait_times_out(self):
+        self.assertEqual(self.bus.wait(1, 0.1), [])
+
+
+class SyncEventsTestCase(StudioAPITestCase):
+    def setUp(self):
+        super(SyncEventsTestCase, self).setUp()
+        self.user = testdata.user()
+        self.client.force_authenticate(user=self.user)
+
+    def test_returns_user_events(self):
+        event = generate_update_event(uuid.uuid4().hex, CHANNEL, {"name": "channel"})
+        add_event_for_users([self.user.id], event)
+        with self.settings(SYNC_POLL_ENABLED=True):
+            response = self.client.get(reverse("sync_events"), {"timeout": 1})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["changes"], [event])
+
+    def test_returns_no_events_after_timeout(self):
+        with self.settings(SYNC_POLL_ENABLED=True):
+            response = self.client.get(reverse("sync_events"), {"timeout": 0.1})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data["changes"], [])
+
+    @patch("contentcuration.viewsets.sync.endpoint.wait_for_user_events", return_value=[])
+    def test_does_not_wait_unless_enabled(self, mock_wait_for_user_events):
+        with self.settings(SYNC_POLL_ENABLED=False):
+            response = self.client.get(reverse("sync_events"), {"timeout": 10})
+        self.assertEqual(response.status_code, 200, response.content)
+        mock_wait_for_user_events.assert_called_once_with(self.user.id, 0)
+
+    def test_invalid_timeout(self):
+        response = self.client.get(reverse("sync_events"), {"timeout": "soon"})
+        self.assertEqual(response.status_code, 400, response.content)
+
+
+class CoalesceChangesTestCase(StudioTestCase):
+    def test_merges_updates(self):
+        key = uuid.uuid4().hex
+        changes = [
+            generate_update_event(key, CONTENTNODE, {"title": "a", "extra_fields.randomize": True}),
+            generate_update_event(uuid.uuid4().hex, CONTENTNODE, {"title": "other"}),
+            generate_update_event(key, CONTENTNODE, {"title": "b", "extra_fields": {"m": 1}}),
+            generate_update_event(key, CONTENTNODE, {"extra_fields.n": 2}),
+        ]
+        coalesced, replaced = coalesce_changes(changes)
+        self.assertEqual(len(coalesced), 2)
+        self.assertEqual(coalesced[1]["mods"], {"title": "b", "extra_fields": {"m": 1, "n": 2}})
+        self.assertEqual(replaced[id(coalesced[1])][1], [changes[0], changes[2], changes[3]])
+
+    def test_drops_updates_before_delete(self):
+        key = uuid.uuid4().hex
+        changes = [
+            generate_update_event(key, CONTENTNODE, {"title": "a"}),
+            generate_delete_event(key, CONTENTNODE),
+        ]
+        coalesced, _ = coalesce_changes(changes)
+        self.assertEqual(coalesced, [changes[1]])
+
+    def test_collapses_moves(self):
+        key = uuid.uuid4().hex
+        other_key = uuid.uuid4().hex
+        changes = [
+            generate_move_event(key, CONTENTNODE, uuid.uuid4().hex, "last-child"),
+            generate_move_event(key, CONTENTNODE, uuid.uuid4().hex, "last-child"),
+            # Moving another node relative to the moved node stops earlier moves from collapsing
+            generate_move_event(other_key, CONTENTNODE, key, "right"),
+            generate_move_event(key, CONTENTNODE, uuid.uuid4().hex, "first-child"),
+        ]
+        coalesced, replaced = coalesce_changes(changes)
+        self.assertEqual(coalesced, changes[1:])
+        self.assertEqual(replaced[id(changes[1])][1], changes[:2])
+
+    def test_errors_reported_on_original_changes(self):
+        key = uuid.uuid4().hex
+        changes = [
+            generate_update_event(key, CONTENTNODE, {"title": "a"}),
+            generate_update_event(key, CONTENTNODE, {"title": "b"}),
+        ]
+        coalesced, replaced = coalesce_changes(changes)
+        coalesced[0]["errors"] = ["Not found"]
+        errors = expand_coalesced_errors(coalesced, replaced)
+        self.assertEqual(errors, [dict(change, errors=["Not found"]) for change in changes])
+
+
+class SyncCoalescingTestCase(StudioAPITestCase):
+    def test_successive_updates(self):
+        user = testdata.user()
+        channel = testdata.channel()
+        channel.editors.add(user)
+        contentnode = channel.main_tree.get_descendants().first()
+        self.client.force_authenticate(user=user)
+        with patch("contentcuration.viewsets.sync.endpoint.handle_changes", wraps=handle_changes) as mock_handle_changes:
+            response = self.client.post(
+                reverse("sync"),
+                [
+                    generate_update_event(contentnode.id, CONTENTNODE, {"title": "title {}".format(i)})
+                    for i in range(10)
+                ],
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(mock_handle_changes.call_args[0][3]), 1)
+        contentnode.refresh_from_db()
+        self.assertEqual(contentnode.title, "title 9")
@@ -42,6 +42,7 @@ from contentcuration.viewsets.contentnode import ContentNodeViewSet
 from contentcuration.viewsets.file import FileViewSet
 from contentcuration.viewsets.invitation import InvitationViewSet
 from contentcuration.viewsets.sync.endpoint import sync
+from contentcuration.viewsets.sync.endpoint import sync_events
 from contentcuration.viewsets.task import TaskViewSet
 from contentcuration.viewsets.user import AdminUserViewSet
 from contentcuration.viewsets.user import ChannelUserViewSet
@@ -87,6 +88,7 @@ urlpatterns = [
     url(r'^api/download_channel_content_csv/(?P<channel_id>[^/]{32})$', views.download_channel_content_csv, name='download_channel_content_csv'),
     url(r'^api/probers/get_prober_channel', views.get_prober_channel, name='get_prober_channel'),
     url(r'^api/sync/$', sync, name="sync"),
+    url(r'^api/sync/events/$', sync_events, name="sync_events"),
 ]
 
 # if activated, turn on django prometheus urls
@@ -142,6 +144,7 @@ urlpatterns += [
     url(r'^api/internal/get_node_tree_data$', internal_views.get_node_tree_data, name='get_node_tree_data'),
     url(r'^api/internal/create_channel$', internal_views.api_create_channel_endpoint, name="api_create_channel"),
     url(r'^api/internal/add_nodes$', internal_views.api_add_nodes_to_tree, name="api_add_nodes_to_tree"),
+    url(r'^api/internal/add_nodes_bulk$', internal_views.api_add_nodes_to_tree_bulk, name="api_add_nodes_to_tree_bulk"),
     url(r'^api/internal/finish_channel$', internal_views.api_commit_channel, name="api_finish_channel"),
     url(r'^api/internal/get_channel_status_bulk$', internal_views.get_channel_status_bulk, name="get_channel_status_bulk"),
 ]
@@ -11,6 +11,7 @@ from le_utils.constants import exercises
 from le_utils.constants import file_formats
 from le_utils.constants import format_presets
 from le_utils.constants import licenses
+from search import search_index
 
 from contentcuration.api import write_file_to_storage
 from contentcuration.models import AssessmentItem
@@ -21,6 +22,7 @@ from contentcuration.models import File
 from contentcuration.models import FormatPreset
 from contentcuration.models import License
 from contentcuration.models import User
+from contentcuration.node_metadata import aggregates
 from contentcuration.utils.files import duplicate_file
 
 LICENSE_DESCRIPTION = "Sample text for content with special permissions"
@@ -306,6 +308,7 @@ class TreeBuilder(object):
             self.assessment_items, batch_size=BATCH_SIZE,
         )
         File.objects.bulk_create(self.files, batch_size=BATCH_SIZE)
+        aggregates.add_subtree(self._root_node["id"])
         if self.tags:
             ContentNode.tags.through.objects.bulk_create(
                 [
@@ -316,6 +319,7 @@ class TreeBuilder(object):
                 ],
                 batch_size=BATCH_SIZE,
             )
+        search_index.update_subtree(self._root_node["id"])
 
     def recurse_and_generate(self, parent_id, levels):
         children = []
@@ -1,15 +1,18 @@
 from future import standard_library
 standard_library.install_aliases()
 import base64
+import collections
 import copy
+import logging
 from io import BytesIO
 import os
 import re
 import tempfile
+import threading
 from multiprocessing.dummy import Pool
 
-import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import default_storage
 from le_utils.constants import file_formats
 from PIL import Image
@@ -18,10 +21,21 @@ from PIL import ImageFile
 from contentcuration.api import write_raw_content_to_storage
 from contentcuration.models import File
 from contentcuration.models import generate_object_storage_name
+from contentcuration.models import StagedFile
+from contentcuration.utils.storage_common import get_existing_files
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 THUMBNAIL_WIDTH = 400
 
+# Encodings are content-addressed, so they never go stale. The shared cache holds
+# them indefinitely and each process keeps the most recently used ones in memory.
+THUMBNAIL_ENCODING_CACHE_TIMEOUT = None
+THUMBNAIL_ENCODING_MEMORY_CACHE_SIZE = 1000
+THUMBNAIL_ENCODING_WORKER_COUNT = 4
+
+_thumbnail_encodings = collections.OrderedDict()
+_thumbnail_encodings_lock = threading.Lock()
+
 
 def create_file_from_contents(contents, ext=None, node=None, preset_id=None, uploaded_by=None):
     checksum, _, path = write_raw_content_to_storage(contents, ext=ext)
@@ -44,28 +58,52 @@ def get_file_diff(files):
     storage, and return.
 
     """
+    file_paths = {f: generate_object_storage_name(os.path.splitext(f)[0], f) for f in files}
+    missing = get_missing_storage_files(list(file_paths.values()))
+    return [f for f in files if file_paths[f] in missing]
 
-    # We use a thread pool in here, making direct HEAD requests to the storage URL
-    # to see if the objects exist.
-    # The threaded method is found to be the fastest -- see
-    # https://gist.github.com/aronasorman/57b8c01e5ed2b7cbf876e7734b7b9f38
-    # for benchmarking details.
-    ret = []
 
-    session = requests.Session()
-
-    def check_file_url(f):
-        filepath = generate_object_storage_name(os.path.splitext(f)[0], f)
-        url = "/".join([settings.AWS_S3_ENDPOINT_URL, settings.AWS_S3_BUCKET_NAME, filepath])
-        resp = session.head(url)
-        if resp.status_code != 200:
-            ret.append(f)
+def get_missing_storage_files(file_paths):
+    """
+        Checks which of many files are missing from storage. Files known to have been uploaded
+        are assumed to be in storage, so only the remaining ones are checked with the backend.
+        Args:
+            file_paths ([str]): storage paths of the files to check
+        Returns set of the paths that are not in storage
+    """
+    unknown = set(file_paths) - get_known_storage_files(file_paths)
+    if not unknown:
+        return set()
+    return unknown - get_existing_files(unknown)
 
-    # use a pool of 3 threads to make our queries
-    pool = Pool(3)
-    pool.map(check_file_url, files)
 
-    return ret
+def get_known_storage_files(file_paths):
+    """
+        Finds the files that Studio knows have been uploaded to storage, without asking the
+        storage backend. Staged files are only recorded once their upload has completed.
+        A File is not enough, as one is created before its upload to a presigned URL, which
+        may never complete.
+        Args:
+            file_paths ([str]): storage paths of the files to check
+        Returns set of the paths that are known to be in storage
+    """
+    paths_by_checksum = {}
+    for path in set(file_paths):
+        checksum, ext = os.path.splitext(os.path.basename(path))
+        paths_by_checksum.setdefault(checksum, []).append((path, ext.lstrip(".")))
+    if not paths_by_checksum:
+        return set()
+
+    staged_files = set(
+        StagedFile.objects.filter(checksum__in=list(paths_by_checksum.keys()))
+        .exclude(extension="")
+        .values_list('checksum', 'extension')
+        .distinct()
+    )
+    return set(
+        path for checksum, paths in paths_by_checksum.items() for path, ext in paths
+        if (checksum, ext) in staged_files
+    )
 
 
 def duplicate_file(file_object, node=None, assessment_item=None, preset_id=None, save=True):
@@ -83,7 +121,7 @@ def duplicate_file(file_object, node=None, assessment_item=None, preset_id=None,
 
 def get_thumbnail_encoding(filename, dimension=THUMBNAIL_WIDTH):
     """
-        Generates a base64 encoding for a thumbnail
+        Generates a base64 encoding for a thumbnail, reusing any cached encoding of the same file
         Args:
             filename (str): thumbnail to generate encoding from (must be in storage already)
             dimension (int, optional): desired width of thumbnail. Defaults to 400.
@@ -93,6 +131,124 @@ def get_thumbnail_encoding(filename, dimension=THUMBNAIL_WIDTH):
     if filename.startswith("data:image"):
         return filename
 
+    if filename.startswith(settings.STATIC_ROOT):
+        return generate_thumbnail_encoding(filename, dimension=dimension)
+
+    key = get_thumbnail_encoding_key(filename, dimension)
+    encoding = get_cached_thumbnail_encodings([key]).get(key)
+    if encoding is None:
+        encoding = generate_thumbnail_encoding(filename, dimension=dimension)
+        cache_thumbnail_encodings({key: encoding})
+    return encoding
+
+
+def get_thumbnail_encodings(filenames, dimension=THUMBNAIL_WIDTH):
+    """
+        Generates base64 encodings for many thumbnails, resizing each file at most once
+        Args:
+            filenames ([str]): thumbnails to generate encodings from (must be in storage already)
+            dimension (int, optional): desired width of thumbnails. Defaults to 400.
+        Returns dict of filename to base64 encoding, leaving out any file that could not be encoded
+    """
+    encodings = {}
+    keys = {}
+    for filename in set(filenames):
+        if filename.startswith("data:image"):
+            encodings[filename] = filename
+        elif not filename.startswith(settings.STATIC_ROOT):
+            keys[filename] = get_thumbnail_encoding_key(filename, dimension)
+
+    cached = get_cached_thumbnail_encodings(list(keys.values()))
+
+    # Files sharing a checksum share an encoding, so only resize one of them
+    uncached = {}
+    for filename, key in keys.items():
+        if key in cached:
+            encodings[filename] = cached[key]
+        else:
+            uncached.setdefault(key, filename)
+
+    generated = generate_thumbnail_encodings(uncached, dimension) if uncached else {}
+    cache_thumbnail_encodings(generated)
+
+    encodings.update((filename, generated[key]) for filename, key in keys.items() if key in generated)
+    return encodings
+
+
+def generate_thumbnail_encodings(filenames, dimension):
+    """
+        Resizes thumbnails in parallel
+        Args:
+            filenames (dict): key to thumbnail to generate the encoding from
+            dimension (int): desired width of thumbnails
+        Returns dict of key to base64 encoding, leaving out any file that could not be encoded
+    """
+    def encode(filename):
+        try:
+            return generate_thumbnail_encoding(filename, dimension=dimension)
+        except Exception as e:
+            logging.warning("Unable to generate thumbnail encoding for {}: {}".format(filename, e))
+
+    pool = Pool(THUMBNAIL_ENCODING_WORKER_COUNT)
+    try:
+        generated = pool.map(encode, list(filenames.values()))
+    finally:
+        pool.close()
+        pool.join()
+    return {key: encoding for key, encoding in zip(filenames, generated) if encoding}
+
+
+def get_thumbnail_encoding_key(filename, dimension):
+    checksum, ext = os.path.splitext(os.path.basename(filename.split("?")[0]))
+    return "thumbnail_encoding_{}_{}_{}".format(checksum, dimension, ext[1:].lower())
+
+
+def get_cached_thumbnail_encodings(keys):
+    """
+        Looks up cached thumbnail encodings, first in this process and then in the shared cache
+        Args:
+            keys ([str]): keys returned by get_thumbnail_encoding_key
+        Returns dict of key to base64 encoding for each key found
+    """
+    encodings = {}
+    with _thumbnail_encodings_lock:
+        for key in keys:
+            if key in _thumbnail_encodings:
+                # Move the encoding to the end so it is evicted last
+                encodings[key] = _thumbnail_encodings[key] = _thumbnail_encodings.pop(key)
+
+    missing = [key for key in keys if key not in encodings]
+    if missing:
+        shared = cache.get_many(missing)
+        remember_thumbnail_encodings(shared)
+        encodings.update(shared)
+    return encodings
+
+
+def cache_thumbnail_encodings(encodings):
+    if encodings:
+        cache.set_many(encodings, THUMBNAIL_ENCODING_CACHE_TIMEOUT)
+        remember_thumbnail_encodings(encodings)
+
+
+def remember_thumbnail_encodings(encodings):
+    with _thumbnail_encodings_lock:
+        for key, encoding in encodings.items():
+            _thumbnail_encodings.pop(key, None)
+            _thumbnail_encodings[key] = encoding
+        while len(_thumbnail_encodings) > THUMBNAIL_ENCODING_MEMORY_CACHE_SIZE:
+            _thumbnail_encodings.popitem(last=False)
+
+
+def generate_thumbnail_encoding(filename, dimension=THUMBNAIL_WIDTH):
+    """
+        Generates a base64 encoding for a thumbnail by resizing the original image
+        Args:
+            filename (str): thumbnail to generate encoding from (must be in storage already)
+            dimension (int, optional): desired width of thumbnail. Defaults to 400.
+        Returns base64 encoding of resized thumbnail
+    """
+
     checksum, ext = os.path.splitext(filename.split("?")[0])
     outbuffer = BytesIO()
 
@@ -2,6 +2,7 @@ import logging
 import tempfile
 from gzip import GzipFile
 from io import BytesIO
+from multiprocessing.dummy import Pool as ThreadPool
 
 import backoff
 from django.core.files import File
@@ -72,6 +73,25 @@ class GoogleCloudStorage(Storage):
         blob = self.bucket.get_blob(name)
         return blob
 
+    def exists_many(self, names, concurrency=10):
+        """
+        Check which of many resources exist, making at most `concurrency` requests at once.
+        :param names: the names of the resources to check
+        :param concurrency: the maximum number of requests to make at once
+        :return: a set of the names of the resources that exist.
+        """
+        names = list(set(names))
+        if not names:
+            return set()
+
+        pool = ThreadPool(min(concurrency, len(names)))
+        try:
+            exists = pool.map(self.exists, names)
+        finally:
+            pool.close()
+            pool.join()
+        return set(name for name, blob in zip(names, exists) if blob)
+
     def size(self, name):
         blob = self.bucket.get_blob(name)
         return blob.size
@@ -18,6 +18,7 @@ from contentcuration.models import FormatPreset
 from contentcuration.models import generate_object_storage_name
 from contentcuration.models import Language
 from contentcuration.models import User
+from contentcuration.utils.files import get_missing_storage_files
 from contentcuration.utils.files import get_thumbnail_encoding
 
 
@@ -32,7 +33,8 @@ def map_files_to_node(user, node, data):
         assert isinstance(data, list)
 
     # filter out file that are empty
-    valid_data = filter_out_nones(data)
+    valid_data = list(filter_out_nones(data))
+    raise_if_missing_from_storage(valid_data)
 
     for file_data in valid_data:
         filename = file_data["filename"]
@@ -43,10 +45,6 @@ def map_files_to_node(user, node, data):
         kind_preset = FormatPreset.get_preset(file_data["preset"]) or FormatPreset.guess_format_preset(filename)
 
         file_path = generate_object_storage_name(checksum, filename)
-        storage = default_storage
-
-        if not storage.exists(file_path):
-            raise IOError('{} not found'.format(file_path))
 
         try:
             if file_data.get('language'):
@@ -92,16 +90,14 @@ def map_files_to_assessment_item(user, assessment_item, data):
         assert isinstance(data, list)
 
     # filter out file that are empty
-    valid_data = filter_out_nones(data)
+    valid_data = list(filter_out_nones(data))
+    raise_if_missing_from_storage(valid_data)
 
     for file_data in valid_data:
         filename = file_data["filename"]
         checksum, ext = filename.split(".")
 
         file_path = generate_object_storage_name(checksum, filename)
-        storage = default_storage
-        if not storage.exists(file_path):
-            raise IOError('{} not found'.format(file_path))
 
         resource_obj = File(
             checksum=checksum,
@@ -152,6 +148,19 @@ def map_files_to_slideshow_slide_item(user, node, slides, files):
         file_obj.save()
 
 
+def raise_if_missing_from_storage(data):
+    """
+    Check that all the files referenced by file data are in storage, in one batch.
+    """
+    file_paths = [
+        generate_object_storage_name(os.path.splitext(file_data["filename"])[0], file_data["filename"])
+        for file_data in data
+    ]
+    missing = get_missing_storage_files(file_paths)
+    if missing:
+        raise IOError('{} not found'.format(", ".join(sorted(missing))))
+
+
 def filter_out_nones(data):
     """
     Filter out any falsey values from data.
@@ -1,24 +1,31 @@
 from __future__ import division
 
 import collections
+import hashlib
 import itertools
 import json
 import logging as logmodule
 import math
 import os
 import re
+import shutil
 import tempfile
 import traceback
 import uuid
 import zipfile
 from builtins import str
+from io import BytesIO
 from itertools import chain
+from multiprocessing.dummy import Pool
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files import File
 from django.core.files.storage import default_storage as storage
 from django.core.management import call_command
+from django.db import connections
 from django.db import transaction
+from django.db.migrations.executor import MigrationExecutor
 from django.db.models import Count
 from django.db.models import Q
 from django.db.models import Sum
@@ -26,6 +33,7 @@ from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from kolibri_content import models as kolibrimodels
+from kolibri_content.router import APP_CONFIG_LABEL
 from kolibri_content.router import get_active_content_database
 from kolibri_content.router import using_content_database
 from le_utils.constants import content_kinds
@@ -35,11 +43,15 @@ from le_utils.constants import format_presets
 from le_utils.constants import roles
 from past.builtins import basestring
 from past.utils import old_div
+from search.content_locations import refresh_content_locations
 
 from contentcuration import models as ccmodels
+from contentcuration.api import write_raw_content_to_storage
+from contentcuration.node_metadata.aggregates import rebuild_aggregates
 from contentcuration.statistics import record_publish_stats
 from contentcuration.utils.files import create_thumbnail_from_base64
 from contentcuration.utils.files import get_thumbnail_encoding
+from contentcuration.utils.files import get_thumbnail_encodings
 from contentcuration.utils.parser import extract_value
 from contentcuration.utils.parser import load_json_string
 from contentcuration.utils.sentry import report_exception
@@ -49,9 +61,38 @@ logmodule.basicConfig()
 logging = logmodule.getLogger(__name__)
 
 PERSEUS_IMG_DIR = exercises.IMG_PLACEHOLDER + "/images"
+MARKDOWN_IMAGE_REGEX = r'!\[(?:[^\]]*)]\(([^\)]+)\)'
+EXERCISE_IMAGE_PATH_REGEX = r'(.+/images/[^\s]+)(?:\s=([0-9\.]+)x([0-9\.]+))*'
 THUMBNAIL_DIMENSION = 128
 MIN_SCHEMA_VERSION = "1"
 
+# Number of export rows to build in memory before handing them to bulk_create
+# when using the bulk publish engine. Django further splits each chunk into
+# statements that fit within SQLite's limit on query variables.
+BULK_EXPORT_CHUNK_SIZE = 1000
+
+# Number of ids to filter on per query when deleting export rows, kept below
+# SQLite's limit of 999 query variables.
+EXPORT_DELETE_CHUNK_SIZE = 500
+
+# Incremental publishes fall back to rebuilding the export database from scratch
+# once more than this fraction of the exported nodes would need to be rewritten.
+INCREMENTAL_PUBLISH_MAX_CHANGED_RATIO = 0.25
+
+# Number of threads used to fetch exercise images, render Perseus archives and
+# save them to storage when building exercises during a bulk publish.
+PERSEUS_WORKER_COUNT = 8
+
+# Number of exercises built per batch, bounding how many archives and images
+# are held in memory at once.
+PERSEUS_BATCH_SIZE = 100
+
+# Perseus archives are cached by a hash of everything they are built from, so that
+# unchanged exercises link their existing archive instead of rebuilding it. Bump the
+# version whenever the way archives are rendered changes to invalidate the cache.
+PERSEUS_ARCHIVE_VERSION = 1
+PERSEUS_ARCHIVE_CACHE_TIMEOUT = None
+
 
 def send_emails(channel, user_id, version_notes=''):
     subject = render_to_string('registration/custom_email_subject.txt', {'subject': _('Kolibri Studio Channel Published')})
@@ -69,7 +110,7 @@ def send_emails(channel, user_id, version_notes=''):
             user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL, )
 
 
-def create_content_database(channel, force, user_id, force_exercises, task_object=None):
+def create_content_database(channel, force, user_id, force_exercises, task_object=None, bulk=False, incremental=False):
     # increment the channel version
     if not force:
         raise_if_nodes_are_all_unchanged(channel)
@@ -79,12 +120,25 @@ def create_content_database(channel, force, user_id, force_exercises, task_objec
         channel.main_tree.publishing = True
         channel.main_tree.save()
 
-        prepare_export_database(tempdb)
-        if task_object:
-            task_object.update_state(state='STARTED', meta={'progress': 10.0})
-        map_channel_to_kolibri_channel(channel)
-        map_content_nodes(channel.main_tree, channel.language, channel.id, channel.name, user_id=user_id,
-                          force_exercises=force_exercises, task_object=task_object, starting_percent=10.0)
+        updated_previous_export = False
+        if incremental and load_previous_export_database(channel.id, tempdb):
+            if task_object:
+                task_object.update_state(state='STARTED', meta={'progress': 10.0})
+            updated_previous_export = incremental_map_content_nodes(
+                channel.main_tree, channel.language, channel.id, channel.name, user_id=user_id,
+                force_exercises=force_exercises, task_object=task_object, starting_percent=10.0)
+
+        if updated_previous_export:
+            kolibrimodels.ChannelMetadata.objects.all().delete()
+            map_channel_to_kolibri_channel(channel)
+        else:
+            prepare_export_database(tempdb)
+            if task_object:
+                task_object.update_state(state='STARTED', meta={'progress': 10.0})
+            map_channel_to_kolibri_channel(channel)
+            map_nodes = bulk_map_content_nodes if bulk else map_content_nodes
+            map_nodes(channel.main_tree, channel.language, channel.id, channel.name, user_id=user_id,
+                      force_exercises=force_exercises, task_object=task_object, starting_percent=10.0)
         # It should be at this percent already, but just in case.
         if task_object:
             task_object.update_state(state='STARTED', meta={'progress': 90.0})
@@ -163,6 +217,385 @@ def map_content_nodes(root_node, default_language, channel_id, channel_name, use
                 current_node_percent = new_node_percent
 
 
+def get_nodes_with_resources(nodes):
+    """ get_nodes_with_resources: finds the nodes whose subtree holds any non-topic node
+        Args:
+            nodes ([<ContentNode>]): every node of a single tree, ordered by lft
+        Returns: set of the ids of nodes that are resources or have a resource descendant
+    """
+    with_resources = set()
+    ancestors = []
+    for node in nodes:
+        # Drop any nodes whose MPTT interval closed before this one started,
+        # leaving only the ancestors of the current node on the stack
+        while ancestors and ancestors[-1].rght < node.lft:
+            ancestors.pop()
+        if node.kind_id != content_kinds.TOPIC:
+            with_resources.add(node.id)
+            for ancestor in reversed(ancestors):
+                # Ancestors above an already marked node are marked too
+                if ancestor.id in with_resources:
+                    break
+                with_resources.add(ancestor.id)
+        ancestors.append(node)
+    return with_resources
+
+
+def get_publishable_nodes(nodes):
+    """ get_publishable_nodes: selects the nodes that map_content_nodes would export
+        Args:
+            nodes ([<ContentNode>]): every node of a single tree, ordered by lft
+        Returns: list of nodes to export, in the breadth first order map_content_nodes visits them
+    """
+    if not nodes:
+        return []
+
+    with_resources = get_nodes_with_resources(nodes)
+    children_by_parent = collections.defaultdict(list)
+    for node in nodes:
+        children_by_parent[node.parent_id].append(node)
+
+    publishable = []
+    node_queue = collections.deque([nodes[0]])
+    while node_queue:
+        node = node_queue.popleft()
+        if node.id in with_resources and node.complete:
+            publishable.append(node)
+            node_queue.extend(children_by_parent[node.id])
+    return publishable
+
+
+def set_kolibri_mptt_values(publishable, kolibrinodes):
+    """ set_kolibri_mptt_values: numbers the exported tree the way an MPTT rebuild of the export database would
+        Args:
+            publishable ([<ContentNode>]): nodes being exported, closed under their parents
+            kolibrinodes ({str: <kolibri ContentNode>}): kolibri nodes keyed by the id of their Studio node
+        Returns: None
+    """
+    opts = kolibrimodels.ContentNode._mptt_meta
+    cursor = 1
+    stack = []
+    for node in sorted(publishable, key=lambda n: n.lft):
+        while stack and stack[-1].rght < node.lft:
+            setattr(kolibrinodes[stack.pop().id], opts.right_attr, cursor)
+            cursor += 1
+        kolibrinode = kolibrinodes[node.id]
+        setattr(kolibrinode, opts.tree_id_attr, 1)
+        setattr(kolibrinode, opts.level_attr, len(stack))
+        setattr(kolibrinode, opts.left_attr, cursor)
+        cursor += 1
+        stack.append(node)
+    while stack:
+        setattr(kolibrinodes[stack.pop().id], opts.right_attr, cursor)
+        cursor += 1
+
+
+def bulk_create_in_chunks(model, objs):
+    for i in range(0, len(objs), BULK_EXPORT_CHUNK_SIZE):
+        model.objects.bulk_create(objs[i:i + BULK_EXPORT_CHUNK_SIZE])
+
+
+def get_tree_nodes(root_node):
+    return list(
+        root_node.get_descendants(include_self=True)
+        .select_related('license', 'language')
+        .order_by('lft')
+    )
+
+
+def bulk_map_content_nodes(root_node, default_language, channel_id, channel_name, user_id=None,
+                           force_exercises=False, task_object=None, starting_percent=10.0):
+    """
+    Set based equivalent of map_content_nodes. The tree is read with a few queries ordered by lft,
+    and the export database is written with bulk inserts in the same order map_content_nodes
+    would insert each row, so both engines produce the same export.
+    """
+    nodes = get_tree_nodes(root_node)
+    publishable = get_publishable_nodes(nodes)
+    logging.debug("Mapping {} of {} nodes".format(len(publishable), len(nodes)))
+
+    with transaction.atomic(), transaction.atomic(using=get_active_content_database()):
+        write_content_nodes(publishable, publishable, default_language, channel_id, channel_name, user_id=user_id,
+                            force_exercises=force_exercises, task_object=task_object, starting_percent=starting_percent)
+
+
+def incremental_map_content_nodes(root_node, default_language, channel_id, channel_name, user_id=None,
+                                  force_exercises=False, task_object=None, starting_percent=10.0):
+    """
+    Updates the previous export of a channel in the active content database in place. Only nodes that
+    were added, changed or moved since the last publish are rewritten, nodes that are no longer published
+    are removed, and the MPTT values of every other node are corrected where they have shifted.
+
+    Returns False without writing anything if the export cannot be updated incrementally, either because
+    the channel default language changed or because the diff is too large to be worth applying.
+    """
+    nodes = get_tree_nodes(root_node)
+    publishable = get_publishable_nodes(nodes)
+    node_ids = {node.id: node.node_id for node in nodes}
+
+    mptt_opts = kolibrimodels.ContentNode._mptt_meta
+    mptt_fields = (mptt_opts.parent_attr + '_id', mptt_opts.left_attr, mptt_opts.right_attr, mptt_opts.level_attr, mptt_opts.tree_id_attr)
+    existing = {row[0]: row[1:] for row in kolibrimodels.ContentNode.objects.values_list('id', *mptt_fields)}
+
+    # Nodes without a language are exported with the channel language, so they all depend on it
+    channel_language_id = default_language.pk if default_language else None
+    exported_languages = dict(kolibrimodels.ContentNode.objects.values_list('id', 'lang_id'))
+    if any(
+        node.language_id is None and node.node_id in exported_languages and exported_languages[node.node_id] != channel_language_id
+        for node in publishable
+    ):
+        logging.info("Channel language has changed, unable to update the previous export")
+        return False
+
+    nodes_to_write = [
+        node for node in publishable
+        if node.changed
+        or node.node_id not in existing
+        or existing[node.node_id][0] != node_ids.get(node.parent_id)
+        or force_exercises and node.kind_id == content_kinds.EXERCISE
+    ]
+    published_node_ids = set(node.node_id for node in publishable)
+    nodes_to_remove = [node_id for node_id in existing if node_id not in published_node_ids]
+
+    if len(nodes_to_write) + len(nodes_to_remove) > INCREMENTAL_PUBLISH_MAX_CHANGED_RATIO * max(len(publishable), 1):
+        logging.info("Too many nodes have changed to update the previous export ({} rewritten, {} removed)".format(
+            len(nodes_to_write), len(nodes_to_remove)))
+        return False
+
+    logging.debug("Updating previous export ({} rewritten, {} removed)".format(len(nodes_to_write), len(nodes_to_remove)))
+
+    with transaction.atomic(), transaction.atomic(using=get_active_content_database()):
+        delete_export_nodes([node.node_id for node in nodes_to_write if node.node_id in existing] + nodes_to_remove)
+        # Prerequisites are remapped in full after the nodes have been mapped
+        kolibrimodels.ContentNode.has_prerequisite.through.objects.all().delete()
+
+        kolibrinodes = write_content_nodes(publishable, nodes_to_write, default_language, channel_id, channel_name, user_id=user_id,
+                                           force_exercises=force_exercises, task_object=task_object, starting_percent=starting_percent)
+
+        written_ids = set(node.id for node in nodes_to_write)
+        renumbered = []
+        for node in publishable:
+            if node.id in written_ids:
+                continue
+            kolibrinode = kolibrinodes[node.id]
+            values = tuple(getattr(kolibrinode, field) for field in mptt_fields)
+            if values != existing[node.node_id]:
+                renumbered.append(values + (kolibrinode.id,))
+
+        if renumbered:
+            table = kolibrimodels.ContentNode._meta.db_table
+            with connections[get_active_content_database()].cursor() as cursor:
+                cursor.executemany(
+                    "UPDATE {table} SET {assignments} WHERE id = %s".format(
+                        table=table,
+                        assignments=", ".join("{} = %s".format(field) for field in mptt_fields),
+                    ),
+                    renumbered,
+                )
+
+        # Clean up anything that is no longer referenced by a published node, as a full export would not contain it
+        kolibrimodels.LocalFile.objects.delete_orphan_file_objects()
+        kolibrimodels.ContentTag.objects.filter(tagged_content__isnull=True).delete()
+        kolibrimodels.Language.objects.filter(contentnode__isnull=True, file__isnull=True).delete()
+        kolibrimodels.License.objects.filter(contentnode__isnull=True).delete()
+
+    return True
+
+
+def delete_export_nodes(node_ids):
+    """ delete_export_nodes: removes nodes from the active export database, along with their files, tags and assessment metadata
+        Args:
+            node_ids ([str]): ids of the kolibri nodes to delete
+        Returns: None
+    """
+    table = kolibrimodels.ContentNode._meta.db_table
+    for i in range(0, len(node_ids), EXPORT_DELETE_CHUNK_SIZE):
+        chunk = node_ids[i:i + EXPORT_DELETE_CHUNK_SIZE]
+        kolibrimodels.File.objects.filter(contentnode_id__in=chunk).delete()
+        kolibrimodels.AssessmentMetaData.objects.filter(contentnode_id__in=chunk).delete()
+        kolibrimodels.ContentNode.tags.through.objects.filter(contentnode_id__in=chunk).delete()
+        # Delete the node rows directly, as deleting through the ORM would cascade
+        # to the children of rewritten topics, which are left in place
+        with connections[get_active_content_database()].cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {table} WHERE id IN ({params})".format(table=table, params=", ".join(["%s"] * len(chunk))),
+                chunk,
+            )
+
+
+def write_content_nodes(publishable, nodes_to_write, default_language, channel_id, channel_name, user_id=None,  # noqa C901
+                        force_exercises=False, task_object=None, starting_percent=10.0):
+    """ write_content_nodes: bulk inserts export rows for a subset of the publishable nodes
+        Args:
+            publishable ([<ContentNode>]): every node being exported, in breadth first order
+            nodes_to_write ([<ContentNode>]): nodes from publishable to insert, along with their files, tags and assessment metadata
+        Returns: ordered dict of unsaved kolibri nodes for every publishable node, keyed by Studio node id,
+            with their MPTT values set for the whole exported tree
+    """
+    task_percent_total = 80.0
+
+    def update_progress(fraction):
+        if task_object:
+            task_object.update_state(state='STARTED', meta={'progress': starting_percent + task_percent_total * fraction})
+
+    write_ids = set(node.id for node in nodes_to_write)
+    nodes_to_write = [node for node in publishable if node.id in write_ids]
+    node_ids = [node.id for node in nodes_to_write]
+
+    licenses = {}
+    languages = {}
+
+    def get_license(ccnode):
+        use_license_description = not ccnode.license.is_custom
+        key = (
+            ccnode.license.license_name,
+            ccnode.license.license_description if use_license_description else ccnode.license_description,
+        )
+        if key not in licenses:
+            licenses[key] = kolibrimodels.License.objects.get_or_create(license_name=key[0], license_description=key[1])[0]
+        return licenses[key]
+
+    def get_language(language):
+        if language.pk not in languages:
+            languages[language.pk] = get_or_create_language(language)[0]
+        return languages[language.pk]
+
+    kolibrinodes = collections.OrderedDict()
+    for ccnode in publishable:
+        kolibrinode = kolibrimodels.ContentNode(
+            id=ccnode.node_id,
+            parent_id=kolibrinodes[ccnode.parent_id].id if ccnode.parent_id else None,
+        )
+        kolibrinodes[ccnode.id] = kolibrinode
+        if ccnode.id not in write_ids:
+            continue
+
+        kolibri_license = get_license(ccnode) if ccnode.license is not None else None
+        language = None
+        if ccnode.language or default_language:
+            language = get_language(ccnode.language or default_language)
+        options = {}
+        if ccnode.extra_fields and 'options' in ccnode.extra_fields:
+            options = ccnode.extra_fields['options']
+
+        kolibrinode.kind = ccnode.kind_id
+        kolibrinode.title = ccnode.title if ccnode.parent_id else channel_name
+        kolibrinode.content_id = ccnode.content_id
+        kolibrinode.channel_id = channel_id
+        kolibrinode.author = ccnode.author or ""
+        kolibrinode.description = ccnode.description
+        kolibrinode.sort_order = ccnode.sort_order
+        kolibrinode.license_owner = ccnode.copyright_holder or ""
+        kolibrinode.license = kolibri_license
+        kolibrinode.available = True  # Publishable nodes always have a resource in their subtree
+        kolibrinode.stemmed_metaphone = ""
+        kolibrinode.lang = language
+        kolibrinode.license_name = kolibri_license.license_name if kolibri_license is not None else None
+        kolibrinode.license_description = kolibri_license.license_description if kolibri_license is not None else None
+        kolibrinode.coach_content = ccnode.role_visibility == roles.COACH
+        kolibrinode.options = json.dumps(options)
+
+    set_kolibri_mptt_values(publishable, kolibrinodes)
+    bulk_create_in_chunks(kolibrimodels.ContentNode, [kolibrinodes[node_id] for node_id in node_ids])
+    update_progress(0.3)
+
+    # Exercises and slideshows generate Studio files, so handle them before reading any files
+    exercise_ids = [node.id for node in nodes_to_write if node.kind_id == content_kinds.EXERCISE]
+    assessment_items = collections.defaultdict(list)
+    for item in ccmodels.AssessmentItem.objects.filter(contentnode_id__in=exercise_ids).order_by('contentnode_id', 'order'):
+        assessment_items[item.contentnode_id].append(item)
+    with_exercise_file = set(
+        ccmodels.File.objects.filter(contentnode_id__in=exercise_ids, preset_id=format_presets.EXERCISE)
+        .values_list('contentnode_id', flat=True)
+    )
+    assessment_metadata = []
+    exercises_to_build = []
+    for ccnode in nodes_to_write:
+        if ccnode.kind_id == content_kinds.EXERCISE:
+            metadata, exercise_data = build_assessment_metadata(ccnode, kolibrinodes[ccnode.id], assessment_items[ccnode.id])
+            assessment_metadata.append(metadata)
+            if force_exercises or ccnode.changed or ccnode.id not in with_exercise_file:
+                exercises_to_build.append((ccnode, exercise_data, assessment_items[ccnode.id]))
+        elif ccnode.kind_id == content_kinds.SLIDESHOW:
+            create_slideshow_manifest(ccnode, kolibrinodes[ccnode.id], user_id=user_id)
+    bulk_create_in_chunks(kolibrimodels.AssessmentMetaData, assessment_metadata)
+    create_perseus_exercises(exercises_to_build, user_id=user_id)
+    update_progress(0.6)
+
+    ccnodes = {node.id: node for node in nodes_to_write}
+    files_by_node = collections.defaultdict(list)
+    for ccfilemodel in ccmodels.File.objects.filter(contentnode_id__in=node_ids)\
+            .exclude(Q(preset_id=format_presets.EXERCISE_IMAGE) | Q(preset_id=format_presets.EXERCISE_GRAPHIE))\
+            .select_related('preset', 'file_format', 'language', 'uploaded_by'):
+        files_by_node[ccfilemodel.contentnode_id].append(ccfilemodel)
+
+    # Resize the thumbnails of nodes without an encoding together, so each file is resized once
+    get_thumbnail_encodings([
+        str(ccfilemodel) for node_id in node_ids for ccfilemodel in files_by_node[node_id]
+        if ccfilemodel.preset.thumbnail and not ccnodes[node_id].thumbnail_encoding
+    ])
+
+    localfiles = collections.OrderedDict()
+    kolibrifiles = []
+    for node_id in node_ids:
+        for ccfilemodel in files_by_node[node_id]:
+            preset = ccfilemodel.preset
+            fformat = ccfilemodel.file_format
+            if ccfilemodel.language:
+                get_language(ccfilemodel.language)
+
+            if preset.thumbnail:
+                ccfilemodel = create_associated_thumbnail(ccnodes[node_id], ccfilemodel) or ccfilemodel
+
+            if ccfilemodel.checksum not in localfiles:
+                localfiles[ccfilemodel.checksum] = kolibrimodels.LocalFile(
+                    id=ccfilemodel.checksum,
+                    extension=fformat.extension,
+                    file_size=ccfilemodel.file_size,
+                )
+
+            kolibrifiles.append(kolibrimodels.File(
+                id=ccfilemodel.pk,
+                checksum=ccfilemodel.checksum,
+                extension=fformat.extension,
+                available=True,
+                file_size=ccfilemodel.file_size,
+                contentnode_id=kolibrinodes[node_id].id,
+                preset=preset.pk,
+                supplementary=preset.supplementary,
+                lang_id=ccfilemodel.language_id,
+                thumbnail=preset.thumbnail,
+                priority=preset.order,
+                local_file_id=ccfilemodel.checksum,
+            ))
+
+    existing_localfiles = set(kolibrimodels.LocalFile.objects.filter(pk__in=list(localfiles.keys())).values_list('pk', flat=True))
+    bulk_create_in_chunks(kolibrimodels.LocalFile, [f for f in localfiles.values() if f.id not in existing_localfiles])
+    bulk_create_in_chunks(kolibrimodels.File, kolibrifiles)
+    update_progress(0.8)
+
+    export_order = {node_id: index for index, node_id in enumerate(node_ids)}
+    node_tags = sorted(
+        ccmodels.ContentNode.tags.through.objects.filter(contentnode_id__in=node_ids)
+        .values_list('contentnode_id', 'contenttag_id', 'contenttag__tag_name'),
+        key=lambda t: export_order[t[0]],
+    )
+    tags = collections.OrderedDict()
+    for _node_id, tag_id, tag_name in node_tags:
+        tags.setdefault(tag_id, tag_name)
+    existing_tags = set(kolibrimodels.ContentTag.objects.filter(pk__in=list(tags.keys())).values_list('pk', flat=True))
+    bulk_create_in_chunks(kolibrimodels.ContentTag, [
+        kolibrimodels.ContentTag(id=tag_id, tag_name=tag_name) for tag_id, tag_name in tags.items() if tag_id not in existing_tags
+    ])
+    bulk_create_in_chunks(kolibrimodels.ContentNode.tags.through, [
+        kolibrimodels.ContentNode.tags.through(contentnode_id=kolibrinodes[node_id].id, contenttag_id=tag_id)
+        for node_id, tag_id, _tag_name in node_tags
+    ])
+    update_progress(1.0)
+
+    return kolibrinodes
+
+
 def create_slideshow_manifest(ccnode, kolibrinode, user_id=None):
     print("Creating slideshow manifest...")
 
@@ -330,12 +763,22 @@ def create_associated_file_objects(kolibrinode, ccnode):
 
 def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
     logging.debug("Creating Perseus Exercise for Node {}".format(ccnode.title))
+    assessment_items = list(ccnode.assessment_items.all().order_by('order'))
+    questions = get_perseus_questions(assessment_items)
+    questions = [questions[item.id] for item in assessment_items]
+
+    archive_key = get_perseus_archive_key(exercise_data, questions)
+    cached_archive = get_cached_perseus_archives([archive_key]).get(archive_key)
+    if cached_archive:
+        link_perseus_archives([(ccnode, cached_archive)], user_id=user_id)
+        return
+
     filename = "{0}.{ext}".format(ccnode.title, ext=file_formats.PERSEUS)
     temppath = None
     try:
         with tempfile.NamedTemporaryFile(suffix="zip", delete=False) as tempf:
             temppath = tempf.name
-            create_perseus_zip(ccnode, exercise_data, tempf)
+            create_perseus_zip(ccnode, exercise_data, tempf, questions=questions)
             file_size = tempf.tell()
             tempf.flush()
 
@@ -350,26 +793,41 @@ def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
                 file_size=file_size,
                 uploaded_by_id=user_id,
             )
+            cache.set(archive_key, {'checksum': assessment_file_obj.checksum, 'file_size': file_size}, PERSEUS_ARCHIVE_CACHE_TIMEOUT)
             logging.debug("Created exercise for {0} with checksum {1}".format(ccnode.title, assessment_file_obj.checksum))
     finally:
         temppath and os.unlink(temppath)
 
 
 def process_assessment_metadata(ccnode, kolibrinode):
-    # Get mastery model information, set to default if none provided
     assessment_items = ccnode.assessment_items.all().order_by('order')
+    assessment_metadata, exercise_data = build_assessment_metadata(ccnode, kolibrinode, list(assessment_items))
+    assessment_metadata.save()
+    return exercise_data
+
+
+def build_assessment_metadata(ccnode, kolibrinode, assessment_items):
+    """ build_assessment_metadata: derives the exercise data and unsaved assessment metadata for an exercise
+        Args:
+            ccnode (<ContentNode>): exercise to build metadata for
+            kolibrinode (<kolibri ContentNode>): exported node the metadata belongs to
+            assessment_items ([<AssessmentItem>]): assessment items of ccnode, ordered by order
+        Returns: tuple of unsaved <AssessmentMetaData> and exercise data dict
+    """
+    # Get mastery model information, set to default if none provided
     exercise_data = ccnode.extra_fields if ccnode.extra_fields else {}
     if isinstance(exercise_data, basestring):
         exercise_data = json.loads(exercise_data)
     randomize = exercise_data.get('randomize') if exercise_data.get('randomize') is not None else True
     assessment_item_ids = [a.assessment_id for a in assessment_items]
+    item_count = len(assessment_items)
 
     mastery_model = {'type': exercise_data.get('mastery_model') or exercises.M_OF_N}
     if mastery_model['type'] == exercises.M_OF_N:
-        mastery_model.update({'n': exercise_data.get('n') or min(5, assessment_items.count()) or 1})
-        mastery_model.update({'m': exercise_data.get('m') or min(5, assessment_items.count()) or 1})
+        mastery_model.update({'n': exercise_data.get('n') or min(5, item_count) or 1})
+        mastery_model.update({'m': exercise_data.get('m') or min(5, item_count) or 1})
     elif mastery_model['type'] == exercises.DO_ALL:
-        mastery_model.update({'n': assessment_items.count() or 1, 'm': assessment_items.count() or 1})
+        mastery_model.update({'n': item_count or 1, 'm': item_count or 1})
     elif mastery_model['type'] == exercises.NUM_CORRECT_IN_A_ROW_2:
         mastery_model.update({'n': 2, 'm': 2})
     elif mastery_model['type'] == exercises.NUM_CORRECT_IN_A_ROW_3:
@@ -389,20 +847,264 @@ def process_assessment_metadata(ccnode, kolibrinode):
         'assessment_mapping': {a.assessment_id: a.type if a.type != 'true_false' else exercises.SINGLE_SELECTION for a in assessment_items},
     })
 
-    kolibrimodels.AssessmentMetaData.objects.create(
+    assessment_metadata = kolibrimodels.AssessmentMetaData(
         id=uuid.uuid4(),
         contentnode=kolibrinode,
         assessment_item_ids=json.dumps(assessment_item_ids),
-        number_of_assessments=assessment_items.count(),
+        number_of_assessments=item_count,
         mastery_model=json.dumps(mastery_model),
         randomize=randomize,
         is_manipulable=ccnode.kind_id == content_kinds.EXERCISE,
     )
 
-    return exercise_data
+    return assessment_metadata, exercise_data
+
+
+def create_perseus_exercises(exercises_to_build, user_id=None):
+    """ create_perseus_exercises: builds and saves the Perseus archives of many exercises using a pool of threads
+        Args:
+            exercises_to_build ([(<ContentNode>, dict, [<AssessmentItem>])]): exercises to build, along with
+                their exercise data and assessment items ordered by order
+            user_id (int): id of the user publishing the channel
+        Returns: None
+    """
+    pool = Pool(PERSEUS_WORKER_COUNT)
+    try:
+        for index in range(0, len(exercises_to_build), PERSEUS_BATCH_SIZE):
+            create_perseus_exercise_batch(exercises_to_build[index:index + PERSEUS_BATCH_SIZE], pool, user_id=user_id)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def create_perseus_exercise_batch(exercises_to_build, pool, user_id=None):
+    questions = get_perseus_questions(list(chain.from_iterable(exercise[2] for exercise in exercises_to_build)))
+
+    # Link archives that were already built from identical inputs rather than rebuilding them
+    archive_keys = [
+        get_perseus_archive_key(exercise_data, [questions[item.id] for item in items])
+        for _ccnode, exercise_data, items in exercises_to_build
+    ]
+    cached_archives = get_cached_perseus_archives(archive_keys, pool=pool)
+    link_perseus_archives([
+        (exercise[0], cached_archives[archive_key])
+        for exercise, archive_key in zip(exercises_to_build, archive_keys) if archive_key in cached_archives
+    ], user_id=user_id)
+    uncached = [
+        (exercise, archive_key)
+        for exercise, archive_key in zip(exercises_to_build, archive_keys) if archive_key not in cached_archives
+    ]
+    if not uncached:
+        return
+    exercises_to_build = [exercise for exercise, _archive_key in uncached]
+
+    # Fetch each image once for the whole batch, as exercises frequently share images
+    image_names = set()
+    for exercise in exercises_to_build:
+        for item in exercise[2]:
+            image_names.update(get_perseus_image_names(*questions[item.id]))
+    prefetched = {name: content for name, content in pool.map(prefetch_storage_file, sorted(image_names)) if content is not None}
+
+    def read_image(storage_name):
+        if storage_name in prefetched:
+            return prefetched[storage_name]
+        return read_storage_file(storage_name)
+
+    def build_archive(exercise):
+        ccnode, exercise_data, items = exercise
+        logging.debug("Creating Perseus Exercise for Node {}".format(ccnode.title))
+        archive = BytesIO()
+        create_perseus_zip(ccnode, exercise_data, archive, questions=[questions[item.id] for item in items], read_image=read_image)
+        return archive.getvalue()
+
+    archives = pool.map(build_archive, exercises_to_build)
+
+    # Remove the previous archives before saving the new ones, as deleting a file
+    # also removes its content from storage once nothing else references it
+    ccmodels.File.objects.filter(
+        contentnode_id__in=[exercise[0].id for exercise in exercises_to_build],
+        preset_id=format_presets.EXERCISE,
+    ).delete()
+
+    stored = pool.map(write_perseus_archive_to_storage, archives)
+    assessment_files = []
+    built_archives = {}
+    for (exercise, archive_key), contents, (checksum, _filename, file_path) in zip(uncached, archives, stored):
+        ccnode = exercise[0]
+        assessment_files.append(create_perseus_file_object(ccnode, checksum, len(contents), file_path, user_id=user_id))
+        built_archives[archive_key] = {'checksum': checksum, 'file_size': len(contents)}
+        logging.debug("Created exercise for {0} with checksum {1}".format(ccnode.title, checksum))
+    ccmodels.File.objects.bulk_create(assessment_files)
+    cache.set_many(built_archives, PERSEUS_ARCHIVE_CACHE_TIMEOUT)
+
+
+def create_perseus_file_object(ccnode, checksum, file_size, file_path, user_id=None):
+    assessment_file = ccmodels.File(
+        contentnode=ccnode,
+        checksum=checksum,
+        file_format_id=file_formats.PERSEUS,
+        preset_id=format_presets.EXERCISE,
+        original_filename="{0}.{ext}".format(ccnode.title, ext=file_formats.PERSEUS),
+        file_size=file_size,
+        uploaded_by_id=user_id,
+    )
+    assessment_file.file_on_disk.name = file_path
+    return assessment_file
+
+
+def get_perseus_archive_key(exercise_data, questions):
+    """ get_perseus_archive_key: hashes everything that goes into an exercise's Perseus archive
+        Args:
+            exercise_data (dict): exercise data returned by process_assessment_metadata
+            questions ([(<AssessmentItem>, [image <File>], [graphie <File>])]): questions in the order they are archived
+        Returns: cache key identifying the archive
+    """
+    archive_inputs = {
+        'version': PERSEUS_ARCHIVE_VERSION,
+        'exercise': exercise_data,
+        'questions': [
+            {
+                'assessment_id': item.assessment_id,
+                'type': item.type,
+                'question': item.question,
+                'answers': item.answers,
+                'hints': item.hints,
+                'raw_data': item.raw_data,
+                'randomize': item.randomize,
+                'images': [(image.checksum, image.file_format_id) for image in images],
+                'graphies': [(graphie.checksum, graphie.original_filename) for graphie in graphies],
+            }
+            for item, images, graphies in questions
+        ],
+    }
+    digest = hashlib.sha256(json.dumps(archive_inputs, sort_keys=True).encode('utf-8')).hexdigest()
+    return "perseus_archive_{}".format(digest)
+
+
+def get_perseus_archive_storage_name(checksum):
+    return ccmodels.generate_object_storage_name(checksum, "{}.{}".format(checksum, file_formats.PERSEUS))
+
+
+def get_cached_perseus_archives(archive_keys, pool=None):
+    """ get_cached_perseus_archives: looks up previously built archives that are still in storage
+        Args:
+            archive_keys ([str]): keys returned by get_perseus_archive_key
+            pool (<Pool>): pool to check storage with, checked serially if not provided
+        Returns: dict of key to {'checksum': str, 'file_size': int} for each archive found
+    """
+    cached_archives = list(cache.get_many(set(archive_keys)).items())
+
+    def archive_exists(cached_archive):
+        return storage.exists(get_perseus_archive_storage_name(cached_archive[1]['checksum']))
 
+    exists = pool.map(archive_exists, cached_archives) if pool else [archive_exists(a) for a in cached_archives]
+    return {archive_key: archive for (archive_key, archive), found in zip(cached_archives, exists) if found}
+
+
+def link_perseus_archives(archives, user_id=None):
+    """ link_perseus_archives: points exercises to archives that already exist in storage
+        Args:
+            archives ([(<ContentNode>, {'checksum': str, 'file_size': int})]): exercises and the archives to link
+            user_id (int): id of the user publishing the channel
+        Returns: None
+    """
+    if not archives:
+        return
+    existing = collections.defaultdict(list)
+    for file_id, node_id, checksum in ccmodels.File.objects.filter(
+        contentnode_id__in=[ccnode.id for ccnode, _archive in archives],
+        preset_id=format_presets.EXERCISE,
+    ).order_by('id').values_list('id', 'contentnode_id', 'checksum'):
+        existing[node_id].append((file_id, checksum))
+
+    assessment_files = []
+    stale_file_ids = []
+    for ccnode, archive in archives:
+        current = [file_id for file_id, checksum in existing[ccnode.id] if checksum == archive['checksum']][:1]
+        if not current:
+            file_path = get_perseus_archive_storage_name(archive['checksum'])
+            assessment_files.append(create_perseus_file_object(ccnode, archive['checksum'], archive['file_size'], file_path, user_id=user_id))
+        stale_file_ids.extend(file_id for file_id, _checksum in existing[ccnode.id] if file_id not in current)
+        logging.debug("Linked existing exercise for {0} with checksum {1}".format(ccnode.title, archive['checksum']))
+
+    # Create the new references before removing the previous ones, so that deleting
+    # them doesn't remove the shared content from storage
+    ccmodels.File.objects.bulk_create(assessment_files)
+    ccmodels.File.objects.filter(id__in=stale_file_ids).delete()
+
+
+def write_perseus_archive_to_storage(contents):
+    return write_raw_content_to_storage(contents, ext=file_formats.PERSEUS)
+
+
+def get_perseus_questions(assessment_items):
+    """ get_perseus_questions: pairs assessment items with the image and graphie files they use
+        Args:
+            assessment_items ([<AssessmentItem>]): items to look up files for
+        Returns: dict of item id to (<AssessmentItem>, [image <File>], [graphie <File>]), files ordered by checksum
+    """
+    images = collections.defaultdict(list)
+    graphies = collections.defaultdict(list)
+    item_files = ccmodels.File.objects.filter(
+        assessment_item_id__in=[item.id for item in assessment_items],
+        preset_id__in=[format_presets.EXERCISE_IMAGE, format_presets.EXERCISE_GRAPHIE],
+    ).select_related('file_format').order_by('checksum')
+    for item_file in item_files:
+        if item_file.preset_id == format_presets.EXERCISE_IMAGE:
+            images[item_file.assessment_item_id].append(item_file)
+        else:
+            graphies[item_file.assessment_item_id].append(item_file)
+    return {item.id: (item, images[item.id], graphies[item.id]) for item in assessment_items}
+
+
+def get_perseus_image_names(assessment_item, images, graphies):
+    """ get_perseus_image_names: finds the storage names of the images an assessment item's archive will include
+        Args:
+            assessment_item (<AssessmentItem>): item to find images for
+            images ([<File>]): image files of the item
+            graphies ([<File>]): graphie files of the item
+        Returns: set of storage names
+    """
+    image_names = set(ccmodels.generate_object_storage_name(f.checksum, str(f)) for f in chain(images, graphies))
+    texts = [assessment_item.question]
+    try:
+        texts.extend(answer['answer'] for answer in json.loads(assessment_item.answers)
+                     if assessment_item.type != exercises.INPUT_QUESTION)
+        texts.extend(hint['hint'] for hint in json.loads(assessment_item.hints))
+    except (ValueError, TypeError, KeyError):
+        # Malformed items are reported when their archive is built
+        pass
+    for text in texts:
+        if not isinstance(text, basestring):
+            continue
+        text = text.replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
+        for match in re.finditer(MARKDOWN_IMAGE_REGEX, text):
+            img_match = re.search(EXERCISE_IMAGE_PATH_REGEX, match.group(1))
+            if img_match:
+                filename = img_match.group(1).split('/')[-1]
+                image_names.add(ccmodels.generate_object_storage_name(os.path.splitext(filename)[0], filename))
+    return image_names
+
+
+def read_storage_file(storage_name):
+    with storage.open(storage_name, 'rb') as content:
+        return content.read()
+
+
+def prefetch_storage_file(storage_name):
+    try:
+        return storage_name, read_storage_file(storage_name)
+    except Exception:
+        # Leave the error to be raised by the archive that needs the file
+        return storage_name, None
+
+
+def create_perseus_zip(ccnode, exercise_data, write_to_path, questions=None, read_image=read_storage_file):  # noqa C901
+    if questions is None:
+        assessment_items = list(ccnode.assessment_items.all().order_by('order'))
+        questions = get_perseus_questions(assessment_items)
+        questions = [questions[item.id] for item in assessment_items]
 
-def create_perseus_zip(ccnode, exercise_data, write_to_path):
     with zipfile.ZipFile(write_to_path, "w") as zf:
         try:
             exercise_context = {
@@ -411,25 +1113,23 @@ def create_perseus_zip(ccnode, exercise_data, write_to_path):
             exercise_result = render_to_string('perseus/exercise.json', exercise_context)
             write_to_zipfile("exercise.json", exercise_result, zf)
 
-            for question in ccnode.assessment_items.prefetch_related('files').all().order_by('order'):
+            for question, images, graphies in questions:
                 try:
-                    for image in question.files.filter(preset_id=format_presets.EXERCISE_IMAGE).order_by('checksum'):
+                    for image in images:
                         image_name = "images/{}.{}".format(image.checksum, image.file_format_id)
                         if image_name not in zf.namelist():
-                            with storage.open(ccmodels.generate_object_storage_name(image.checksum, str(image)), 'rb') as content:
-                                write_to_zipfile(image_name, content.read(), zf)
+                            write_to_zipfile(image_name, read_image(ccmodels.generate_object_storage_name(image.checksum, str(image))), zf)
 
-                    for image in question.files.filter(preset_id=format_presets.EXERCISE_GRAPHIE).order_by('checksum'):
+                    for image in graphies:
                         svg_name = "images/{0}.svg".format(image.original_filename)
                         json_name = "images/{0}-data.json".format(image.original_filename)
                         if svg_name not in zf.namelist() or json_name not in zf.namelist():
-                            with storage.open(ccmodels.generate_object_storage_name(image.checksum, str(image)), 'rb') as content:
-                                content = content.read()
-                                # in Python 3, delimiter needs to be in bytes format
-                                content = content.split(exercises.GRAPHIE_DELIMITER.encode('ascii'))
-                                write_to_zipfile(svg_name, content[0], zf)
-                                write_to_zipfile(json_name, content[1], zf)
-                    write_assessment_item(question, zf)
+                            content = read_image(ccmodels.generate_object_storage_name(image.checksum, str(image)))
+                            # in Python 3, delimiter needs to be in bytes format
+                            content = content.split(exercises.GRAPHIE_DELIMITER.encode('ascii'))
+                            write_to_zipfile(svg_name, content[0], zf)
+                            write_to_zipfile(json_name, content[1], zf)
+                    write_assessment_item(question, zf, read_image=read_image)
                 except Exception as e:
                     logging.error("Publishing error: {}".format(str(e)))
                     logging.error(traceback.format_exc())
@@ -451,7 +1151,7 @@ def write_to_zipfile(filename, content, zf):
     zf.writestr(info, content)
 
 
-def write_assessment_item(assessment_item, zf):  # noqa C901
+def write_assessment_item(assessment_item, zf, read_image=read_storage_file):  # noqa C901
     if assessment_item.type == exercises.MULTIPLE_SELECTION:
         template = 'perseus/multiple_selection.json'
     elif assessment_item.type == exercises.SINGLE_SELECTION or assessment_item.type == 'true_false':
@@ -464,7 +1164,7 @@ def write_assessment_item(assessment_item, zf):  # noqa C901
         raise TypeError("Unrecognized question type on item {}".format(assessment_item.assessment_id))
 
     question = process_formulas(assessment_item.question)
-    question, question_images = process_image_strings(question, zf)
+    question, question_images = process_image_strings(question, zf, read_image=read_image)
 
     answer_data = json.loads(assessment_item.answers)
     for answer in answer_data:
@@ -474,14 +1174,14 @@ def write_assessment_item(assessment_item, zf):  # noqa C901
             answer['answer'] = answer['answer'].replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
             answer['answer'] = process_formulas(answer['answer'])
             # In case perseus doesn't support =wxh syntax, use below code
-            answer['answer'], answer_images = process_image_strings(answer['answer'], zf)
+            answer['answer'], answer_images = process_image_strings(answer['answer'], zf, read_image=read_image)
             answer.update({'images': answer_images})
 
     answer_data = list([a for a in answer_data if a['answer'] or a['answer'] == 0])  # Filter out empty answers, but not 0
     hint_data = json.loads(assessment_item.hints)
     for hint in hint_data:
         hint['hint'] = process_formulas(hint['hint'])
-        hint['hint'], hint_images = process_image_strings(hint['hint'], zf)
+        hint['hint'], hint_images = process_image_strings(hint['hint'], zf, read_image=read_image)
         hint.update({'images': hint_images})
 
     answers_sorted = answer_data
@@ -516,19 +1216,18 @@ def process_formulas(content):
     return content
 
 
-def process_image_strings(content, zf):
+def process_image_strings(content, zf, read_image=read_storage_file):
     image_list = []
     content = content.replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
-    for match in re.finditer(r'!\[(?:[^\]]*)]\(([^\)]+)\)', content):
-        img_match = re.search(r'(.+/images/[^\s]+)(?:\s=([0-9\.]+)x([0-9\.]+))*', match.group(1))
+    for match in re.finditer(MARKDOWN_IMAGE_REGEX, content):
+        img_match = re.search(EXERCISE_IMAGE_PATH_REGEX, match.group(1))
         if img_match:
             # Add any image files that haven't been written to the zipfile
             filename = img_match.group(1).split('/')[-1]
             checksum, ext = os.path.splitext(filename)
             image_name = "images/{}.{}".format(checksum, ext[1:])
             if image_name not in zf.namelist():
-                with storage.open(ccmodels.generate_object_storage_name(checksum, filename), 'rb') as imgfile:
-                    write_to_zipfile(image_name, imgfile.read(), zf)
+                write_to_zipfile(image_name, read_image(ccmodels.generate_object_storage_name(checksum, filename)), zf)
 
             # Add resizing data
             if img_match.group(2) and img_match.group(3):
@@ -611,6 +1310,39 @@ def map_tags_to_node(kolibrinode, ccnode):
     kolibrinode.save()
 
 
+def get_export_database_path(channel_id):
+    return os.path.join(settings.DB_ROOT, "{id}.sqlite3".format(id=channel_id))
+
+
+def load_previous_export_database(channel_id, tempdb):
+    """ load_previous_export_database: copies the last published export of a channel into the active content database
+        Args:
+            channel_id (str): channel to load the previous export for
+            tempdb (str): path of the active content database
+        Returns: True if the previous export was loaded and has the same schema as the current content models
+    """
+    export_db_location = get_export_database_path(channel_id)
+    if not storage.exists(export_db_location):
+        return False
+
+    connection = connections[get_active_content_database()]
+    connection.close()
+    with storage.open(export_db_location, 'rb') as previousf, open(tempdb, 'wb') as tempf:
+        shutil.copyfileobj(previousf, tempf)
+
+    executor = MigrationExecutor(connection)
+    leaf_nodes = [node for node in executor.loader.graph.leaf_nodes() if node[0] == APP_CONFIG_LABEL]
+    if not executor.migration_plan(leaf_nodes) and \
+            kolibrimodels.ChannelMetadata.objects.filter(min_schema_version=MIN_SCHEMA_VERSION).exists():
+        logging.info("Loaded the previous export database.")
+        return True
+
+    logging.info("Previous export database has a different schema, discarding it.")
+    connection.close()
+    open(tempdb, 'wb').close()
+    return False
+
+
 def prepare_export_database(tempdb):
     call_command("flush", "--noinput", database=get_active_content_database())  # clears the db!
     call_command("migrate",
@@ -638,6 +1370,7 @@ def mark_all_nodes_as_published(channel):
     logging.debug("Marking all nodes as published.")
 
     channel.main_tree.get_family().update(changed=False, published=True)
+    rebuild_aggregates(channel.main_tree.tree_id)
 
     logging.info("Marked all nodes as published.")
 
@@ -645,7 +1378,7 @@ def mark_all_nodes_as_published(channel):
 def save_export_database(channel_id):
     logging.debug("Saving export database")
     current_export_db_location = get_active_content_database()
-    target_export_db_location = os.path.join(settings.DB_ROOT, "{id}.sqlite3".format(id=channel_id))
+    target_export_db_location = get_export_database_path(channel_id)
 
     with open(current_export_db_location, 'rb') as currentf:
         storage.save(target_export_db_location, currentf)
@@ -689,17 +1422,43 @@ def fill_published_fields(channel, version_notes):
     channel.save()
 
 
-def publish_channel(user_id, channel_id, version_notes='', force=False, force_exercises=False, send_email=False, task_object=None):
+def fill_channel_facets(channel):
+    """
+    Store what the published nodes of the main tree of the channel contain, for the catalog filters
+    """
+    publishable = get_publishable_nodes(get_tree_nodes(channel.main_tree))
+    node_ids = set(node.id for node in publishable)
+    kinds = set(node.kind_id for node in publishable if node.kind_id)
+    subtitled_node_ids = ccmodels.File.objects.filter(
+        contentnode__tree_id=channel.main_tree.tree_id, preset__subtitle=True
+    ).values_list('contentnode_id', flat=True)
+    ccmodels.ChannelFacets.objects.update_or_create(
+        channel=channel,
+        defaults={
+            'kinds': sorted(kinds),
+            'licenses': sorted(set(node.license_id for node in publishable if node.license_id)),
+            'has_coach_content': any(node.role_visibility == roles.COACH for node in publishable),
+            'has_exercises': content_kinds.EXERCISE in kinds,
+            'has_subtitles': any(node_id in node_ids for node_id in subtitled_node_ids.iterator()),
+        },
+    )
+
+
+def publish_channel(user_id, channel_id, version_notes='', force=False, force_exercises=False, send_email=False, task_object=None,
+                    bulk=False, incremental=False):
     channel = ccmodels.Channel.objects.get(pk=channel_id)
     kolibri_temp_db = None
 
     try:
         set_channel_icon_encoding(channel)
-        kolibri_temp_db = create_content_database(channel, force, user_id, force_exercises, task_object)
+        kolibri_temp_db = create_content_database(channel, force, user_id, force_exercises, task_object, bulk=bulk,
+                                                  incremental=incremental)
         increment_channel_version(channel)
         mark_all_nodes_as_published(channel)
         add_tokens_to_channel(channel)
         fill_published_fields(channel, version_notes)
+        fill_channel_facets(channel)
+        refresh_content_locations([channel.main_tree.tree_id])
 
         # Attributes not getting set for some reason, so just save it here
         channel.main_tree.publishing = False
@@ -1,5 +1,6 @@
 import mimetypes
 from datetime import timedelta
+from multiprocessing.dummy import Pool as ThreadPool
 
 from django.conf import settings
 from django.core.files.storage import default_storage
@@ -28,6 +29,34 @@ def determine_content_type(filename):
         return typ
 
 
+def get_existing_files(file_paths, storage=default_storage, concurrency=None):
+    """Return the subset of the given file paths that exist in storage.
+
+    :param: file_paths: the file paths inside the bucket to check.
+    :param: storage: the storage backend to check. Google Cloud Storage uses its own bulk
+    check, while any other backend, e.g. S3 or Minio, has exists() called for each path.
+    :param: concurrency: the maximum number of requests to make at once. Defaults to
+    the STORAGE_EXISTS_CONCURRENCY setting.
+
+    :returns: a set of the file paths that exist.
+    """
+    concurrency = concurrency or settings.STORAGE_EXISTS_CONCURRENCY
+    if isinstance(storage, GoogleCloudStorage):
+        return storage.exists_many(file_paths, concurrency=concurrency)
+
+    file_paths = list(set(file_paths))
+    if not file_paths:
+        return set()
+
+    pool = ThreadPool(min(concurrency, len(file_paths)))
+    try:
+        exists = pool.map(storage.exists, file_paths)
+    finally:
+        pool.close()
+        pool.join()
+    return set(path for path, found in zip(file_paths, exists) if found)
+
+
 def get_presigned_upload_url(
     filepath, md5sum_b64, lifetime_sec, content_length, storage=default_storage, client=None
 ):
@@ -2,16 +2,45 @@ from __future__ import division
 
 import copy
 import logging
+from collections import defaultdict
 
 from django.db.models import Q
+from django.utils import timezone
 from django_bulk_update.helper import bulk_update
 from le_utils.constants import content_kinds
 from le_utils.constants import format_presets
-from past.utils import old_div
+from search import search_index
 
 from contentcuration.models import AssessmentItem
+from contentcuration.models import ContentNode
 from contentcuration.models import ContentTag
 from contentcuration.models import File
+from contentcuration.node_metadata import aggregates
+
+# Number of nodes to sync at once
+SYNC_BATCH_SIZE = 500
+
+# Node attributes synced from the original node
+node_attribute_fields = (
+    "title",
+    "description",
+    "license_id",
+    "copyright_holder",
+    "author",
+    "extra_fields",
+)
+
+assessment_item_fields = (
+    "type",
+    "question",
+    "hints",
+    "answers",
+    "order",
+    "raw_data",
+    "source_url",
+    "randomize",
+    "deleted",
+)
 
 
 def sync_channel(
@@ -21,7 +50,15 @@ def sync_channel(
     sync_files=False,
     sync_assessment_items=False,
     task_object=None,
+    dry_run=False,
 ):
+    """
+    Sync the imported nodes in the main tree of `channel` with their original nodes,
+    SYNC_BATCH_SIZE nodes at a time.
+
+    Returns the differences found, by node id, which are only reported and
+    not applied when `dry_run` is set. See `diff_nodes` for their format.
+    """
     nodes_to_sync = channel.main_tree.get_descendants().filter(
         Q(original_node__isnull=False)
         | Q(original_channel_id__isnull=False, original_source_node_id__isnull=False)
@@ -29,24 +66,36 @@ def sync_channel(
     sync_node_count = nodes_to_sync.count()
     if not sync_node_count:
         raise ValueError("Tried to sync a channel that has no imported content")
-    total_percent = 100.0
-    percent_per_node = old_div(total_percent, sync_node_count)
-    percent_done = 0.0
-    for node in nodes_to_sync:
-        node = sync_node(
-            node,
+    nodes_to_sync = nodes_to_sync.order_by("lft")
+    diff = {}
+    for start in range(0, sync_node_count, SYNC_BATCH_SIZE):
+        nodes = list(nodes_to_sync[start:start + SYNC_BATCH_SIZE])
+        original_nodes = ContentNode.objects.get_original_nodes(nodes)
+        # Only update nodes that are not their own original
+        pairs = [
+            (node, original_nodes[node.pk])
+            for node in nodes
+            if original_nodes[node.pk].node_id != node.node_id
+        ]
+        batch_diff, changes = diff_nodes(
+            pairs,
             sync_attributes=sync_attributes,
             sync_tags=sync_tags,
             sync_files=sync_files,
             sync_assessment_items=sync_assessment_items,
         )
+        if not dry_run:
+            apply_changes(changes)
+        diff.update(batch_diff)
         if task_object:
-            percent_done = min(percent_done + percent_per_node, total_percent)
-            task_object.update_state(state="STARTED", meta={"progress": percent_done})
-        if node.changed:
-            node.save()
-    if task_object:
-        task_object.update_state(state="STARTED", meta={"progress": 100.0})
+            progress = min(100.0 * (start + len(nodes)) / sync_node_count, 100.0)
+            task_object.update_state(state="STARTED", meta={"progress": progress})
+    logging.info(
+        "Synced {} of {} imported nodes in channel {}".format(
+            len(diff), sync_node_count, channel.id
+        )
+    )
+    return diff
 
 
 def sync_node(
@@ -55,165 +104,263 @@ def sync_node(
     sync_tags=False,
     sync_files=False,
     sync_assessment_items=False,
+    original_node=None,
 ):
-    original_node = node.get_original_node()
+    if original_node is None:
+        original_node = node.get_original_node()
     if original_node.node_id != node.node_id:  # Only update if node is not original
-        logging.info(
-            "----- Syncing: {} from {}".format(
-                node.title, original_node.get_channel().name
-            )
+        _diff, changes = diff_nodes(
+            [(node, original_node)],
+            sync_attributes=sync_attributes,
+            sync_tags=sync_tags,
+            sync_files=sync_files,
+            sync_assessment_items=sync_assessment_items,
         )
-        if sync_attributes:  # Sync node metadata
-            sync_node_data(node, original_node)
-        if sync_tags:  # Sync node tags
-            sync_node_tags(node, original_node)
-        if sync_files:  # Sync node files
-            sync_node_files(node, original_node)
-        if (
-            sync_assessment_items and node.kind_id == content_kinds.EXERCISE
-        ):  # Sync node exercises
-            sync_node_assessment_items(node, original_node)
+        apply_changes(changes)
     return node
 
 
-def sync_node_data(node, original):
-    node.title = original.title
-    node.description = original.description
-    node.license_id = original.license_id
-    node.copyright_holder = original.copyright_holder
-    node.author = original.author
-    node.extra_fields = original.extra_fields
-    # Set changed if anything has changed
-    node.on_update()
-
-
-def sync_node_tags(node, original):
-    # Remove tags that aren't in original
-    for tag in node.tags.exclude(
-        tag_name__in=original.tags.values_list("tag_name", flat=True)
-    ):
-        node.tags.remove(tag)
-        node.changed = True
-    # Add tags that are in original
-    for tag in original.tags.exclude(
-        tag_name__in=node.tags.values_list("tag_name", flat=True)
-    ):
-        new_tag, _ = ContentTag.objects.get_or_create(
-            tag_name=tag.tag_name, channel_id=None,
+def diff_nodes(
+    pairs,
+    sync_attributes=False,
+    sync_tags=False,
+    sync_files=False,
+    sync_assessment_items=False,
+):
+    """
+    Compare each node with its original node, for a list of (node, original) pairs,
+    with a fixed number of queries for the whole list.
+
+    Returns a tuple of the differences by node id, in the form:
+        {
+            "attributes": {field: original value},
+            "tags": {"added": [tag names], "removed": [tag names]},
+            "files": {"added": [checksums], "removed": [checksums]},
+            "assessment_items": {"added": [ids], "updated": [ids], "removed": [ids]},
+        }
+    with only the keys that have differences, and the changes for `apply_changes`
+    to make to the database to sync them. The attributes of the nodes are updated in place.
+    """
+    diff = defaultdict(dict)
+    changes = defaultdict(list)
+    if sync_attributes or sync_assessment_items:
+        _diff_attributes(pairs, sync_attributes, sync_assessment_items, diff)
+    if sync_tags:
+        _diff_tags(pairs, diff, changes)
+    if sync_files:
+        _diff_files(pairs, diff, changes)
+    if sync_assessment_items:
+        _diff_assessment_items(
+            [(node, original) for node, original in pairs if node.kind_id == content_kinds.EXERCISE],
+            diff,
+            changes,
         )
-        node.tags.add(new_tag)
-        node.changed = True
+    changes["nodes"] = [node for node, _original in pairs if node.pk in diff]
+    return dict(diff), changes
 
 
-def sync_node_files(node, original):
+def apply_changes(changes):
     """
-    Sync all files in ``node`` from the files in ``original`` node.
+    Make the changes returned by `diff_nodes`, in bulk
     """
-    node_files = {}
-
-    for file in node.files.all():
-        if file.preset_id == format_presets.VIDEO_SUBTITLE:
-            file_key = "{}:{}".format(file.preset_id, file.language_id)
-        else:
-            file_key = file.preset_id
-        node_files[file_key] = file
-
-    source_files = {}
-
-    for file in original.files.all():
-        if file.preset_id == format_presets.VIDEO_SUBTITLE:
-            file_key = "{}:{}".format(file.preset_id, file.language_id)
-        else:
-            file_key = file.preset_id
-        source_files[file_key] = file
-
-    files_to_delete = []
-    files_to_create = []
-    # B. Add all files that are in original
-    for file_key, source_file in source_files.items():
-        # 1. Look for old file with matching preset (and language if subs file)
-        node_file = node_files.get(file_key)
-        if not node_file or node_file.checksum != source_file.checksum:
-            if node_file:
-                files_to_delete.append(node_file.id)
-            source_file.id = None
-            source_file.contentnode_id = node.id
-            files_to_create.append(source_file)
+    _apply_tag_changes(changes)
+    _apply_assessment_item_changes(changes)
+
+    if changes["files_to_delete"]:
+        File.objects.filter(id__in=changes["files_to_delete"]).delete()
+    if changes["files_to_create"]:
+        File.objects.bulk_create(changes["files_to_create"])
+        sizes_by_node = defaultdict(int)
+        for file in changes["files_to_create"]:
+            if file.contentnode_id and file.file_size:
+                sizes_by_node[file.contentnode_id] += file.file_size
+        aggregates.add_file_sizes(sizes_by_node)
+
+    if changes["nodes"]:
+        now = timezone.now()
+        for node in changes["nodes"]:
             node.changed = True
+            node.modified = now
+        with aggregates.track_changes(node.pk for node in changes["nodes"]):
+            bulk_update(
+                changes["nodes"],
+                update_fields=node_attribute_fields + ("changed", "modified"),
+            )
+        search_index.update_search_vectors(node_ids=[node.pk for node in changes["nodes"]])
 
-    if files_to_delete:
-        File.objects.filter(id__in=files_to_delete).delete()
 
-    if files_to_create:
-        File.objects.bulk_create(files_to_create)
+def _apply_tag_changes(changes):
+    if changes["tags_to_add"]:
+        tag_names = {tag_name for _node_id, tag_name in changes["tags_to_add"]}
+        tag_ids = dict(
+            ContentTag.objects.filter(
+                tag_name__in=tag_names, channel__isnull=True
+            ).values_list("tag_name", "id")
+        )
+        tags_to_create = [
+            ContentTag(tag_name=tag_name) for tag_name in tag_names if tag_name not in tag_ids
+        ]
+        ContentTag.objects.bulk_create(tags_to_create)
+        tag_ids.update({tag.tag_name: tag.id for tag in tags_to_create})
+        ContentNode.tags.through.objects.bulk_create(
+            [
+                ContentNode.tags.through(contentnode_id=node_id, contenttag_id=tag_ids[tag_name])
+                for node_id, tag_name in changes["tags_to_add"]
+            ]
+        )
+    if changes["tags_to_remove"]:
+        ContentNode.tags.through.objects.filter(id__in=changes["tags_to_remove"]).delete()
 
 
-assessment_item_fields = (
-    "type",
-    "question",
-    "hints",
-    "answers",
-    "order",
-    "raw_data",
-    "source_url",
-    "randomize",
-    "deleted",
-)
+def _apply_assessment_item_changes(changes):
+    if changes["assessment_items_to_delete"]:
+        AssessmentItem.objects.filter(id__in=changes["assessment_items_to_delete"]).delete()
+    if changes["assessment_items_to_update"]:
+        bulk_update(changes["assessment_items_to_update"], update_fields=assessment_item_fields)
+    if changes["assessment_items_to_create"]:
+        # The ids of the new assessment items are set on them by bulk_create
+        AssessmentItem.objects.bulk_create(
+            [assessment_item for assessment_item, _files in changes["assessment_items_to_create"]]
+        )
+        for assessment_item, files in changes["assessment_items_to_create"]:
+            for file in files:
+                file.assessment_item_id = assessment_item.id
+            changes["files_to_create"].extend(files)
 
 
-def sync_node_assessment_items(node, original):  # noqa C901
-    node_assessment_items = {}
+def _diff_attributes(pairs, sync_attributes, sync_assessment_items, diff):
+    for node, original in pairs:
+        fields = node_attribute_fields if sync_attributes else ()
+        if sync_assessment_items and node.kind_id == content_kinds.EXERCISE:
+            # Exercise settings are stored in extra_fields, so are synced with the assessment items
+            fields = set(fields) | {"extra_fields"}
+        attributes = {
+            field: getattr(original, field)
+            for field in fields
+            if getattr(node, field) != getattr(original, field)
+        }
+        if attributes:
+            diff[node.pk]["attributes"] = attributes
+            for field, value in attributes.items():
+                setattr(node, field, value)
 
-    for ai in node.assessment_items.all():
-        node_assessment_items[ai.assessment_id] = ai
 
-    node.extra_fields = original.extra_fields
-    files_to_delete = []
-    files_to_create = []
+def _diff_tags(pairs, diff, changes):
+    node_tags = defaultdict(dict)
+    for mapping_id, contentnode_id, tag_name in ContentNode.tags.through.objects.filter(
+        contentnode_id__in=_node_ids(pairs)
+    ).values_list("id", "contentnode_id", "contenttag__tag_name"):
+        node_tags[contentnode_id][tag_name] = mapping_id
 
-    ai_to_update = []
+    for node, original in pairs:
+        tags = node_tags[node.pk]
+        original_tags = node_tags[original.pk]
+        removed = sorted(set(tags) - set(original_tags))
+        added = sorted(set(original_tags) - set(tags))
+        if removed or added:
+            diff[node.pk]["tags"] = {"added": added, "removed": removed}
+            changes["tags_to_remove"].extend(tags[tag_name] for tag_name in removed)
+            changes["tags_to_add"].extend((node.pk, tag_name) for tag_name in added)
 
-    for source_ai in original.assessment_items.all():
-        ai_id = source_ai.assessment_id
-        node_ai = node_assessment_items.get(ai_id)
-        if not node_ai:
-            node_ai = copy.copy(source_ai)
-            node_ai.id = None
-            node_ai.contentnode_id = node.id
-            node_ai.save()
-            node.changed = True
-        else:
-            for field in assessment_item_fields:
-                setattr(node_ai, field, getattr(source_ai, field))
-            if node_ai.has_changes():
-                ai_to_update.append(node_ai)
-            node_assessment_items.pop(ai_id)
-        node_ai_files = {}
-        if node_ai.id is not None:
-            for file in node_ai.files.all():
-                node_ai_files[file.checksum] = file
-        for file in source_ai.files.all():
-            if file.checksum not in node_ai_files:
-                file.id = None
-                file.assessment_item_id = node_ai.id
-                files_to_create.append(file)
-            else:
-                node_ai_files.pop(file.checksum)
-        files_to_delete.extend([f.id for f in node_ai_files.values()])
-
-    ai_to_delete = [a.id for a in node_assessment_items.values()]
-    if ai_to_delete:
-        AssessmentItem.objects.filter(id__in=ai_to_delete).delete()
-        node.changed = True
-
-    if ai_to_update:
-        bulk_update(ai_to_update, update_fields=assessment_item_fields)
-        node.changed = True
-
-    if files_to_delete:
-        File.objects.filter(id__in=files_to_delete).delete()
-        node.changed = True
-
-    if files_to_create:
-        File.objects.bulk_create(files_to_create)
-        node.changed = True
+
+def _get_file_key(file):
+    if file.preset_id == format_presets.VIDEO_SUBTITLE:
+        return "{}:{}".format(file.preset_id, file.language_id)
+    return file.preset_id
+
+
+def _diff_files(pairs, diff, changes):
+    node_files = defaultdict(dict)
+    for file in File.objects.filter(contentnode_id__in=_node_ids(pairs)):
+        node_files[file.contentnode_id][_get_file_key(file)] = file
+
+    for node, original in pairs:
+        files = node_files[node.pk]
+        added = []
+        removed = []
+        for file_key, source_file in node_files[original.pk].items():
+            # Look for an existing file with a matching preset (and language if subs file)
+            node_file = files.get(file_key)
+            if not node_file or node_file.checksum != source_file.checksum:
+                if node_file:
+                    changes["files_to_delete"].append(node_file.id)
+                    removed.append(node_file.checksum)
+                changes["files_to_create"].append(_copy_object(source_file, contentnode_id=node.pk))
+                added.append(source_file.checksum)
+        if added:
+            diff[node.pk]["files"] = {"added": added, "removed": removed}
+
+
+def _diff_assessment_items(pairs, diff, changes):  # noqa C901
+    node_assessment_items = defaultdict(dict)
+    for assessment_item in AssessmentItem.objects.filter(
+        contentnode_id__in=_node_ids(pairs)
+    ).prefetch_related("files"):
+        node_assessment_items[assessment_item.contentnode_id][
+            assessment_item.assessment_id
+        ] = assessment_item
+
+    for node, original in pairs:
+        assessment_items = dict(node_assessment_items[node.pk])
+        added = []
+        updated = []
+        for assessment_id, source_ai in node_assessment_items[original.pk].items():
+            node_ai = assessment_items.pop(assessment_id, None)
+            if not node_ai:
+                changes["assessment_items_to_create"].append(
+                    (
+                        _copy_object(source_ai, contentnode_id=node.pk),
+                        [_copy_object(file) for file in source_ai.files.all()],
+                    )
+                )
+                added.append(assessment_id)
+                continue
+            if any(
+                getattr(node_ai, field) != getattr(source_ai, field)
+                for field in assessment_item_fields
+            ):
+                for field in assessment_item_fields:
+                    setattr(node_ai, field, getattr(source_ai, field))
+                changes["assessment_items_to_update"].append(node_ai)
+                updated.append(assessment_id)
+            node_ai_files = {file.checksum: file for file in node_ai.files.all()}
+            files_to_create = [
+                _copy_object(file, assessment_item_id=node_ai.id)
+                for file in source_ai.files.all()
+                if node_ai_files.pop(file.checksum, None) is None
+            ]
+            if files_to_create or node_ai_files:
+                changes["files_to_create"].extend(files_to_create)
+                changes["files_to_delete"].extend(file.id for file in node_ai_files.values())
+                if assessment_id not in updated:
+                    updated.append(assessment_id)
+        removed = list(assessment_items)
+        changes["assessment_items_to_delete"].extend(
+            assessment_item.id for assessment_item in assessment_items.values()
+        )
+        if added or updated or removed:
+            diff[node.pk]["assessment_items"] = {
+                "added": added,
+                "updated": updated,
+                "removed": removed,
+            }
+
+
+def _node_ids(pairs):
+    node_ids = set()
+    for node, original in pairs:
+        node_ids.add(node.pk)
+        node_ids.add(original.pk)
+    return node_ids
+
+
+def _copy_object(obj, **attributes):
+    """
+    Return an unsaved copy of a model instance, with `attributes` set on it
+    """
+    obj_copy = copy.copy(obj)
+    # Gives a new id for UUIDField primary keys, and None for AutoFields
+    obj_copy.pk = obj._meta.pk.get_default()
+    for attr, value in attributes.items():
+        setattr(obj_copy, attr, value)
+    return obj_copy
@@ -4,3 +4,11 @@ def trace(f):
         return newrelic.agent.function_trace()(f)
     except ImportError:
         return f
+
+
+def record_metric(name, value):
+    try:
+        import newrelic.agent
+        newrelic.agent.record_custom_metric(name, value)
+    except ImportError:
+        pass
@@ -1,12 +1,15 @@
 import json
 import logging
+import os
 from collections import namedtuple
 from distutils.version import LooseVersion
+from itertools import chain
 
 from builtins import str
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import PermissionDenied
 from django.core.exceptions import SuspiciousOperation
+from django.core.exceptions import ValidationError
 from django.core.management import call_command
 from django.db import transaction
 from django.http import HttpResponseBadRequest
@@ -26,6 +29,7 @@ from rest_framework.decorators import authentication_classes
 from rest_framework.decorators import permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from search import search_index
 
 from contentcuration import ricecooker_versions as rc
 from contentcuration.api import activate_channel
@@ -35,18 +39,26 @@ from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
 from contentcuration.models import ContentNode
 from contentcuration.models import ContentTag
+from contentcuration.models import File
+from contentcuration.models import FormatPreset
+from contentcuration.models import generate_object_storage_name
+from contentcuration.models import Language
 from contentcuration.models import License
 from contentcuration.models import SlideshowSlide
 from contentcuration.models import StagedFile
+from contentcuration.node_metadata import aggregates
 from contentcuration.serializers import GetTreeDataSerializer
 from contentcuration.utils.files import get_file_diff
+from contentcuration.utils.files import get_missing_storage_files
+from contentcuration.utils.files import get_thumbnail_encoding
+from contentcuration.utils.files import get_thumbnail_encodings
 from contentcuration.utils.garbage_collect import get_deleted_chefs_root
 from contentcuration.utils.nodes import map_files_to_assessment_item
 from contentcuration.utils.nodes import map_files_to_node
 from contentcuration.utils.nodes import map_files_to_slideshow_slide_item
 from contentcuration.utils.tracing import trace
 from contentcuration.viewsets.sync.constants import CHANNEL
-from contentcuration.viewsets.sync.utils import add_event_for_user
+from contentcuration.viewsets.sync.utils import add_event_for_users
 from contentcuration.viewsets.sync.utils import generate_update_event
 
 
@@ -56,6 +68,11 @@ VERSION_SOFT_WARNING = VersionStatus(version=rc.VERSION_SOFT_WARNING, status=1,
 VERSION_HARD_WARNING = VersionStatus(version=rc.VERSION_HARD_WARNING, status=2, message=rc.VERSION_HARD_WARNING_MESSAGE)
 VERSION_ERROR = VersionStatus(version=rc.VERSION_ERROR, status=3, message=rc.VERSION_ERROR_MESSAGE)
 
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# Number of nodes to validate and insert together when adding nodes in bulk
+BULK_INGEST_BATCH_SIZE = 500
+
 
 def handle_server_error(request):
     client.captureException(stack=True, tags={'url': request.path})
@@ -141,6 +158,7 @@ def api_file_upload(request):
         write_file_to_storage(fobj, check_valid=True)
         StagedFile.objects.get_or_create(
             checksum=checksum,
+            extension=ext.lower(),
             file_size=fobj._size,
             uploaded_by=request.user
         )
@@ -230,8 +248,7 @@ def api_commit_channel(request):
                 return Response(str(e), status=e.status_code)
 
         # Send event (new staging tree or new main tree) to all channel editors
-        for editor in obj.editors.all():
-            add_event_for_user(editor.id, event)
+        add_event_for_users(obj.editors.values_list("id", flat=True), event)
 
         # Send response back to the content integration script
         return Response({
@@ -286,6 +303,51 @@ def api_add_nodes_to_tree(request):
         return HttpResponseServerError(content=str(e), reason=str(e))
 
 
+@api_view(['POST'])
+@authentication_classes((TokenAuthentication, SessionAuthentication,))
+@permission_classes((IsAuthenticated,))
+def api_add_nodes_to_tree_bulk(request):
+    """
+    Bulk counterpart to `api_add_nodes_to_tree`, which validates and inserts the
+    nodes in batches rather than one row at a time.
+
+    Accepts the same JSON body as `api_add_nodes_to_tree`, or newline delimited
+    JSON (content type `application/x-ndjson`) so that the payload is never held
+    in memory as a whole. In that case the first line is `{"root_id": "<pk>"}`
+    and each following line is one node from `content_data`.
+
+    Each batch is committed on its own. As nodes already under the parent are
+    skipped, a failed request can safely be retried.
+
+    Response is of the same form as `api_add_nodes_to_tree`.
+    """
+    parent_id = None
+    try:
+        if request.content_type == NDJSON_CONTENT_TYPE:
+            content_data = read_ndjson(request.stream)
+            parent_id = next(content_data, {})['root_id']
+        else:
+            data = json.loads(request.body)
+            content_data = data['content_data']
+            parent_id = data['root_id']
+        node = ContentNode.objects.get(id=parent_id)
+        request.user.can_edit_node(node)
+        with ContentNode.objects.disable_mptt_updates():
+            return Response({
+                "success": True,
+                "root_ids": bulk_convert_data_to_nodes(request.user, content_data, parent_id)
+            })
+    except (ContentNode.DoesNotExist, PermissionDenied):
+        return HttpResponseNotFound("No content matching: {}".format(parent_id))
+    except KeyError as e:
+        return HttpResponseBadRequest("Required attribute missing from data: {}".format(e))
+    except (ValueError, ValidationError) as e:
+        return HttpResponseBadRequest("Invalid node data: {}".format(e))
+    except Exception as e:
+        handle_server_error(request)
+        return HttpResponseServerError(content=str(e), reason=str(e))
+
+
 @api_view(['POST'])
 @authentication_classes((TokenAuthentication, SessionAuthentication,))
 @permission_classes((IsAuthenticated,))
@@ -563,6 +625,230 @@ def convert_data_to_nodes(user, content_data, parent_node):
         raise ObjectDoesNotExist("Error creating node: {0}".format(e))
 
 
+def read_ndjson(stream):
+    """ Parse newline delimited JSON one line at a time """
+    if stream is None:
+        return
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+@trace
+def bulk_convert_data_to_nodes(user, content_data, parent_node, batch_size=BULK_INGEST_BATCH_SIZE):
+    """ Parse dicts and create nodes a batch at a time, using a fixed number of queries per batch """
+    root_mapping = {}
+    parent_node = ContentNode.objects.get(pk=parent_node)
+    channel = parent_node.get_channel()
+    sort_order = parent_node.children.count() + 1
+    existing_node_ids = set(ContentNode.objects.filter(parent_id=parent_node.pk).values_list('node_id', flat=True))
+    lookups = NodeDataLookups()
+
+    batch = []
+    for node_data in chain(content_data, [None]):
+        if node_data is not None:
+            # Check if node id is already in the tree to avoid duplicates
+            if node_data['node_id'] in existing_node_ids:
+                continue
+            existing_node_ids.add(node_data['node_id'])
+            batch.append(node_data)
+        if batch and (node_data is None or len(batch) >= batch_size):
+            with transaction.atomic():
+                created = create_node_batch(user, batch, parent_node, channel, sort_order, lookups)
+            root_mapping.update(created)
+            sort_order += len(batch)
+            batch = []
+
+    return root_mapping
+
+
+class NodeDataLookups(object):
+    """ Resolves the licenses, languages and presets referenced by node data, caching them across batches """
+
+    def __init__(self):
+        self.licenses = {license.license_name.lower(): license for license in License.objects.all()}
+        self.presets = set()
+        self.thumbnail_presets = set()
+        self.guessed_presets = {}
+        presets = FormatPreset.objects.order_by('id').values_list('id', 'thumbnail', 'display', 'allowed_formats__extension')
+        for preset_id, thumbnail, display, extension in presets:
+            self.presets.add(preset_id)
+            if thumbnail:
+                self.thumbnail_presets.add(preset_id)
+            # Only guess presets that are displayed, as FormatPreset.guess_format_preset does
+            if display and extension:
+                self.guessed_presets.setdefault(extension, preset_id)
+        self.languages = set()
+
+    def get_license(self, license_name):
+        if license_name is None:
+            return None
+        try:
+            return self.licenses[license_name.lower()]
+        except KeyError:
+            raise ValidationError("Invalid license found")
+
+    def get_preset_id(self, preset_id, filename):
+        if preset_id in self.presets:
+            return preset_id
+        return self.guessed_presets.get(os.path.splitext(filename)[1].lstrip("."))
+
+    def load_languages(self, language_ids):
+        missing = set(language_ids) - self.languages - {None}
+        if missing:
+            self.languages.update(Language.objects.filter(id__in=missing).values_list('id', flat=True))
+        invalid = missing - self.languages
+        if invalid:
+            raise ValidationError("Invalid languages found: {}".format(", ".join(sorted(invalid))))
+
+
+def create_node_batch(user, batch, parent_node, channel, sort_order, lookups):  # noqa C901
+    """ Validate a batch of node dicts and bulk insert the nodes, their files, questions and tags """
+    node_files = [[f for f in node_data['files'] if f] for node_data in batch]
+    question_files = [[[f for f in question['files'] if f] for question in node_data['questions']] for node_data in batch]
+
+    # Validate everything the batch references before writing anything
+    lookups.load_languages(
+        [node_data.get('language') for node_data in batch]
+        + [f.get('language') for files in node_files for f in files]
+    )
+    all_filenames = [f['filename'] for files in node_files for f in files]
+    all_filenames += [f['filename'] for questions in question_files for files in questions for f in files]
+    missing = get_missing_storage_files(
+        generate_object_storage_name(os.path.splitext(filename)[0], filename) for filename in all_filenames
+    )
+    if missing:
+        raise ValidationError('Files not found: {}'.format(", ".join(sorted(missing))))
+
+    thumbnails = [
+        f['filename'] for files in node_files for f in files
+        if lookups.get_preset_id(f['preset'], f['filename']) in lookups.thumbnail_presets
+    ]
+    thumbnail_encodings = get_thumbnail_encodings(thumbnails)
+
+    nodes = []
+    files = []
+    assessment_items = []
+    items_files = []
+    tag_names = []
+    for index, node_data in enumerate(batch):
+        extra_fields = node_data['extra_fields'] or {}
+        if isinstance(extra_fields, basestring):
+            extra_fields = json.loads(extra_fields)
+        node = ContentNode(
+            title=node_data['title'],
+            kind_id=node_data['kind'],
+            node_id=node_data['node_id'],
+            content_id=node_data['content_id'],
+            description=node_data['description'],
+            author=node_data['author'],
+            aggregator=node_data.get('aggregator') or "",
+            provider=node_data.get('provider') or "",
+            license=lookups.get_license(node_data['license']),
+            license_description=node_data.get('license_description'),
+            copyright_holder=node_data.get('copyright_holder') or "",
+            parent=parent_node,
+            extra_fields=extra_fields,
+            sort_order=sort_order + index,
+            source_id=node_data.get('source_id'),
+            source_domain=node_data.get('source_domain'),
+            language_id=node_data.get('language'),
+            freeze_authoring_data=True,
+            role_visibility=node_data.get('role') or roles.LEARNER,
+        )
+        nodes.append(node)
+        tag_names.append(node_data.get('tags') or [])
+
+        for file_data in node_files[index]:
+            file_obj = build_file_object(user, file_data, lookups.get_preset_id(file_data['preset'], file_data['filename']))
+            file_obj.contentnode = node
+            file_obj.language_id = file_data.get('language')
+            files.append(file_obj)
+            # The last thumbnail wins, as when mapping files one at a time
+            if file_obj.preset_id in lookups.thumbnail_presets:
+                node.thumbnail_encoding = json.dumps({
+                    'base64': thumbnail_encodings.get(file_data['filename']) or get_thumbnail_encoding(file_data['filename']),
+                    'points': [],
+                    'zoom': 0
+                })
+
+        for order, question in enumerate(node_data['questions']):
+            assessment_items.append(AssessmentItem(
+                type=question.get('type'),
+                question=question.get('question'),
+                hints=question.get('hints'),
+                answers=question.get('answers'),
+                order=order,
+                contentnode=node,
+                assessment_id=question.get('assessment_id'),
+                raw_data=question.get('raw_data'),
+                source_url=question.get('source_url'),
+                randomize=question.get('randomize') or False,
+            ))
+            # Assessment item files always have a preset
+            items_files.append([build_file_object(user, f, f['preset']) for f in question_files[index][order]])
+
+    with ContentNode.objects.lock_mptt(parent_node.tree_id):
+        # Append the nodes as the last children of the parent, making space for them in the tree
+        parent_node.refresh_from_db(fields=['lft', 'rght', 'level'])
+        cursor = ContentNode.objects.make_space_for_children(parent_node, 2 * len(nodes))
+        for index, node in enumerate(nodes):
+            node.tree_id = parent_node.tree_id
+            node.level = parent_node.level + 1
+            node.lft = cursor + 2 * index
+            node.rght = node.lft + 1
+        ContentNode.objects.bulk_create(nodes)
+    ContentNode.objects.filter(pk=parent_node.pk).update(changed=True)
+
+    AssessmentItem.objects.bulk_create(assessment_items)
+    for item, item_files in zip(assessment_items, items_files):
+        for file_obj in item_files:
+            file_obj.assessment_item = item
+            files.append(file_obj)
+    File.objects.bulk_create(files)
+    node_ids = [node.pk for node in nodes]
+    aggregates.add_nodes(nodes)
+
+    tags = {
+        tag.tag_name: tag
+        for tag in ContentTag.objects.filter(channel=channel, tag_name__in=set(chain.from_iterable(tag_names)))
+    }
+    new_tags = [ContentTag(tag_name=name, channel=channel) for name in set(chain.from_iterable(tag_names)) if name not in tags]
+    ContentTag.objects.bulk_create(new_tags)
+    tags.update((tag.tag_name, tag) for tag in new_tags)
+    ContentNode.tags.through.objects.bulk_create([
+        ContentNode.tags.through(contentnode_id=node.id, contenttag_id=tags[name].id)
+        for node, names in zip(nodes, tag_names) for name in set(names)
+    ])
+    search_index.update_search_vectors(parent_node.tree_id, node_ids=node_ids)
+
+    for node, node_data in zip(nodes, batch):
+        # Create Slideshow slides (if slideshow kind)
+        if node_data['kind'] == 'slideshow':
+            slides = create_slides(user, node, node.extra_fields.get('slideshow_data'))
+            map_files_to_slideshow_slide_item(user, node, slides, node_data["files"])
+
+    return {node_data['node_id']: node.pk for node, node_data in zip(nodes, batch)}
+
+
+def build_file_object(user, file_data, preset_id):
+    """ Generate an unsaved file from file dict """
+    filename = file_data["filename"]
+    checksum, ext = os.path.splitext(filename)
+    file_obj = File(
+        checksum=checksum,
+        file_format_id=ext.lstrip("."),
+        original_filename=file_data.get('original_filename') or 'file',
+        source_url=file_data.get('source_url'),
+        file_size=file_data['size'],
+        preset_id=preset_id,
+        uploaded_by=user,
+    )
+    file_obj.file_on_disk.name = generate_object_storage_name(checksum, filename)
+    return file_obj
+
+
 def create_node(node_data, parent_node, sort_order):
     """ Generate node based on node dict """
     # Make sure license is valid
@@ -611,6 +897,8 @@ def create_node(node_data, parent_node, sort_order):
     if len(tags) > 0:
         node.tags = tags
         node.save()
+        # Tags aren't among the fields that update the search vector on save
+        search_index.update_search_vectors(node.tree_id, node_ids=[node.pk])
 
     return node
 
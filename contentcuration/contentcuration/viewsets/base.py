@@ -18,9 +18,14 @@ from rest_framework.status import HTTP_201_CREATED
 from rest_framework.status import HTTP_204_NO_CONTENT
 from rest_framework.utils import html
 from rest_framework.utils import model_meta
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
 from contentcuration.viewsets.common import MissingRequiredParamsException
+from contentcuration.viewsets.pagination import decode_cursor
+from contentcuration.viewsets.pagination import encode_cursor
+from contentcuration.viewsets.pagination import filter_after
+from contentcuration.viewsets.pagination import get_position
 
 
 class SimpleReprMixin(object):
@@ -361,6 +366,14 @@ class ReadOnlyValuesViewset(SimpleReprMixin, ReadOnlyModelViewSet):
     # to remove unneeded keys from the object as a side effect.
     field_map = {}
 
+    # Fields ordering the list uniquely, prefixed with "-" if descending, to page it by cursor
+    # when a client passes `max_results`. Defaults to the primary key.
+    cursor_ordering = None
+    cursor_query_param = "cursor"
+    max_results_query_param = "max_results"
+    # The most results a page of a list paged by cursor can have
+    max_results_limit = 1000
+
     def __init__(self, *args, **kwargs):
         viewset = super(ReadOnlyValuesViewset, self).__init__(*args, **kwargs)
         if not isinstance(self.values, tuple):
@@ -512,8 +525,59 @@ class ReadOnlyValuesViewset(SimpleReprMixin, ReadOnlyModelViewSet):
     def serialize(self, queryset):
         return self.consolidate(list(map(self._map_fields, queryset or [])), queryset)
 
+    def get_cursor_ordering(self, queryset):
+        return self.cursor_ordering or (queryset.model._meta.pk.name,)
+
+    def get_max_results(self):
+        try:
+            max_results = int(self.request.query_params[self.max_results_query_param])
+        except ValueError:
+            raise ValidationError("max_results must be an integer")
+        if max_results < 1:
+            raise ValidationError("max_results must be at least 1")
+        return min(max_results, self.max_results_limit)
+
+    def list_by_cursor(self, queryset):
+        """
+        Return a page of at most `max_results` results, starting after the position in `cursor`
+        if given, with the cursor for the next page, so that large lists can be read page by
+        page at the same cost for each page.
+        """
+        max_results = self.get_max_results()
+        ordering = self.get_cursor_ordering(queryset)
+        queryset = self.annotate_queryset(queryset)
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = filter_after(queryset, ordering, decode_cursor(cursor, ordering))
+
+        # The position of the last result is read from the ordering fields, so fetch any that aren't values
+        extra_values = tuple(
+            field.lstrip("-") for field in ordering if field.lstrip("-") not in self._values
+        )
+        queryset = queryset.values(*(self._values + extra_values)).order_by(*ordering)
+        items = list(queryset[:max_results + 1])
+
+        next_cursor = None
+        if len(items) > max_results:
+            items = items[:max_results]
+            next_cursor = encode_cursor(get_position(items[-1], ordering))
+        for item in items:
+            for field in extra_values:
+                item.pop(field)
+
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param, next_cursor
+            )
+        return Response(
+            {"next": next_url, "cursor": next_cursor, "results": self.serialize(items)}
+        )
+
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.prefetch_queryset(self.get_queryset()))
+        if self.max_results_query_param and self.max_results_query_param in request.query_params:
+            return self.list_by_cursor(queryset)
         queryset = self._cast_queryset_to_values(queryset)
 
         page = self.paginate_queryset(queryset)
@@ -44,11 +44,21 @@ from contentcuration.viewsets.common import CatalogPaginator
 from contentcuration.viewsets.common import ContentDefaultsSerializer
 from contentcuration.viewsets.common import SQCount
 from contentcuration.viewsets.common import UUIDInFilter
+from contentcuration.viewsets.pagination import CachedCountPagination
 from contentcuration.viewsets.sync.constants import CHANNEL
 from contentcuration.viewsets.sync.utils import generate_update_event
 
 
-class CatalogListPagination(PageNumberPagination):
+class CatalogListPagination(CachedCountPagination):
+    page_size = None
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    keyset_ordering = ("name", "id")
+    # The catalog only lists public channels
+    count_per_user = False
+
+
+class ChannelListPagination(PageNumberPagination):
     page_size = None
     page_size_query_param = "page_size"
     max_page_size = 1000
@@ -212,6 +222,30 @@ class BaseChannelFilter(RequiredFilterSet):
         fields = base_channel_filter_fields
 
 
+class CatalogFilter(BaseChannelFilter):
+    """
+    Filters public channels on the facets computed when they were last published,
+    rather than on their main trees, which hold any changes made since
+    """
+
+    def filter_licenses(self, queryset, name, value):
+        return queryset.filter(
+            facets__licenses__overlap=[int(l_id) for l_id in value.split(",")]
+        )
+
+    def filter_kinds(self, queryset, name, value):
+        return queryset.filter(facets__kinds__overlap=value.split(","))
+
+    def filter_coach(self, queryset, name, value):
+        return queryset.filter(facets__has_coach_content=True)
+
+    def filter_assessments(self, queryset, name, value):
+        return queryset.filter(facets__has_exercises=True)
+
+    def filter_subtitles(self, queryset, name, value):
+        return queryset.filter(facets__has_subtitles=True)
+
+
 class ChannelFilter(BaseChannelFilter):
     edit = BooleanFilter(method="filter_edit")
     view = BooleanFilter(method="filter_view")
@@ -379,7 +413,7 @@ class ChannelViewSet(ValuesViewset):
     permission_classes = [IsAuthenticated]
     serializer_class = ChannelSerializer
     filter_backends = (DjangoFilterBackend,)
-    pagination_class = CatalogListPagination
+    pagination_class = ChannelListPagination
     filter_class = ChannelFilter
 
     field_map = channel_field_map
@@ -497,7 +531,7 @@ class CatalogViewSet(ReadOnlyValuesViewset):
     serializer_class = ChannelSerializer
     filter_backends = (DjangoFilterBackend,)
     pagination_class = CatalogListPagination
-    filter_class = BaseChannelFilter
+    filter_class = CatalogFilter
 
     permission_classes = [AllowAny]
 
@@ -507,7 +541,7 @@ class CatalogViewSet(ReadOnlyValuesViewset):
     def get_queryset(self):
         queryset = Channel.objects.filter(deleted=False, public=True)
 
-        return queryset.order_by("name")
+        return queryset.order_by("name", "id")
 
     def annotate_queryset(self, queryset):
         queryset = queryset.annotate(primary_token=primary_token_subquery)
@@ -550,7 +584,7 @@ class AdminChannelFilter(BaseChannelFilter):
 
 
 class AdminChannelViewSet(ChannelViewSet):
-    pagination_class = CatalogListPagination
+    pagination_class = ChannelListPagination
     permission_classes = [IsAdminUser]
     filter_class = AdminChannelFilter
     filter_backends = (
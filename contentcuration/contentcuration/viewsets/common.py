@@ -1,12 +1,17 @@
 import re
 
+from django.conf import settings
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
 from django.core.paginator import Paginator
 from django.db.models import CharField
+from django.db.models import F
 from django.db.models import IntegerField
 from django.db.models import Manager
+from django.db.models import OuterRef
 from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.forms.fields import UUIDField
 from django.utils.datastructures import MultiValueDict
@@ -23,6 +28,8 @@ from rest_framework.serializers import RegexField
 from rest_framework.serializers import ValidationError
 from rest_framework.utils import html
 
+from contentcuration.db.models.expressions import BooleanComparison
+from contentcuration.models import ContentNode
 from contentcuration.models import DEFAULT_CONTENT_DEFAULTS
 from contentcuration.models import License
 
@@ -93,6 +100,38 @@ class SQArrayAgg(AggregateSubquery):
     output_field = ArrayField(CharField())
 
 
+def descendant_count():
+    """
+    Expression for the number of descendants of each ContentNode in a queryset.
+    With sparse mptt numbering topics have free lft and rght values in them,
+    so the descendants are counted rather than derived from lft and rght.
+    """
+    if not settings.MPTT_SPARSE_GAP:
+        return (F("rght") - F("lft") - 1) / 2
+    descendants = ContentNode.objects.filter(
+        tree_id=OuterRef("tree_id"),
+        lft__gt=OuterRef("lft"),
+        rght__lt=OuterRef("rght"),
+    )
+    return SQCount(descendants, field="id")
+
+
+def aggregate_count(field):
+    """
+    Expression for a count over the descendants of each ContentNode in a queryset,
+    read from its ContentNodeAggregate with a join
+    """
+    return Coalesce(F("aggregate__{}".format(field)), Value(0))
+
+
+def aggregate_exists(field):
+    """
+    Expression for whether a count over the descendants of each ContentNode in a
+    queryset, read from its ContentNodeAggregate, is more than zero
+    """
+    return BooleanComparison(aggregate_count(field), ">", Value(0))
+
+
 dot_path_regex = re.compile(r"^([^.]+)\.(.+)$")
 
 
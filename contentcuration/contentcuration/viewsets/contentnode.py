@@ -3,7 +3,6 @@ from functools import reduce
 
 from django.conf import settings
 from django.db import IntegrityError
-from django.db.models import Exists
 from django.db.models import F
 from django.db.models import OuterRef
 from django.db.models import Q
@@ -12,9 +11,7 @@ from django.http import Http404
 from django_filters.rest_framework import CharFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django_filters.rest_framework import UUIDFilter
-from le_utils.constants import content_kinds
 from le_utils.constants import exercises
-from le_utils.constants import roles
 from rest_framework.decorators import detail_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -23,6 +20,7 @@ from rest_framework.serializers import DictField
 from rest_framework.serializers import IntegerField
 from rest_framework.serializers import ValidationError
 from rest_framework.viewsets import ViewSet
+from search import search_index
 
 from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
@@ -31,18 +29,23 @@ from contentcuration.models import ContentTag
 from contentcuration.models import File
 from contentcuration.models import generate_storage_url
 from contentcuration.models import PrerequisiteContentRelationship
+from contentcuration.node_metadata import aggregates
 from contentcuration.tasks import create_async_task
 from contentcuration.viewsets.base import BulkListSerializer
 from contentcuration.viewsets.base import BulkModelSerializer
 from contentcuration.viewsets.base import BulkUpdateMixin
 from contentcuration.viewsets.base import RequiredFilterSet
 from contentcuration.viewsets.base import ValuesViewset
+from contentcuration.viewsets.common import aggregate_count
+from contentcuration.viewsets.common import aggregate_exists
+from contentcuration.viewsets.common import descendant_count
 from contentcuration.viewsets.common import DotPathValueMixin
 from contentcuration.viewsets.common import JSONFieldDictSerializer
 from contentcuration.viewsets.common import NotNullMapArrayAgg
 from contentcuration.viewsets.common import SQCount
 from contentcuration.viewsets.common import UserFilteredPrimaryKeyRelatedField
 from contentcuration.viewsets.common import UUIDInFilter
+from contentcuration.viewsets.common import uuidregex
 from contentcuration.viewsets.sync.constants import CONTENTNODE
 from contentcuration.viewsets.sync.constants import CREATED
 from contentcuration.viewsets.sync.constants import DELETED
@@ -51,10 +54,11 @@ from contentcuration.viewsets.sync.utils import generate_delete_event
 from contentcuration.viewsets.sync.utils import generate_update_event
 
 
-channel_query = Channel.objects.filter(main_tree__tree_id=OuterRef("tree_id"))
+_valid_positions = {"first-child", "last-child", "left", "right"}
 
 
-_valid_positions = {"first-child", "last-child", "left", "right"}
+def is_node_id(value):
+    return isinstance(value, str) and uuidregex.match(value) is not None
 
 
 class ContentNodeFilter(RequiredFilterSet):
@@ -148,6 +152,7 @@ def set_tags(tags_by_id):
         ContentNode.tags.through.objects.filter(
             reduce(lambda x, y: x | y, tags_relations_to_delete)
         ).delete()
+    search_index.update_search_vectors(node_ids=tags_by_id.keys())
 
 
 class ContentNodeListSerializer(BulkListSerializer):
@@ -442,6 +447,7 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
     permission_classes = [IsAuthenticated]
     filter_backends = (DjangoFilterBackend,)
     filter_class = ContentNodeFilter
+    cursor_ordering = ("tree_id", "lft")
     values = (
         "id",
         "content_id",
@@ -496,9 +502,7 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
     }
 
     def _annotate_channel_id(self, queryset):
-        return queryset.annotate(
-            channel_id=Subquery(channel_query.values_list("id", flat=True)[:1])
-        )
+        return ContentNode._annotate_channel_id(queryset)
 
     def get_queryset(self):
         queryset = super(ContentNodeViewSet, self).get_queryset()
@@ -508,6 +512,13 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
         queryset = super(ContentNodeViewSet, self).get_edit_queryset()
         return self._annotate_channel_id(queryset)
 
+    def perform_bulk_update(self, serializer):
+        # Updates are made with bulk_update, so bypass the aggregate and search vector updates in save
+        node_ids = list(serializer.instance.values_list("id", flat=True))
+        with aggregates.track_changes(node_ids):
+            super(ContentNodeViewSet, self).perform_bulk_update(serializer)
+        search_index.update_search_vectors(node_ids=node_ids)
+
     @detail_route(methods=["get"])
     def requisites(self, request, pk=None):
         if not pk:
@@ -540,32 +551,7 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
         )
 
     def annotate_queryset(self, queryset):
-        queryset = queryset.annotate(total_count=(F("rght") - F("lft") - 1) / 2)
-
-        descendant_resources = (
-            ContentNode.objects.filter(
-                tree_id=OuterRef("tree_id"),
-                lft__gt=OuterRef("lft"),
-                rght__lt=OuterRef("rght"),
-            )
-            .exclude(kind_id=content_kinds.TOPIC)
-            .values("id", "role_visibility", "changed")
-            .order_by()
-        )
-
-        all_descendants = (
-            ContentNode.objects.filter(
-                tree_id=OuterRef("tree_id"),
-                lft__gt=OuterRef("lft"),
-                rght__lt=OuterRef("rght"),
-            )
-            .values("id", "complete", "published")
-            .order_by()
-        )
-
-        # Get count of descendant nodes with errors
-        descendant_errors = all_descendants.filter(complete=False)
-        changed_descendants = descendant_resources.filter(changed=True)
+        queryset = queryset.annotate(total_count=descendant_count())
 
         thumbnails = File.objects.filter(
             contentnode=OuterRef("id"), preset__thumbnail=True
@@ -589,18 +575,13 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
         )
 
         queryset = queryset.annotate(
-            resource_count=SQCount(descendant_resources, field="id"),
-            coach_count=SQCount(
-                descendant_resources.filter(role_visibility=roles.COACH), field="id",
-            ),
+            # Counts over the descendants are read from their aggregates
+            resource_count=aggregate_count("resource_count"),
+            coach_count=aggregate_count("coach_count"),
             assessment_item_count=SQCount(assessment_items, field="assessment_id"),
-            error_count=SQCount(descendant_errors, field="id"),
-            has_updated_descendants=Exists(
-                changed_descendants.filter(published=True).values("id")
-            ),
-            has_new_descendants=Exists(
-                changed_descendants.filter(published=False).values("id")
-            ),
+            error_count=aggregate_count("error_count"),
+            has_updated_descendants=aggregate_exists("updated_resource_count"),
+            has_new_descendants=aggregate_exists("new_resource_count"),
             thumbnail_checksum=Subquery(thumbnails.values("checksum")[:1]),
             thumbnail_extension=Subquery(
                 thumbnails.values("file_format__extension")[:1]
@@ -608,9 +589,7 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
             original_channel_name=Subquery(original_channel.values("name")[:1]),
             original_parent_id=Subquery(original_node.values("parent_id")[:1]),
             original_node_id=Subquery(original_node.values("pk")[:1]),
-            has_children=Exists(
-                ContentNode.objects.filter(parent=OuterRef("id")).values("pk")
-            ),
+            has_children=aggregate_exists("child_count"),
             root_id=Subquery(root_id),
         )
         queryset = queryset.annotate(content_tags=NotNullMapArrayAgg("tags__tag_name"))
@@ -637,42 +616,52 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
 
     def move_from_changes(self, changes):
         errors = []
-        changes_to_return = []
+        # Look up all the nodes to move and their targets, checking permissions, in one query
+        ids = set()
+        for move in changes:
+            ids.update(pk for pk in (move["key"], move.get("target")) if is_node_id(pk))
+        nodes = {node.id: node for node in self.get_edit_queryset().filter(pk__in=ids)}
+
+        moves = []
+        valid_changes = []
         for move in changes:
             # Move change will have key, must also have target property
             # optionally can include the desired position.
-            move_error, move_change = self.move(
-                move["key"], target=move.get("target"), position=move.get("position")
-            )
-            if move_error:
-                move.update({"errors": [move_error]})
+            try:
+                node, target, position = self.validate_move(
+                    nodes, move["key"], move.get("target"), move.get("position")
+                )
+            except ValidationError as e:
+                move.update({"errors": [str(e)]})
                 errors.append(move)
-            if move_change:
-                changes_to_return.append(move_change)
-        return errors, changes_to_return
+            else:
+                moves.append((node, target, position))
+                valid_changes.append(move)
 
-    def move(self, pk, target=None, position=None):
-        try:
-            contentnode = self.get_edit_queryset().get(pk=pk)
-        except ContentNode.DoesNotExist:
-            error = ValidationError("Specified node does not exist")
-            return str(error), None
+        move_errors = ContentNode.objects.bulk_move(moves) if moves else []
+        for move, move_error in zip(valid_changes, move_errors):
+            if move_error:
+                move.update({"errors": [str(ValidationError(move_error))]})
+                errors.append(move)
+        return errors, []
 
-        try:
-            target, position = self.validate_targeting_args(target, position)
-            try:
-                contentnode.move_to(target, position)
-            except ValueError:
-                raise ValidationError(
-                    "Invalid position argument specified: {}".format(position)
+    def validate_move(self, nodes, pk, target, position):
+        if pk not in nodes:
+            raise ValidationError("Specified node does not exist")
+        position = position or "last-child"
+        if target is None:
+            raise ValidationError("A target must be specified")
+        if not is_node_id(target):
+            raise ValidationError("Invalid target specified: {}".format(target))
+        if target not in nodes:
+            raise ValidationError("Target: {} does not exist".format(target))
+        if position not in _valid_positions:
+            raise ValidationError(
+                "Invalid position specified, must be one of {}".format(
+                    ", ".join(_valid_positions)
                 )
-
-            return (
-                None,
-                None,
             )
-        except ValidationError as e:
-            return str(e), None
+        return nodes[pk], nodes[target], position
 
     def copy_from_changes(self, changes):
         errors = []
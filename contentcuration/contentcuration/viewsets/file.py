@@ -12,6 +12,7 @@ from contentcuration.models import ContentNode
 from contentcuration.models import File
 from contentcuration.models import generate_object_storage_name
 from contentcuration.models import generate_storage_url
+from contentcuration.node_metadata import aggregates
 from contentcuration.utils.storage_common import get_presigned_upload_url
 from contentcuration.viewsets.base import BulkDeleteMixin
 from contentcuration.viewsets.base import BulkListSerializer
@@ -94,6 +95,11 @@ class FileViewSet(BulkDeleteMixin, BulkUpdateMixin, ReadOnlyValuesViewset):
         "assessment_item": "assessment_item_id",
     }
 
+    def perform_bulk_update(self, serializer):
+        # Updates are made with bulk_update, so bypass the aggregate updates in signals
+        with aggregates.track_file_changes(serializer.instance.values_list("id", flat=True)):
+            super(FileViewSet, self).perform_bulk_update(serializer)
+
     @list_route(methods=["post"])
     def upload_url(self, request):
         try:
@@ -0,0 +1,239 @@
+"""
+Pagination for large lists, such as the catalog and search results.
+
+Counting every result of a list for each page is as slow as the query itself, so counts
+are cached under a key made from the filters of the list, and lists that the query planner
+estimates to have more than PAGINATION_COUNT_ESTIMATE_THRESHOLD results report that estimate
+while their exact count is computed by a Celery task.
+
+Deep pages numbered with OFFSET still read every row before them, so lists can also be
+paged with a cursor holding the position of the last result of the previous page.
+"""
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.core.paginator import Page
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param
+from rest_framework.utils.urls import replace_query_param
+
+# Number of seconds the counts of lists are cached for
+COUNT_CACHE_TIMEOUT = 300
+
+
+def get_count_cache_key(prefix, query_params, exclude=(), user_id=None):
+    """
+    Return the cache key for the count of a list, from the query parameters that filter it,
+    so that the same filters share a count whatever order they, and their comma separated
+    values, are given in
+    """
+    params = sorted(
+        (key, sorted(",".join(sorted(part.strip() for part in value.split(","))) for value in values))
+        for key, values in query_params.lists()
+        if key not in exclude
+    )
+    digest = hashlib.md5(json.dumps([user_id, params]).encode("utf8")).hexdigest()
+    return "query-count:{}:{}".format(prefix, digest)
+
+
+def estimate_count(queryset):
+    """
+    Return the query planner's estimate of the number of rows of a queryset
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def get_count(queryset, cache_key):
+    """
+    Return the number of rows of a queryset, and whether it is an estimate.
+    Exact counts are cached under `cache_key`.
+    """
+    count = cache.get(cache_key)
+    if count is not None:
+        return count, False
+    queryset = queryset.order_by().values("id")
+    threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+    if threshold:
+        estimate = estimate_count(queryset)
+        if estimate > threshold:
+            # Only count the same list once at a time
+            if cache.add(cache_key + ":counting", True, COUNT_CACHE_TIMEOUT):
+                from contentcuration.tasks import count_query_task
+
+                sql, params = queryset.query.sql_with_params()
+                count_query_task.delay(sql, params, cache_key)
+            return estimate, True
+    count = queryset.count()
+    cache.set(cache_key, count, COUNT_CACHE_TIMEOUT)
+    return count, False
+
+
+def cache_query_count(sql, params, cache_key):
+    """
+    Count the rows of a query, given as its SQL and parameters, and cache the count under `cache_key`
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM ({}) AS counted".format(sql), params)
+            cache.set(cache_key, cursor.fetchone()[0], COUNT_CACHE_TIMEOUT)
+    finally:
+        cache.delete(cache_key + ":counting")
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Return the position encoded in a cursor, checking it has a value for each field of `ordering`
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8"))
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid cursor")
+    if not isinstance(position, list) or len(position) != len(ordering):
+        raise ValidationError("Invalid cursor")
+    return position
+
+
+def get_position(item, ordering):
+    """
+    Return the position of an item, a dict of values, in `ordering`
+    """
+    return [item[field.lstrip("-")] for field in ordering]
+
+
+def filter_after(queryset, ordering, position):
+    """
+    Filter a queryset to the rows after `position` in `ordering`, a list of fields
+    prefixed with "-" if descending, that must identify each row. Written as the expanded
+    form of a row comparison, so that the fields can be in different directions.
+    """
+    after = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "{}__{}".format(name, "lt" if field.startswith("-") else "gt")
+        condition = Q(**{lookup: position[index]})
+        for previous_field, value in zip(ordering[:index], position[:index]):
+            condition &= Q(**{previous_field.lstrip("-"): value})
+        after |= condition
+    return queryset.filter(after)
+
+
+class CachedCountPagination(PageNumberPagination):
+    """
+    Page number pagination with cached, or estimated, counts. Lists can also be paged by
+    passing `cursor`, starting with an empty cursor, to views that set a `keyset_ordering`
+    identifying each of their results. Cursors only page forward.
+    """
+
+    cursor_query_param = "cursor"
+
+    # Fields ordering the results of the view uniquely, to page them by cursor
+    keyset_ordering = None
+
+    # Whether the results of the view depend on the user, so counts can't be shared
+    count_per_user = True
+
+    def get_count_cache_key(self, request, view):
+        return get_count_cache_key(
+            type(view).__name__,
+            request.query_params,
+            exclude=(self.page_query_param, self.page_size_query_param, self.cursor_query_param),
+            user_id=request.user.id if self.count_per_user and request.user.is_authenticated() else None,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        self.count, self.count_is_estimate = get_count(
+            queryset, self.get_count_cache_key(request, view)
+        )
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is not None and self.keyset_ordering:
+            return self.paginate_queryset_by_cursor(queryset, cursor, page_size)
+
+        paginator = Paginator(queryset, page_size)
+        paginator.count = self.count
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            if self.count_is_estimate:
+                # Pages beyond the estimate may still have results, so don't check the number against it
+                number = int(page_number)
+                if number < 1:
+                    raise InvalidPage("That page number is less than 1")
+                bottom = (number - 1) * page_size
+                self.page = Page(list(queryset[bottom:bottom + page_size]), number, paginator)
+            else:
+                self.page = paginator.page(page_number)
+        except (InvalidPage, ValueError) as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=exc)
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+
+        return list(self.page)
+
+    def paginate_queryset_by_cursor(self, queryset, cursor, page_size):
+        self.page = None
+        queryset = queryset.order_by(*self.keyset_ordering)
+        if cursor:
+            queryset = filter_after(queryset, self.keyset_ordering, decode_cursor(cursor, self.keyset_ordering))
+        results = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_cursor = encode_cursor(get_position(results[-1], self.keyset_ordering))
+        return results
+
+    def get_next_link(self):
+        if self.page is not None:
+            return super(CachedCountPagination, self).get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        if self.page is not None:
+            return super(CachedCountPagination, self).get_previous_link()
+        return None
+
+    def get_paginated_response(self, data):
+        page_size = self.get_page_size(self.request)
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "page_number": self.page.number if self.page is not None else None,
+                "count": self.count,
+                "count_is_estimate": self.count_is_estimate,
+                "total_pages": max(1, -(-self.count // page_size)),
+                "results": data,
+            }
+        )
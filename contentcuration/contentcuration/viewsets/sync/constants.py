@@ -40,8 +40,7 @@ ALL_TABLES = set(
 )
 
 
-# Using this as a workaround for not having a proper event source
-# this key will hold events for propagation in redis
+# Key of the redis list holding the ids of events to propagate to a user
 USER_CHANGES_PREFIX = "user_changes_{user_id}"
 
 
@@ -6,9 +6,13 @@ bulk creates, updates, and deletes.
 import logging
 import time
 from collections import OrderedDict
+from copy import deepcopy
 from itertools import groupby
+from multiprocessing.dummy import Pool
+from queue import Queue
 
 from django.conf import settings
+from django.db import connections
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view
@@ -48,6 +52,7 @@ from contentcuration.viewsets.sync.constants import UPDATED
 from contentcuration.viewsets.sync.constants import USER
 from contentcuration.viewsets.sync.constants import VIEWER_M2M
 from contentcuration.viewsets.sync.utils import get_and_clear_user_events
+from contentcuration.viewsets.sync.utils import wait_for_user_events
 from contentcuration.viewsets.task import TaskViewSet
 from contentcuration.viewsets.user import ChannelUserViewSet
 from contentcuration.viewsets.user import UserViewSet
@@ -118,6 +123,14 @@ viewset_mapping = OrderedDict(
     ]
 )
 
+# Changes to these tables can affect the permissions on, or existence of,
+# objects in any other table, so all later groups of changes wait for them
+GLOBAL_TABLES = (USER, CHANNEL)
+
+# Tables with changes to content nodes or what belongs to them, which wait for every earlier
+# group of changes to content nodes, as those can copy, move or delete whole subtrees
+CONTENTNODE_DEPENDENT_TABLES = (CONTENTNODE, CONTENTNODE_PREREQUISITE, CLIPBOARD, ASSESSMENTITEM, FILE)
+
 change_order = [
     # inserts
     COPIED,
@@ -200,6 +213,263 @@ def handle_changes(request, viewset_class, change_type, changes):
         return changes, None
 
 
+def get_change_type_value(change):
+    try:
+        return int(change["type"])
+    except ValueError:
+        return None
+
+
+def get_change_object_key(change, key_attr="key"):
+    # Keys of some tables, like assessment items, are lists, so make them hashable
+    key = change.get(key_attr)
+    return change["table"], tuple(key) if isinstance(key, list) else key
+
+
+def merge_mods(mods, new_mods):
+    """
+    merge_mods: merge the modifications of a later UPDATED change into those of an earlier one
+        Modifications are keyed by dot paths, so a later change to a whole value replaces
+        earlier changes to any paths inside it, and a later change to a path inside a value
+        set by an earlier change is set inside that value.
+        Args:
+            mods (dict): modifications of the earlier change
+            new_mods (dict): modifications of the later change
+        Returns: the merged modifications, or None if they can't be merged
+    """
+    merged = dict(mods)
+    for path, value in new_mods.items():
+        for existing_path in list(merged):
+            if existing_path.startswith(path + "."):
+                del merged[existing_path]
+            elif path.startswith(existing_path + "."):
+                if not isinstance(merged[existing_path], dict):
+                    return None
+                merged[existing_path] = deepcopy(merged[existing_path])
+                parent = merged[existing_path]
+                parts = path[len(existing_path) + 1:].split(".")
+                for part in parts[:-1]:
+                    parent = parent.setdefault(part, {})
+                    if not isinstance(parent, dict):
+                        return None
+                parent[parts[-1]] = value
+                break
+        else:
+            merged[path] = value
+    return merged
+
+
+def coalesce_changes(changes):
+    """
+    coalesce_changes: reduce a batch of changes to fewer changes with the same end result
+        UPDATED changes to the same object are merged into one, UPDATED changes to objects
+        that are DELETED later in the batch are dropped, and MOVED changes of the same object
+        are collapsed into the last one, unless another move in between is relative to it.
+        Args:
+            changes (list): changes sent by the frontend, in the order they were made
+        Returns: tuple of the coalesced changes, and a dict of the id of each change that
+            replaces several changes to a tuple of itself and the changes it replaces
+    """
+    last_deleted = {}
+    for index, change in enumerate(changes):
+        if get_change_type_value(change) == DELETED:
+            last_deleted[get_change_object_key(change)] = index
+
+    coalesced = list(changes)
+    replaced = {}
+    updates = {}
+    moves = {}
+    for index, change in enumerate(changes):
+        change_type = get_change_type_value(change)
+        object_key = get_change_object_key(change)
+        if change_type == UPDATED:
+            if last_deleted.get(object_key, -1) > index:
+                coalesced[index] = None
+                continue
+            previous = updates.get(object_key)
+            if previous is not None:
+                mods = merge_mods(coalesced[previous].get("mods") or {}, change.get("mods") or {})
+                if mods is not None:
+                    coalesced[index] = dict(change, mods=mods)
+                    replaced[index] = replaced.pop(previous, [coalesced[previous]]) + [change]
+                    coalesced[previous] = None
+            updates[object_key] = index
+        elif change_type == MOVED:
+            # A move relative to the target depends on where the target is at that point,
+            # so the target's earlier move can't be collapsed into a later one
+            moves.pop(get_change_object_key(change, "target"), None)
+            previous = moves.get(object_key)
+            if previous is not None:
+                replaced[index] = replaced.pop(previous, [coalesced[previous]]) + [change]
+                coalesced[previous] = None
+            moves[object_key] = index
+
+    replaced = {
+        id(coalesced[index]): (coalesced[index], originals)
+        for index, originals in replaced.items()
+    }
+    return [change for change in coalesced if change is not None], replaced
+
+
+def expand_coalesced_errors(errors, replaced):
+    """
+    expand_coalesced_errors: report errors on changes that replaced several changes on each of those changes
+        Args:
+            errors (list): error objects returned by a viewset
+            replaced (dict): replaced changes as returned by coalesce_changes
+        Returns: list of error objects
+    """
+    if not replaced:
+        return errors
+    expanded = []
+    for error in errors:
+        match = replaced.get(id(error))
+        if match is None and "rev" in error:
+            match = next(
+                (m for m in replaced.values() if m[0].get("rev") == error["rev"]), None
+            )
+        if match is None:
+            expanded.append(error)
+        else:
+            expanded.extend(
+                dict(original, errors=error.get("errors", error.get("error")))
+                for original in match[1]
+            )
+    return expanded
+
+
+def get_change_groups(data):
+    """
+    get_change_groups: group changes by table and change type, in the order they are applied
+        Args:
+            data (list): changes sent by the frontend
+        Returns: list of (table_name, change_type, changes) tuples
+    """
+    groups = []
+    data = sorted(data, key=get_table_sort_order)
+    for table_name, group in groupby(data, get_table):
+        if table_name in viewset_mapping:
+            group = sorted(group, key=get_change_order)
+            for change_type, changes in groupby(group, get_change_type):
+                # Coerce changes iterator to list so it can be read multiple times
+                groups.append((table_name, change_type, list(changes)))
+    return groups
+
+
+def get_change_keys(change):
+    """
+    get_change_keys: collect the ids a change refers to, from its key, source, target, object and modifications
+        Args:
+            change (dict): change sent by the frontend
+        Returns: set of string values referenced by the change
+    """
+    keys = set()
+    values = [change.get("key"), change.get("from_key"), change.get("target")]
+    values.extend((change.get("obj") or {}).values())
+    values.extend((change.get("mods") or {}).values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        elif isinstance(value, dict):
+            values.extend(value.keys())
+            values.extend(value.values())
+        elif isinstance(value, str) and value:
+            keys.add(value)
+    return keys
+
+
+def get_group_dependencies(groups):
+    """
+    get_group_dependencies: find the earlier groups of changes that each group has to wait for
+        A group depends on every earlier group on the same table or on a global table,
+        and on every earlier group that refers to any of the same keys. Groups on tables
+        in CONTENTNODE_DEPENDENT_TABLES also depend on every earlier group of content node
+        changes, whatever keys they refer to. Groups are in viewset_mapping order, so
+        dependencies always point to earlier groups.
+        Args:
+            groups (list): (table_name, change_type, changes) tuples from get_change_groups
+        Returns: list of sets of group indices, one per group
+    """
+    group_keys = [
+        set().union(*(get_change_keys(change) for change in changes))
+        for _, _, changes in groups
+    ]
+    return [
+        set(
+            j
+            for j in range(i)
+            if groups[j][0] == table_name
+            or groups[j][0] in GLOBAL_TABLES
+            or (groups[j][0] == CONTENTNODE and table_name in CONTENTNODE_DEPENDENT_TABLES)
+            or group_keys[i] & group_keys[j]
+        )
+        for i, (table_name, _, _) in enumerate(groups)
+    ]
+
+
+def handle_change_group(request, index, table_name, change_type, changes):
+    try:
+        return index, handle_changes(request, viewset_mapping[table_name], change_type, changes), None
+    except Exception as e:
+        return index, None, e
+    finally:
+        # Workers each have their own database connections, so close them once done
+        connections.close_all()
+
+
+def process_change_groups(request, groups):
+    """
+    process_change_groups: apply groups of changes, concurrently where they don't depend on each other
+        Independent groups are run on up to SYNC_CONCURRENCY workers, while dependent groups
+        are only started once the groups they depend on have finished. Once SYNC_TIME_BUDGET
+        has elapsed no more groups are started, and the remaining groups are deferred.
+        Args:
+            request (Request): the sync request
+            groups (list): (table_name, change_type, changes) tuples from get_change_groups
+        Returns: list with the (errors, changes) result of each group, or None for deferred groups
+    """
+    deadline = time.time() + settings.SYNC_TIME_BUDGET if settings.SYNC_TIME_BUDGET else None
+    results = [None] * len(groups)
+
+    if settings.SYNC_CONCURRENCY <= 1 or len(groups) <= 1:
+        for index, (table_name, change_type, changes) in enumerate(groups):
+            if deadline is not None and time.time() > deadline:
+                break
+            results[index] = handle_changes(request, viewset_mapping[table_name], change_type, changes)
+        return results
+
+    dependencies = get_group_dependencies(groups)
+    pending = list(range(len(groups)))
+    finished = set()
+    running = 0
+    completed = Queue()
+    pool = Pool(min(settings.SYNC_CONCURRENCY, len(groups)))
+    try:
+        while pending or running:
+            if deadline is not None and time.time() > deadline:
+                pending = []
+            # Start groups in order, so that the order is deterministic between runs
+            for index in [i for i in pending if dependencies[i] <= finished]:
+                pending.remove(index)
+                running += 1
+                pool.apply_async(
+                    handle_change_group, (request, index) + groups[index], callback=completed.put
+                )
+            if not running:
+                break
+            index, result, error = completed.get()
+            running -= 1
+            if error is not None:
+                raise error
+            results[index] = result
+            finished.add(index)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
 @authentication_classes((TokenAuthentication, SessionAuthentication))
 @permission_classes((IsAuthenticated,))
 @api_view(["POST"])
@@ -211,35 +481,57 @@ def sync(request):
     # this allows internal validation to take place and fields to be added
     # if needed by the server.
     changes_to_return = []
-    data = sorted(request.data, key=get_table_sort_order)
-    for table_name, group in groupby(data, get_table):
-        if table_name in viewset_mapping:
-            viewset_class = viewset_mapping[table_name]
-            group = sorted(group, key=get_change_order)
-            for change_type, changes in groupby(group, get_change_type):
-                # Coerce changes iterator to list so it can be read multiple times
-                es, cs = handle_changes(
-                    request, viewset_class, change_type, list(changes)
-                )
-                if es:
-                    errors.extend(es)
-                if cs:
-                    changes_to_return.extend(cs)
+    # Collect changes that were not applied within the time budget,
+    # so that the client sends them again on its next sync
+    deferred = []
+    data = request.data
+    # Merge and drop redundant changes, keeping track of which changes
+    # were replaced, so that any errors are reported on the changes sent
+    coalesced, replaced = coalesce_changes(data)
+    groups = get_change_groups(coalesced)
+    for (_, _, changes), result in zip(groups, process_change_groups(request, groups)):
+        if result is None:
+            for change in changes:
+                deferred.extend(replaced[id(change)][1] if id(change) in replaced else [change])
+            continue
+        es, cs = result
+        if es:
+            errors.extend(expand_coalesced_errors(es, replaced))
+        if cs:
+            changes_to_return.extend(cs)
 
     # Add any changes that have been logged from elsewhere in our hacky redis
     # cache mechanism
     changes_to_return.extend(get_and_clear_user_events(request.user.id))
+    response = {}
+    if deferred:
+        response["deferred"] = deferred
     if not errors:
         if changes_to_return:
-            return Response({"changes": changes_to_return})
-        else:
-            return Response({})
+            response["changes"] = changes_to_return
+        return Response(response)
     elif len(errors) < len(data) or len(changes_to_return):
         # If there are some errors, but not all, or all errors and some changes return a mixed response
-        return Response(
-            {"changes": changes_to_return, "errors": errors},
-            status=HTTP_207_MULTI_STATUS,
-        )
+        response.update({"changes": changes_to_return, "errors": errors})
+        return Response(response, status=HTTP_207_MULTI_STATUS)
     else:
         # If the errors are total, and there are no changes reject the response outright!
         return Response({"errors": errors}, status=HTTP_400_BAD_REQUEST)
+
+
+@authentication_classes((TokenAuthentication, SessionAuthentication))
+@permission_classes((IsAuthenticated,))
+@api_view(["GET"])
+def sync_events(request):
+    """
+    Long poll for changes to return to the user, such as the results of tasks
+    or changes made by other editors, responding as soon as any are published
+    or with no changes once the timeout passes. Unless SYNC_POLL_ENABLED is set,
+    responds at once with the changes already published.
+    """
+    try:
+        timeout = float(request.query_params.get("timeout", settings.SYNC_POLL_TIMEOUT))
+    except ValueError:
+        return Response({"error": "Invalid timeout"}, status=HTTP_400_BAD_REQUEST)
+    timeout = max(0, min(timeout, settings.SYNC_POLL_TIMEOUT)) if settings.SYNC_POLL_ENABLED else 0
+    return Response({"changes": wait_for_user_events(request.user.id, timeout)})
@@ -0,0 +1,187 @@
+"""
+Queues of change events to be returned to users on their next sync.
+
+Each event is stored once, with a TTL, and the queue of every user it is
+for only holds its id, so that an event for every editor of a channel is
+not copied once per editor. Appending to a queue trims it to its maximum
+length and refreshes its TTL, and draining a queue fetches and clears it
+in a single round trip.
+"""
+import json
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from contentcuration.viewsets.sync.constants import USER_CHANGES_PREFIX
+
+
+EVENT_KEY_PREFIX = "sync_event_"
+# Key of the list used to wake up requests waiting on a user's queue
+NOTIFY_KEY_PREFIX = "user_changes_notify_{user_id}"
+
+# Atomically read and clear a user's queue, and look up the events it refers to
+DRAIN_SCRIPT = """
+local event_ids = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+if #event_ids == 0 then
+    return {}
+end
+local event_keys = {}
+for i, event_id in ipairs(event_ids) do
+    event_keys[i] = ARGV[1] .. event_id
+end
+return redis.call('MGET', unpack(event_keys))
+"""
+
+
+class EventBus(object):
+    def __init__(self, max_length=None, ttl=None):
+        self.max_length = max_length or settings.SYNC_EVENT_QUEUE_LENGTH
+        self.ttl = ttl or settings.SYNC_EVENT_TTL
+
+    def publish(self, user_ids, event):
+        """
+        Add an event to the queue of every user in user_ids
+        """
+        raise NotImplementedError("Event bus needs to implement this method")
+
+    def drain(self, user_id):
+        """
+        Return the events queued for a user, in the order they were published, and clear the queue
+        """
+        raise NotImplementedError("Event bus needs to implement this method")
+
+    def wait_for_notification(self, user_id, timeout):
+        """
+        Block until an event is published for a user, or timeout seconds pass.
+        Returns False if it timed out.
+        """
+        raise NotImplementedError("Event bus needs to implement this method")
+
+    def wait(self, user_id, timeout):
+        """
+        Drain the events queued for a user, waiting up to timeout seconds for one
+        to be published if there are none yet
+        """
+        deadline = time.time() + timeout
+        events = self.drain(user_id)
+        while not events:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.wait_for_notification(user_id, remaining):
+                break
+            events = self.drain(user_id)
+        return events
+
+
+class RedisEventBus(EventBus):
+    def __init__(self, *args, **kwargs):
+        super(RedisEventBus, self).__init__(*args, **kwargs)
+        self._connection = None
+        self._drain_script = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = get_redis_connection("default")
+        return self._connection
+
+    @property
+    def drain_script(self):
+        if self._drain_script is None:
+            self._drain_script = self.connection.register_script(DRAIN_SCRIPT)
+        return self._drain_script
+
+    def publish(self, user_ids, event):
+        event_id = uuid.uuid4().hex
+        pipeline = self.connection.pipeline()
+        pipeline.setex(EVENT_KEY_PREFIX + event_id, self.ttl, json.dumps(event))
+        for user_id in user_ids:
+            key = USER_CHANGES_PREFIX.format(user_id=user_id)
+            pipeline.rpush(key, event_id)
+            pipeline.ltrim(key, -self.max_length, -1)
+            pipeline.expire(key, self.ttl)
+            # Keep a single token in the notification list to wake up any waiting request
+            notify_key = NOTIFY_KEY_PREFIX.format(user_id=user_id)
+            pipeline.rpush(notify_key, 1)
+            pipeline.ltrim(notify_key, -1, -1)
+            pipeline.expire(notify_key, settings.SYNC_POLL_TIMEOUT)
+        pipeline.execute()
+
+    def drain(self, user_id):
+        events = self.drain_script(
+            keys=[USER_CHANGES_PREFIX.format(user_id=user_id)], args=[EVENT_KEY_PREFIX]
+        )
+        # Events that have expired are returned as None
+        return [json.loads(event) for event in events if event is not None]
+
+    def wait_for_notification(self, user_id, timeout):
+        # BLPOP only takes a whole number of seconds
+        notify_key = NOTIFY_KEY_PREFIX.format(user_id=user_id)
+        return self.connection.blpop(notify_key, int(math.ceil(timeout))) is not None
+
+
+class InMemoryEventBus(EventBus):
+    """
+    Stand-in for the Redis event bus that keeps events in process memory,
+    for use in tests and in development without Redis.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InMemoryEventBus, self).__init__(*args, **kwargs)
+        self._lock = threading.Condition()
+        self._events = {}
+        self._queues = {}
+        self._notified = set()
+
+    def publish(self, user_ids, event):
+        event_id = uuid.uuid4().hex
+        expiry = time.time() + self.ttl
+        with self._lock:
+            # Serialize the event as Redis would, so that later changes to it are not seen
+            self._events[event_id] = (expiry, json.dumps(event))
+            for user_id in user_ids:
+                _, event_ids = self._queues.get(user_id, (None, []))
+                self._queues[user_id] = (expiry, (event_ids + [event_id])[-self.max_length:])
+                self._notified.add(user_id)
+            self._lock.notify_all()
+
+    def drain(self, user_id):
+        now = time.time()
+        with self._lock:
+            expiry, event_ids = self._queues.pop(user_id, (now, []))
+            if expiry < now:
+                return []
+            events = [self._events.get(event_id) for event_id in event_ids]
+            # Drop any events that have expired, along with the expired events of other users
+            self._events = {
+                event_id: event for event_id, event in self._events.items() if event[0] >= now
+            }
+        return [json.loads(event) for expiry, event in filter(None, events) if expiry >= now]
+
+    def wait_for_notification(self, user_id, timeout):
+        with self._lock:
+            notified = user_id in self._notified or self._lock.wait(timeout)
+            self._notified.discard(user_id)
+        return notified
+
+
+EVENT_BUSES = {
+    "redis": RedisEventBus,
+    "memory": InMemoryEventBus,
+}
+
+_event_buses = {}
+
+
+def get_event_bus():
+    """
+    Return the event bus configured by SYNC_EVENT_BUS, creating it on first use
+    """
+    name = settings.SYNC_EVENT_BUS
+    if name not in _event_buses:
+        _event_buses[name] = EVENT_BUSES[name]()
+    return _event_buses[name]
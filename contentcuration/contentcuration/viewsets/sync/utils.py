@@ -1,12 +1,10 @@
-from django.core.cache import cache
-
 from contentcuration.viewsets.sync.constants import ALL_TABLES
 from contentcuration.viewsets.sync.constants import COPIED
 from contentcuration.viewsets.sync.constants import CREATED
 from contentcuration.viewsets.sync.constants import DELETED
 from contentcuration.viewsets.sync.constants import MOVED
 from contentcuration.viewsets.sync.constants import UPDATED
-from contentcuration.viewsets.sync.constants import USER_CHANGES_PREFIX
+from contentcuration.viewsets.sync.events import get_event_bus
 
 
 def validate_table(table):
@@ -71,14 +69,16 @@ def generate_copy_event(
 
 
 def add_event_for_user(user_id, event):
-    cache_key = USER_CHANGES_PREFIX.format(user_id=user_id)
-    user_events = cache.get(cache_key) or []
-    user_events.append(event)
-    cache.set(cache_key, user_events, None)
+    get_event_bus().publish([user_id], event)
+
+
+def add_event_for_users(user_ids, event):
+    get_event_bus().publish(user_ids, event)
 
 
 def get_and_clear_user_events(user_id):
-    cache_key = USER_CHANGES_PREFIX.format(user_id=user_id)
-    user_events = cache.get(cache_key) or []
-    cache.delete(cache_key)
-    return user_events
+    return get_event_bus().drain(user_id)
+
+
+def wait_for_user_events(user_id, timeout):
+    return get_event_bus().wait(user_id, timeout)
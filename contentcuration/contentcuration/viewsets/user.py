@@ -26,6 +26,7 @@ from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
 from contentcuration.models import Channel
+from contentcuration.models import invalidate_user_tree_ids
 from contentcuration.models import User
 from contentcuration.tasks import cache_multiple_users_metadata_task
 from contentcuration.utils.cache import DEFERRED_FLAG
@@ -209,6 +210,8 @@ class ChannelUserViewSet(ReadOnlyValuesViewset):
                     Channel.editors.through.objects.filter(q).delete()
                 elif table == VIEWER_M2M:
                     Channel.viewers.through.objects.filter(q).delete()
+            # Bulk creates don't send signals, so the cached permissions are invalidated here
+            invalidate_user_tree_ids(d["user_id"] for d in data)
 
     def _check_permissions(self, changes):
         # Filter the passed in channels
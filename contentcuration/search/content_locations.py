@@ -0,0 +1,110 @@
+"""
+The locations of each content id in the main trees of channels, stored in ContentLocation
+so that search results can be reduced to one node per content, and list where each
+content can be found, with joins instead of subqueries over every accessible node.
+
+The locations of a tree are refreshed when its channel is published, and when it becomes
+the main tree of a channel. Content that has been added since is not in the table, and
+content whose canonical node has since been deleted or moved away is ignored in it, so
+both are combined by looking for the nodes themselves, as before the table existed.
+"""
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models import OuterRef
+
+from contentcuration.db.models.functions import Unnest
+from contentcuration.models import ContentNode
+from contentcuration.viewsets.common import SQArrayAgg
+from search.models import ContentLocation
+
+# Rebuild the locations of the content ids in trees, with the canonical node of each
+# preferring the original source of the content, then the oldest node
+REFRESH_SQL = """
+INSERT INTO {location} (content_id, tree_id, canonical_node_id, is_original, created, location_ids)
+SELECT DISTINCT ON (n.content_id, n.tree_id)
+    n.content_id,
+    n.tree_id,
+    n.id,
+    COALESCE(n.original_source_node_id = n.node_id, FALSE) AS is_original,
+    n.created,
+    locations.ids
+FROM {node} n
+JOIN (
+    SELECT content_id, tree_id, array_agg(id) AS ids
+    FROM {node}
+    WHERE tree_id IN %(tree_ids)s AND content_id IS NOT NULL
+    GROUP BY content_id, tree_id
+) locations ON locations.content_id = n.content_id AND locations.tree_id = n.tree_id
+WHERE n.tree_id IN %(tree_ids)s
+ORDER BY n.content_id, n.tree_id, is_original DESC, n.created
+"""
+
+
+def refresh_content_locations(tree_ids):
+    """
+    Rebuild the locations of the content ids in the trees in `tree_ids`
+    """
+    tree_ids = tuple(tree_ids)
+    if not tree_ids:
+        return
+    with transaction.atomic():
+        ContentLocation.objects.filter(tree_id__in=tree_ids).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                REFRESH_SQL.format(
+                    location=ContentLocation._meta.db_table,
+                    node=ContentNode._meta.db_table,
+                ),
+                {"tree_ids": tree_ids},
+            )
+
+
+def refresh_channel(channel, old_main_tree_id=None):
+    """
+    Rebuild the locations of the content ids in the main tree of a channel, and remove
+    those of its previous main tree, given by the id of its root, if it has changed
+    """
+    with transaction.atomic():
+        if old_main_tree_id:
+            ContentLocation.objects.filter(
+                tree_id__in=ContentNode.objects.filter(pk=old_main_tree_id).values("tree_id")
+            ).delete()
+        if channel.main_tree_id:
+            refresh_content_locations(
+                ContentNode.objects.filter(pk=channel.main_tree_id).values_list("tree_id", flat=True)
+            )
+
+
+def get_current_locations(tree_ids):
+    """
+    Return a queryset of the locations in the trees in `tree_ids`, a list or queryset of
+    tree ids, whose canonical node is still in its tree. Once the canonical node of a
+    content id has been deleted or moved away, its location is ignored until the tree is
+    refreshed, so the content is shown as found in the nodes themselves.
+    """
+    return ContentLocation.objects.filter(tree_id__in=tree_ids, canonical_node__tree_id=F("tree_id"))
+
+
+def get_canonical_node_ids(tree_ids):
+    """
+    Return a queryset of the ids of the canonical node of each content id in the trees
+    in `tree_ids`, a list or queryset of tree ids
+    """
+    return (
+        get_current_locations(tree_ids)
+        .order_by("content_id", "-is_original", "created")
+        .distinct("content_id")
+        .values("canonical_node_id")
+    )
+
+
+def get_location_ids(tree_ids):
+    """
+    Return an expression for the ids of the nodes in the trees in `tree_ids`
+    with the same content as each node in a queryset
+    """
+    locations = get_current_locations(tree_ids).filter(
+        content_id=OuterRef("content_id")
+    ).annotate(location_id=Unnest("location_ids"))
+    return SQArrayAgg(locations, field="location_id")
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+from django.db import transaction
+
+
+# Text search configurations that stem words, by language code, as of this migration
+LANGUAGE_CONFIGS = {
+    "da": "danish",
+    "de": "german",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "hu": "hungarian",
+    "it": "italian",
+    "nb": "norwegian",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "tr": "turkish",
+}
+
+LANGUAGE_CONFIG_SQL = "(CASE lower(split_part(replace(n.language_id, '_', '-'), '-', 1)) {} ELSE 'simple' END)::regconfig".format(
+    " ".join("WHEN '{}' THEN '{}'".format(code, config) for code, config in sorted(LANGUAGE_CONFIGS.items()))
+)
+
+# The words of a node, weighted by where they are found, for a text search configuration
+DOCUMENT_SQL = """
+setweight(to_tsvector({config}, COALESCE(n.title, '')), 'A')
+|| setweight(to_tsvector({config}, COALESCE(tags.tag_names, '')), 'B')
+|| setweight(to_tsvector({config}, COALESCE(n.author, '') || ' ' || COALESCE(n.provider, '')), 'C')
+|| setweight(to_tsvector({config}, COALESCE(n.description, '')), 'D')
+"""
+
+# Compute the search vectors of the nodes of a tree from their attributes and tags
+UPDATE_SQL = """
+INSERT INTO {search_vector} (contentnode_id, search_vector)
+SELECT
+    n.id,
+    {simple_document} || {language_document}
+FROM {node} n
+LEFT JOIN LATERAL (
+    SELECT string_agg(t.tag_name, ' ') AS tag_names
+    FROM {node_tags} nt
+    JOIN {tag} t ON t.id = nt.contenttag_id
+    WHERE nt.contentnode_id = n.id
+) tags ON TRUE
+WHERE n.tree_id = %(tree_id)s
+ON CONFLICT (contentnode_id) DO NOTHING
+"""
+
+
+def update_search_vectors(apps, schema_editor):
+    ContentNode = apps.get_model("contentcuration", "ContentNode")
+    ContentTag = apps.get_model("contentcuration", "ContentTag")
+    ContentNodeSearchVector = apps.get_model("search", "ContentNodeSearchVector")
+    sql = UPDATE_SQL.format(
+        search_vector=ContentNodeSearchVector._meta.db_table,
+        node=ContentNode._meta.db_table,
+        node_tags=ContentNode.tags.through._meta.db_table,
+        tag=ContentTag._meta.db_table,
+        simple_document=DOCUMENT_SQL.format(config="'simple'::regconfig"),
+        language_document=DOCUMENT_SQL.format(config=LANGUAGE_CONFIG_SQL),
+    )
+    tree_ids = list(
+        ContentNode.objects.filter(parent__isnull=True).order_by("tree_id").values_list("tree_id", flat=True)
+    )
+    # Each tree is computed in its own transaction, so that only the rows of one tree are locked at a time
+    for tree_id in tree_ids:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(sql, params={"tree_id": tree_id})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('contentcuration', '0126_channelfacets'),
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentNodeSearchVector',
+            fields=[
+                ('contentnode', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    primary_key=True,
+                    related_name='search',
+                    serialize=False,
+                    to='contentcuration.ContentNode',
+                )),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField()),
+            ],
+        ),
+        # The index is built once the vectors are computed, rather than updated for each of them
+        migrations.RunPython(update_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='contentnodesearchvector',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='contentnode_search_vector_idx'),
+        ),
+    ]
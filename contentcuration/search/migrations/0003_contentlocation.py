@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+from django.db import transaction
+
+import contentcuration.models
+
+# Compute the locations of the content ids in a tree, with the canonical node of each
+# preferring the original source of the content, then the oldest node
+REFRESH_SQL = """
+INSERT INTO {location} (content_id, tree_id, canonical_node_id, is_original, created, location_ids)
+SELECT DISTINCT ON (n.content_id)
+    n.content_id,
+    n.tree_id,
+    n.id,
+    COALESCE(n.original_source_node_id = n.node_id, FALSE) AS is_original,
+    n.created,
+    locations.ids
+FROM {node} n
+JOIN (
+    SELECT content_id, array_agg(id) AS ids
+    FROM {node}
+    WHERE tree_id = %(tree_id)s AND content_id IS NOT NULL
+    GROUP BY content_id
+) locations ON locations.content_id = n.content_id
+WHERE n.tree_id = %(tree_id)s
+ORDER BY n.content_id, is_original DESC, n.created
+ON CONFLICT (content_id, tree_id) DO NOTHING
+"""
+
+
+def refresh_content_locations(apps, schema_editor):
+    Channel = apps.get_model('contentcuration', 'Channel')
+    ContentNode = apps.get_model('contentcuration', 'ContentNode')
+    ContentLocation = apps.get_model('search', 'ContentLocation')
+    sql = REFRESH_SQL.format(
+        location=ContentLocation._meta.db_table,
+        node=ContentNode._meta.db_table,
+    )
+    tree_ids = list(
+        Channel.objects.filter(deleted=False, main_tree__isnull=False)
+        .order_by('main_tree__tree_id')
+        .values_list('main_tree__tree_id', flat=True)
+        .distinct()
+    )
+    # Each tree is computed in its own transaction, so that only the rows of one tree are locked at a time
+    for tree_id in tree_ids:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(sql, params={'tree_id': tree_id})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('contentcuration', '0126_channelfacets'),
+        ('search', '0002_contentnodesearchvector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_id', contentcuration.models.UUIDField(max_length=32)),
+                ('tree_id', models.IntegerField()),
+                ('is_original', models.BooleanField(default=False)),
+                ('created', models.DateTimeField()),
+                ('location_ids', django.contrib.postgres.fields.ArrayField(base_field=contentcuration.models.UUIDField(max_length=32), size=None)),
+                ('canonical_node', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='+',
+                    to='contentcuration.ContentNode',
+                )),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentlocation',
+            unique_together=set([('content_id', 'tree_id')]),
+        ),
+        migrations.RunPython(refresh_content_locations, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,14 @@
 import uuid
 
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
+from contentcuration.models import UUIDField
+
 
 class SavedSearch(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -12,3 +17,45 @@ class SavedSearch(models.Model):
     modified = models.DateTimeField(auto_now=True)
     params = JSONField(default=dict)
     saved_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='searches')
+
+
+CONTENTNODE_SEARCH_VECTOR_INDEX_NAME = "contentnode_search_vector_idx"
+
+
+class ContentNodeSearchVector(models.Model):
+    """
+    The words of a node's title, tags, author, provider and description, for full text search.
+    See search.search_index for how they are kept up to date.
+    """
+    contentnode = models.OneToOneField(
+        "contentcuration.ContentNode", primary_key=True, related_name="search", on_delete=models.CASCADE
+    )
+    search_vector = SearchVectorField()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name=CONTENTNODE_SEARCH_VECTOR_INDEX_NAME),
+        ]
+
+
+class ContentLocation(models.Model):
+    """
+    The nodes of a tree that hold the same content, for showing each content once in search
+    results, with all the places it can be found. See search.content_locations for how
+    they are kept up to date.
+    """
+    content_id = UUIDField()
+    tree_id = models.IntegerField()
+    # The node shown in search results for the content in this tree
+    canonical_node = models.ForeignKey(
+        "contentcuration.ContentNode", related_name="+", on_delete=models.CASCADE
+    )
+    # Whether the canonical node is the original source of the content
+    is_original = models.BooleanField(default=False)
+    # When the canonical node was created
+    created = models.DateTimeField()
+    # The ids of all the nodes of the tree with the content
+    location_ids = ArrayField(UUIDField())
+
+    class Meta:
+        unique_together = ("content_id", "tree_id")
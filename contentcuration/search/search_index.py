@@ -0,0 +1,175 @@
+"""
+Full text search over content nodes, with the words of each node stored as a tsvector
+in ContentNodeSearchVector, behind a GIN index.
+
+The words are stored both as they are and stemmed for the language of the node, so that
+searches match whole words, words that start with the searched words, and other forms
+of the searched words in the language of the search.
+
+Saving a node updates its vector when one of the SEARCH_FIELDS changes. Operations that
+write nodes or tags in bulk, such as copies, syncs and bulk edits, update the vectors
+of the nodes they write.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.db import connection
+from django.db.models import F
+from django.db.models import Func
+from django.db.models import IntegerField
+
+from contentcuration.models import ContentNode
+from contentcuration.models import ContentTag
+from search.models import ContentNodeSearchVector
+
+# Node attributes that its search vector depends on
+SEARCH_FIELDS = ("title", "description", "author", "provider", "language_id")
+
+# Text search configuration for words that are not stemmed
+SIMPLE_CONFIG = "simple"
+
+# Text search configurations that stem words, by language code
+LANGUAGE_CONFIGS = {
+    "da": "danish",
+    "de": "german",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "hu": "hungarian",
+    "it": "italian",
+    "nb": "norwegian",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "tr": "turkish",
+}
+
+# Factor the rank of search results is scaled by, to store it as an integer
+SEARCH_RANK_SCALE = 1000000
+
+word_re = re.compile(r"\w+", re.UNICODE)
+
+# The words of a node, weighted by where they are found, for a text search configuration
+DOCUMENT_SQL = """
+setweight(to_tsvector({config}, COALESCE(n.title, '')), 'A')
+|| setweight(to_tsvector({config}, COALESCE(tags.tag_names, '')), 'B')
+|| setweight(to_tsvector({config}, COALESCE(n.author, '') || ' ' || COALESCE(n.provider, '')), 'C')
+|| setweight(to_tsvector({config}, COALESCE(n.description, '')), 'D')
+"""
+
+# Recompute the search vectors of nodes from their attributes and tags
+UPDATE_SQL = """
+INSERT INTO {search_vector} (contentnode_id, search_vector)
+SELECT
+    n.id,
+    {simple_document} || {language_document}
+FROM {node} n
+LEFT JOIN LATERAL (
+    SELECT string_agg(t.tag_name, ' ') AS tag_names
+    FROM {node_tags} nt
+    JOIN {tag} t ON t.id = nt.contenttag_id
+    WHERE nt.contentnode_id = n.id
+) tags ON TRUE
+WHERE {conditions}
+ON CONFLICT (contentnode_id) DO UPDATE SET search_vector = EXCLUDED.search_vector
+"""
+
+
+def get_language_config(lang_code):
+    """
+    Return the text search configuration for a language code, such as "en" or "pt-BR"
+    """
+    if not lang_code:
+        return SIMPLE_CONFIG
+    return LANGUAGE_CONFIGS.get(re.split(r"[-_]", lang_code)[0].lower(), SIMPLE_CONFIG)
+
+
+def _language_config_sql():
+    cases = " ".join(
+        "WHEN '{}' THEN '{}'".format(code, config) for code, config in sorted(LANGUAGE_CONFIGS.items())
+    )
+    return "(CASE lower(split_part(replace(n.language_id, '_', '-'), '-', 1)) {} ELSE '{}' END)::regconfig".format(
+        cases, SIMPLE_CONFIG
+    )
+
+
+def update_search_vectors(tree_id=None, lft=None, rght=None, node_ids=None):
+    """
+    Recompute the search vectors of the nodes in a tree, or all trees if no tree_id is given,
+    in a single statement. Limited to the subtree between `lft` and `rght`, or the nodes
+    in `node_ids`, if given.
+    """
+    conditions = []
+    params = {}
+    if tree_id is not None:
+        conditions.append("n.tree_id = %(tree_id)s")
+        params["tree_id"] = tree_id
+    if lft is not None and rght is not None:
+        conditions.append("n.lft >= %(lft)s AND n.rght <= %(rght)s")
+        params.update(lft=lft, rght=rght)
+    if node_ids is not None:
+        node_ids = tuple(node_ids)
+        if not node_ids:
+            return
+        conditions.append("n.id IN %(node_ids)s")
+        params["node_ids"] = node_ids
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPDATE_SQL.format(
+                search_vector=ContentNodeSearchVector._meta.db_table,
+                node=ContentNode._meta.db_table,
+                node_tags=ContentNode.tags.through._meta.db_table,
+                tag=ContentTag._meta.db_table,
+                simple_document=DOCUMENT_SQL.format(config="'{}'::regconfig".format(SIMPLE_CONFIG)),
+                language_document=DOCUMENT_SQL.format(config=_language_config_sql()),
+                conditions=" AND ".join(conditions) or "TRUE",
+            ),
+            params,
+        )
+
+
+def update_subtree(node_id):
+    """
+    Compute the search vectors of a subtree that has just been created, such as a copy
+    """
+    node = ContentNode.objects.filter(pk=node_id).values("tree_id", "lft", "rght").first()
+    if node:
+        update_search_vectors(node["tree_id"], node["lft"], node["rght"])
+
+
+class ContentNodeSearchQuery(SearchQuery):
+    """
+    Matches search vectors with words that start with every word of the search, either
+    as they are or stemmed for the language of the search, given as a language code
+    """
+
+    def __init__(self, value, language=None, **extra):
+        self.language_config = get_language_config(language)
+        terms = " & ".join("{}:*".format(word) for word in word_re.findall(value))
+        super(ContentNodeSearchQuery, self).__init__(terms, **extra)
+
+    def as_sql(self, compiler, connection):
+        template = "to_tsquery(%s::regconfig, %s)"
+        params = [SIMPLE_CONFIG, self.value]
+        if self.language_config != SIMPLE_CONFIG:
+            template = "({} || {})".format(template, template)
+            params += [self.language_config, self.value]
+        return template, params
+
+
+def search_rank(search_query):
+    """
+    Expression for how well each node in a queryset matches a search query, as an integer
+    so that it can be compared exactly when paging results by cursor, 0 for nodes without
+    a search vector
+    """
+    return Func(
+        SearchRank(F("search__search_vector"), search_query),
+        template="(COALESCE(%(expressions)s, 0) * {})::integer".format(SEARCH_RANK_SCALE),
+        output_field=IntegerField(),
+    )
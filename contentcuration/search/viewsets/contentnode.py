@@ -1,10 +1,10 @@
-import hashlib
 import re
 
-from django.core.cache import cache
-from django.core.paginator import InvalidPage
+from itertools import chain
+
 from django.db.models import Case
 from django.db.models import CharField
+from django.db.models import Exists
 from django.db.models import F
 from django.db.models import IntegerField
 from django.db.models import OuterRef
@@ -12,13 +12,17 @@ from django.db.models import Q
 from django.db.models import Subquery
 from django.db.models import Value
 from django.db.models import When
+from django.db.models.functions import Coalesce
+from django.utils.translation import get_language
 from django_filters.rest_framework import BooleanFilter
 from django_filters.rest_framework import CharFilter
 from le_utils.constants import content_kinds
 from le_utils.constants import roles
-from rest_framework.pagination import NotFound
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.response import Response
+from search.content_locations import get_canonical_node_ids
+from search.content_locations import get_current_locations
+from search.content_locations import get_location_ids
+from search.search_index import ContentNodeSearchQuery
+from search.search_index import search_rank
 
 from contentcuration.models import Channel
 from contentcuration.models import ContentNode
@@ -28,12 +32,20 @@ from contentcuration.viewsets.common import NotNullMapArrayAgg
 from contentcuration.viewsets.common import SQArrayAgg
 from contentcuration.viewsets.common import SQCount
 from contentcuration.viewsets.contentnode import ContentNodeViewSet
+from contentcuration.viewsets.pagination import CachedCountPagination
 
 
-class ListPagination(PageNumberPagination):
+class ListPagination(CachedCountPagination):
     page_size = 25
     page_size_query_param = "page_size"
     max_page_size = 100
+    keyset_ordering = ("-search_rank", "id")
+
+    def get_count_cache_key(self, request, view):
+        # Keywords are stemmed in the language of the request, so results differ between languages
+        return "{}:{}".format(
+            super(ListPagination, self).get_count_cache_key(request, view), get_language()
+        )
 
     def get_page_number(self, request):
         try:
@@ -41,61 +53,6 @@ class ListPagination(PageNumberPagination):
         except (KeyError, ValueError):
             return 1
 
-    def paginate_queryset(self, queryset, request, view=None):
-        """
-        Overrides paginate_queryset from PageNumberPagination
-        to assign the records count to the paginator.
-        This count has been previously obtained in a less complex query,
-        thus it has a better performance.
-
-        """
-
-        def cached_count(queryset):
-            cache_key = (
-                "query-count:"
-                + hashlib.md5(str(queryset.query).encode("utf8")).hexdigest()
-            )
-            value = cache.get(cache_key)
-            if value is None:
-                value = queryset.values("content_id").count()
-                cache.set(cache_key, value, 300)  # save the count for 5 minutes
-            return value
-
-        page_size = self.get_page_size(request)
-        if not page_size:
-            return None
-
-        paginator = self.django_paginator_class(queryset, page_size)
-        paginator.count = cached_count(queryset)
-        page_number = request.query_params.get(self.page_query_param, 1)
-        if page_number in self.last_page_strings:
-            page_number = paginator.num_pages
-
-        try:
-            self.page = paginator.page(page_number)
-        except InvalidPage as exc:
-            msg = self.invalid_page_message.format(page_number=page_number, message=exc)
-            raise NotFound(msg)
-
-        if paginator.num_pages > 1 and self.template is not None:
-            # The browsable API should display pagination controls.
-            self.display_page_controls = True
-
-        self.request = request
-        return list(self.page)
-
-    def get_paginated_response(self, data):
-        return Response(
-            {
-                "next": self.get_next_link(),
-                "previous": self.get_previous_link(),
-                "page_number": self.page.number,
-                "count": self.page.paginator.count,
-                "total_pages": self.page.paginator.num_pages,
-                "results": data,
-            }
-        )
-
 
 uuid_re = re.compile("([a-f0-9]{32})")
 
@@ -112,23 +69,24 @@ class ContentNodeFilter(RequiredFilterSet):
     created_after = CharFilter(method="filter_created_after")
 
     def filter_keywords(self, queryset, name, value):
-        filter_query = Q(title__icontains=value) | Q(description__icontains=value)
-        tags_node_ids = ContentNode.tags.through.objects.filter(
-            contenttag__tag_name__icontains=value
-        ).values_list("contentnode_id", flat=True)[:250]
+        # Search the title, description, author, provider and tags of the nodes, stemming
+        # the words for the language the search is made in
+        search_query = ContentNodeSearchQuery(value, language=get_language())
+        filter_query = Q(search__search_vector=search_query)
         # Check if we have a Kolibri node id or ids and add them to the search if so.
         # Add to, rather than replace, the filters so that we never misinterpret a search term as a UUID.
-        # node_ids = uuid_re.findall(value) + list(tags_node_ids)
         node_ids = uuid_re.findall(value)
         for node_id in node_ids:
             # check for the major ID types
             filter_query |= Q(node_id=node_id)
             filter_query |= Q(content_id=node_id)
             filter_query |= Q(id=node_id)
-        for node_id in tags_node_ids:
-            filter_query |= Q(id=node_id)
 
-        return queryset.filter(filter_query)
+        return (
+            queryset.filter(filter_query)
+            .annotate(search_rank=search_rank(search_query))
+            .order_by("-search_rank", "id")
+        )
 
     def filter_author(self, queryset, name, value):
         return queryset.filter(
@@ -181,10 +139,13 @@ class ContentNodeFilter(RequiredFilterSet):
 class SearchContentNodeViewSet(ContentNodeViewSet):
     filter_class = ContentNodeFilter
     pagination_class = ListPagination
+    # Results are paged by cursor with ListPagination instead
+    max_results_query_param = None
     values = (
         "id",
         "content_id",
         "node_id",
+        "search_rank",
     )
 
     def paginate_queryset(self, queryset):
@@ -194,9 +155,23 @@ class SearchContentNodeViewSet(ContentNodeViewSet):
         ids = [result["id"] for result in page_results]
         queryset = self._annotate_channel_id(ContentNode.objects.filter(id__in=ids))
         queryset = self.complete_annotations(queryset)
-        return list(queryset.values())
+        # Keep the order of the page, which is ranked for keyword searches
+        results = sorted(queryset.values(), key=lambda node: ids.index(node["id"]))
+        # Content locations are only refreshed on publish, so leave out the nodes that
+        # have since been deleted or moved out of the accessible trees
+        location_ids = set(chain.from_iterable(node["location_ids"] or [] for node in results))
+        accessible_location_ids = set(
+            ContentNode.objects.filter(
+                pk__in=location_ids, tree_id__in=self.get_accessible_tree_ids()
+            ).values_list("id", flat=True)
+        )
+        for node in results:
+            node["location_ids"] = [
+                location_id for location_id in node["location_ids"] or [] if location_id in accessible_location_ids
+            ]
+        return results
 
-    def get_accessible_nodes_queryset(self):
+    def get_accessible_tree_ids(self):
         # jayoshih: May the force be with you, optimizations team...
         user_id = not self.request.user.is_anonymous() and self.request.user.id
 
@@ -217,12 +192,17 @@ class SearchContentNodeViewSet(ContentNodeViewSet):
         if self.request.query_params.get("channels"):
             channel_args.update({"pk__in": self.request.query_params["channels"]})
 
-        return ContentNode.objects.filter(
-            tree_id__in=Channel.objects.filter(deleted=False, **channel_args)
+        return (
+            Channel.objects.filter(deleted=False, **channel_args)
             .exclude(pk=self.request.query_params.get("exclude_channel", ""))
             .values_list("main_tree__tree_id", flat=True)
             .order_by()
             .distinct()
+        )
+
+    def get_accessible_nodes_queryset(self):
+        return ContentNode.objects.filter(
+            tree_id__in=self.get_accessible_tree_ids()
         ).annotate(
             channel_id=Value("", output_field=CharField()),
         )
@@ -235,14 +215,13 @@ class SearchContentNodeViewSet(ContentNodeViewSet):
         1. Do a distinct by 'content_id,' using the original node if possible
         2. Annotate lists of content node and channel pks
         """
-        # Get accessible content nodes that match the content id
-        content_id_query = self.get_accessible_nodes_queryset().filter(
-            content_id=OuterRef("content_id")
-        )
+        tree_ids = self.get_accessible_tree_ids()
 
-        # Combine by unique content id
+        # Content that isn't in the content locations yet, such as content of channels that
+        # haven't been published since it was added, is combined by looking for its nodes
         deduped_content_query = (
-            content_id_query.filter(content_id=OuterRef("content_id"))
+            self.get_accessible_nodes_queryset()
+            .filter(content_id=OuterRef("content_id"))
             .annotate(
                 is_original=Case(
                     When(original_source_node_id=F("node_id"), then=Value(1)),
@@ -252,9 +231,23 @@ class SearchContentNodeViewSet(ContentNodeViewSet):
             )
             .order_by("is_original", "created")
         )
-        queryset = queryset.filter(
-            pk__in=Subquery(deduped_content_query.values_list("id", flat=True)[:1])
-        ).order_by()
+
+        # Combine by unique content id, using the canonical node of each content id in the
+        # content locations where there is one
+        queryset = queryset.annotate(
+            has_location=Exists(
+                get_current_locations(tree_ids).filter(content_id=OuterRef("content_id"))
+            )
+        ).filter(
+            Q(pk__in=get_canonical_node_ids(tree_ids))
+            | Q(has_location=False, pk__in=Subquery(deduped_content_query.values_list("id", flat=True)[:1]))
+        )
+        # Results are all ranked the same without keywords, so that they can be paged by cursor
+        if "search_rank" not in queryset.query.annotations:
+            queryset = queryset.annotate(search_rank=Value(0, output_field=IntegerField()))
+        # Drop the default tree ordering, but keep the ranking of keyword searches
+        if not queryset.query.order_by:
+            queryset = queryset.order_by()
         return queryset
 
     def complete_annotations(self, queryset):
@@ -276,7 +269,11 @@ class SearchContentNodeViewSet(ContentNodeViewSet):
             content_id=OuterRef("content_id")
         )
         queryset = queryset.annotate(
-            location_ids=SQArrayAgg(content_id_query, field="id"),
+            # Only look for the nodes themselves for content that isn't in the content locations yet
+            location_ids=Coalesce(
+                get_location_ids(self.get_accessible_tree_ids()),
+                SQArrayAgg(content_id_query, field="id"),
+            ),
             resource_count=SQCount(descendant_resources, field="id"),
             thumbnail_checksum=Subquery(thumbnails.values("checksum")[:1]),
             thumbnail_extension=Subquery(